@@ -17,7 +17,7 @@ setup(
     platforms=["Linux"],
     packages=find_packages(),
     install_requires=requires("requirements.txt"),
-    extras_require={"dev": requires("dev-requirements.txt")},
+    extras_require={"dev": requires("dev-requirements.txt"), "orjson": ["orjson"]},
     classifiers=[
         "Development Status :: 5 - Production/Stable",
         "License :: OSI Approved :: MIT License",
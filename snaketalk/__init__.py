@@ -8,6 +8,7 @@ from snaketalk.function import (
 from snaketalk.plugins import ExamplePlugin, Plugin, WebHookExample
 from snaketalk.scheduler import schedule
 from snaketalk.settings import Settings
+from snaketalk.utils import Priority
 from snaketalk.wrappers import ActionEvent, Message, WebHookEvent
 
 __all__ = [
@@ -21,6 +22,7 @@ __all__ = [
     "WebHookExample",
     "schedule",
     "Settings",
+    "Priority",
     "ActionEvent",
     "Message",
     "WebHookEvent",
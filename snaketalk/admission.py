@@ -0,0 +1,121 @@
+import logging
+import threading
+from collections import Counter
+from typing import Dict, Optional, Union
+
+from snaketalk.function import Function
+from snaketalk.process_pool import ProcessPool
+from snaketalk.threadpool import ThreadPool
+from snaketalk.utils import Priority
+
+ADMIT = "admit"
+DROP = "drop"
+BUSY = "busy"
+
+
+class AdmissionController:
+    """Decides whether new work should still be accepted, based on how far the pool
+    that would execute it is lagging behind.
+
+    A pool is overloaded once its queue is longer than max_queue_length or its oldest
+    task has waited for longer than max_queue_age seconds. Then, new calls to
+    low-priority functions are dropped and new webhooks are rejected. At twice those
+    limits, normal priority calls are answered with a short "busy" reply instead of
+    being executed. High priority and async functions (which don't use any pool) are
+    always admitted.
+
+    Functions are measured against the pool they run on: the process pool for
+    executor="process", the plugin's own threadpool if it has one and the shared
+    threadpool otherwise. A plugin that falls behind therefore only sheds its own load.
+    Webhooks are measured against the shared threadpool.
+
+    Arguments:
+    - threadpool: the shared ThreadPool of the driver.
+    - max_queue_length: int, number of queued tasks at which to start shedding load.
+    - max_queue_age: float, queue wait time in seconds at which to start shedding load.
+    - process_pool: the ProcessPool of the driver, if any.
+    """
+
+    def __init__(
+        self,
+        threadpool: ThreadPool,
+        max_queue_length: Optional[int] = None,
+        max_queue_age: Optional[float] = None,
+        process_pool: Optional[ProcessPool] = None,
+    ):
+        self.threadpool = threadpool
+        self.process_pool = process_pool
+        self.max_queue_length = max_queue_length
+        self.max_queue_age = max_queue_age
+        # Number of shed events per action, may be updated from the webhook server
+        # thread as well.
+        self._shed = Counter()
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.max_queue_length or self.max_queue_age)
+
+    def get_load_level(self, pool: Union[ThreadPool, ProcessPool, None] = None) -> int:
+        """Returns 0 if the pool is keeping up, 1 if any limit was crossed and 2 if any
+        limit was crossed twice over.
+
+        Arguments:
+        - pool: the ThreadPool or ProcessPool to measure, defaults to the shared
+            threadpool.
+        """
+        if pool is None:
+            pool = self.threadpool
+        load = 0.0
+        if self.max_queue_length:
+            load = pool.get_queue_length() / self.max_queue_length
+        if self.max_queue_age:
+            age = pool.get_queue_age() or 0.0
+            load = max(load, age / self.max_queue_age)
+        return min(int(load), 2)
+
+    def get_pool(self, function: Function) -> Union[ThreadPool, ProcessPool]:
+        """Returns the pool that the given function is executed on."""
+        if getattr(function, "executor", None) == "process" and self.process_pool:
+            return self.process_pool
+        return getattr(function.plugin, "threadpool", None) or self.threadpool
+
+    def admit(self, function: Function) -> str:
+        """Returns ADMIT if the function should be called, DROP if the call should be
+        ignored or BUSY if the user should be told to try again later."""
+        if (
+            not self.enabled
+            or function.is_coroutine
+            or function.priority <= Priority.HIGH
+        ):
+            return ADMIT
+
+        level = self.get_load_level(self.get_pool(function))
+        if level == 0:
+            return ADMIT
+        if function.priority >= Priority.LOW:
+            action = DROP
+        elif level >= 2:
+            action = BUSY
+        else:
+            return ADMIT
+
+        self._record(action, function.name)
+        return action
+
+    def admit_webhook(self) -> bool:
+        """Whether a new webhook should be accepted."""
+        if not self.enabled or self.get_load_level() == 0:
+            return True
+        self._record("webhook", "webhook")
+        return False
+
+    def get_stats(self) -> Dict[str, int]:
+        """Returns the number of shed events per action."""
+        with self._lock:
+            return dict(self._shed)
+
+    def _record(self, action: str, name: str):
+        logging.debug(f"Bot is overloaded, shedding {name} ({action}).")
+        with self._lock:
+            self._shed[action] += 1
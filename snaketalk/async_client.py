@@ -0,0 +1,148 @@
+import asyncio
+import itertools
+import logging
+from typing import Dict, Optional
+from weakref import WeakKeyDictionary
+
+from aiohttp import ClientResponse, ClientSession, ClientTimeout, FormData, TCPConnector
+from mattermostdriver.client import Client
+
+from snaketalk.outbound import RETRY_STATUSES, STATUS_EXCEPTIONS, outbound_priority
+
+
+class _RetryableError(Exception):
+    def __init__(self, status: int, exception: Exception):
+        self.status = status
+        self.exception = exception
+
+
+class AsyncClient:
+    """Asynchronous counterpart of the mattermostdriver Client, which sends its requests
+    through a pooled aiohttp session instead of blocking on `requests`.
+
+    The url, token and SSL settings are taken from the synchronous client, so this
+    client is ready to use as soon as the driver has logged in. One session is kept
+    per event loop, so that its connections can be reused by every coroutine. If the
+    synchronous client has an OutboundScheduler, it is used by this client as well.
+
+    Arguments:
+    - client: the mattermostdriver Client to take the connection settings from.
+    - max_connections: int, maximum number of simultaneous connections per session.
+    """
+
+    def __init__(self, client: Client, max_connections=100):
+        self.client = client
+        self.max_connections = max_connections
+        self.scheduler = getattr(client, "scheduler", None)
+        self._sessions: Dict[
+            asyncio.AbstractEventLoop, ClientSession
+        ] = WeakKeyDictionary()
+
+    @property
+    def session(self) -> ClientSession:
+        """The session belonging to the running event loop."""
+        loop = asyncio.get_running_loop()
+        session = self._sessions.get(loop)
+        if session is None or session.closed:
+            timeout = self.client.request_timeout
+            session = ClientSession(
+                connector=TCPConnector(
+                    limit=self.max_connections,
+                    ssl=None if self.client._verify else False,
+                ),
+                timeout=ClientTimeout(total=timeout) if timeout else ClientTimeout(),
+            )
+            self._sessions[loop] = session
+        return session
+
+    async def close(self):
+        """Closes the session of the running event loop, if there is one."""
+        session = self._sessions.pop(asyncio.get_running_loop(), None)
+        if session is not None:
+            await session.close()
+
+    async def make_request(
+        self,
+        method: str,
+        endpoint: str,
+        options: Optional[Dict] = None,
+        params: Optional[Dict] = None,
+        data=None,
+    ):
+        if self.scheduler is None:
+            return await self._send(method, endpoint, options, params, data)
+
+        priority = outbound_priority.get()
+        # Multipart forms can only be sent once
+        retry = not isinstance(data, FormData)
+        for attempt in itertools.count():
+            await self.scheduler.acquire_async(priority)
+            try:
+                return await self._send(method, endpoint, options, params, data)
+            except _RetryableError as e:
+                if not (retry and self.scheduler.should_retry(e.status, attempt)):
+                    raise e.exception from None
+                delay = self.scheduler.get_backoff(attempt)
+                logging.warning(
+                    f"{method.upper()} {endpoint} failed with status {e.status},"
+                    f" retrying in {delay:.2f}s."
+                )
+                await asyncio.sleep(delay)
+
+    async def _send(
+        self,
+        method: str,
+        endpoint: str,
+        options: Optional[Dict] = None,
+        params: Optional[Dict] = None,
+        data=None,
+    ):
+        response = await self.session.request(
+            method,
+            self.client.url + endpoint,
+            headers=self.client.auth_header(),
+            json=options,
+            params=params,
+            data=data,
+        )
+        async with response:
+            if self.scheduler is not None:
+                self.scheduler.update(response.status, response.headers)
+            try:
+                await self._raise_for_status(response)
+            except Exception as e:
+                if response.status in RETRY_STATUSES:
+                    raise _RetryableError(response.status, e)
+                raise
+            if response.content_type != "application/json":
+                return await response.read()
+            return await response.json()
+
+    async def _raise_for_status(self, response: ClientResponse):
+        if response.status < 400:
+            return
+
+        try:
+            data = await response.json(content_type=None)
+            message = data.get("message", data)
+        except ValueError:
+            message = await response.text()
+        logging.error(message)
+
+        if response.status in STATUS_EXCEPTIONS:
+            raise STATUS_EXCEPTIONS[response.status](message) from None
+        response.raise_for_status()
+
+    async def get(self, endpoint: str, params: Optional[Dict] = None):
+        return await self.make_request("get", endpoint, params=params)
+
+    async def post(
+        self,
+        endpoint: str,
+        options: Optional[Dict] = None,
+        params: Optional[Dict] = None,
+        data=None,
+    ):
+        return await self.make_request(
+            "post", endpoint, options=options, params=params, data=data
+        )
@@ -36,7 +36,15 @@ class Bot:
                 "token": settings.BOT_TOKEN,
                 "scheme": settings.SCHEME,
                 "verify": settings.SSL_VERIFY,
-            }
+            },
+            num_threads=settings.WORKER_THREADS,
+            max_threads=settings.MAX_WORKER_THREADS,
+            num_processes=settings.WORKER_PROCESSES,
+            coalesce_window=settings.COALESCE_WINDOW,
+            max_post_length=settings.MAX_POST_LENGTH,
+            cache_size=settings.CACHE_SIZE,
+            cache_ttl=settings.CACHE_TTL,
+            thread_cache_size=settings.THREAD_CACHE_SIZE,
         )
         self.driver.login()
         self.plugins = self._initialize_plugins(plugins)
@@ -44,6 +52,8 @@ class Bot:
             self.driver, settings=self.settings, plugins=self.plugins
         )
         self.webhook_server = None
+        # The event loop that the websocket runs on, once the bot was started
+        self.loop = None
 
         if self.settings.WEBHOOK_HOST_ENABLED:
             self._initialize_webhook_server()
@@ -55,28 +65,42 @@ class Bot:
 
     def _initialize_webhook_server(self):
         self.webhook_server = WebHookServer(
-            url=self.settings.WEBHOOK_HOST_URL, port=self.settings.WEBHOOK_HOST_PORT
+            url=self.settings.WEBHOOK_HOST_URL,
+            port=self.settings.WEBHOOK_HOST_PORT,
+            admission_check=self.event_handler.admission.admit_webhook,
         )
         self.driver.register_webhook_server(self.webhook_server)
         # Schedule the queue loop to the current event loop so that it starts together
         # with self.init_websocket.
-        asyncio.get_event_loop().create_task(
+        loop = asyncio.get_event_loop()
+        loop.create_task(
             self.event_handler._check_queue_loop(self.webhook_server.event_queue)
         )
+        # In single loop mode, the server itself is started the same way.
+        if self.settings.WEBHOOK_SINGLE_LOOP:
+            loop.create_task(self.webhook_server.start())
 
     def run(self):
         logging.info(f"Starting bot {self.__class__.__name__}.")
+        self.loop = asyncio.get_event_loop()
         try:
+            # Fork the worker processes (if needed) before starting any threads
+            self.driver.process_pool.start()
             self.driver.threadpool.start()
             # Start a thread to run potential scheduled jobs
             self.driver.threadpool.start_scheduler_thread(
                 self.settings.SCHEDULER_PERIOD
             )
             # Start the webhook server on a separate thread if necessary
-            if self.settings.WEBHOOK_HOST_ENABLED:
+            if (
+                self.settings.WEBHOOK_HOST_ENABLED
+                and not self.settings.WEBHOOK_SINGLE_LOOP
+            ):
                 self.driver.threadpool.start_webhook_server_thread(self.webhook_server)
 
             for plugin in self.plugins:
+                if plugin.has_own_threadpool:
+                    plugin.threadpool.start()
                 plugin.on_start()
 
             # Start listening for events
@@ -91,5 +115,32 @@ class Bot:
         # Shutdown the running plugins
         for plugin in self.plugins:
             plugin.on_stop()
-        # Stop the threadpool
+            if plugin.has_own_threadpool:
+                plugin.threadpool.stop()
+        # Stop the process pool and threadpool
+        self.driver.process_pool.stop()
         self.driver.threadpool.stop()
+        # In single loop mode, the webhook server isn't stopped by the threadpool
+        if self.settings.WEBHOOK_SINGLE_LOOP and self.webhook_server:
+            self._stop_webhook_server()
+        # Close the pooled connections of the async client
+        self._close_async_client()
+
+    def _stop_webhook_server(self):
+        loop = self.webhook_server.loop
+        if not self.webhook_server.running or loop.is_closed():
+            return
+        if loop.is_running():
+            asyncio.run_coroutine_threadsafe(self.webhook_server.stop(), loop)
+        else:
+            loop.run_until_complete(self.webhook_server.stop())
+
+    def _close_async_client(self):
+        # The session of the async client belongs to the websocket loop
+        loop = self.loop
+        if loop is None or loop.is_closed():
+            return
+        if loop.is_running():
+            asyncio.run_coroutine_threadsafe(self.driver.async_client.close(), loop)
+        else:
+            loop.run_until_complete(self.driver.async_client.close())
@@ -0,0 +1,342 @@
+import bisect
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Hashable, Iterable, List, Optional, Tuple
+
+
+class TTLCache:
+    """Thread-safe mapping that keeps at most max_size entries, each for at most ttl
+    seconds. The least recently used entries are evicted first.
+
+    Arguments:
+    - max_size: int, maximum number of entries.
+    - ttl: float, number of seconds after which an entry expires.
+    """
+
+    def __init__(self, max_size: int = 1000, ttl: float = 300.0):
+        self.max_size = max_size
+        self.ttl = ttl
+        # Maps each key to (expiry time, value)
+        self._entries: "OrderedDict[Hashable, Tuple[float, Any]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key: Hashable, default=None, count: bool = True):
+        """Returns the value for the key, or the default if it is missing or expired.
+
+        Arguments:
+        - count: bool, whether to count this lookup as a hit or miss.
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] <= time.monotonic():
+                del self._entries[key]
+                entry = None
+            if count:
+                self._record(entry is not None)
+            if entry is None:
+                return default
+            self._entries.move_to_end(key)
+            return entry[1]
+
+    def record(self, hit: bool):
+        """Counts a hit or miss for a lookup that was done with count=False."""
+        with self._lock:
+            self._record(hit)
+
+    def _record(self, hit: bool):
+        if hit:
+            self.hits += 1
+        else:
+            self.misses += 1
+
+    def set(self, key: Hashable, value: Any):
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, key: Optional[Hashable] = None):
+        """Removes the given key, or all entries if no key is given."""
+        with self._lock:
+            if key is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(key, None)
+
+    def get_stats(self) -> Dict[str, int]:
+        return {"hits": self.hits, "misses": self.misses, "size": len(self)}
+
+
+class MetadataCache:
+    """Caches user and channel info, so that it doesn't have to be requested from the
+    server for every message. Channels can be looked up by id or by team and name.
+
+    Entries expire after a while, but are kept up to date in the meantime by the
+    websocket events that the EventHandler passes to `handle_event`.
+
+    Arguments:
+    - max_size: int, maximum number of users and of channels to keep.
+    - ttl: float, number of seconds after which an entry expires.
+    """
+
+    # Websocket events that are relevant to the cache.
+    EVENTS = ("user_updated", "channel_updated", "channel_deleted")
+
+    def __init__(self, max_size: int = 1000, ttl: float = 300.0):
+        self.users = TTLCache(max_size, ttl)
+        self.channels = TTLCache(max_size, ttl)
+        # Maps (team_id, channel name) to channel id
+        self.channel_names = TTLCache(max_size, ttl)
+
+    def get_user(self, user_id: str) -> Optional[Dict]:
+        return self.users.get(user_id)
+
+    def get_users(self, user_ids: Iterable[str]) -> Tuple[Dict[str, Dict], List[str]]:
+        """Returns the cached users by id, and a list of the ids that are missing."""
+        return self._lookup(self.users, user_ids)
+
+    def set_user(self, user: Dict) -> Dict:
+        self.users.set(user["id"], user)
+        return user
+
+    def get_channel(self, channel_id: str) -> Optional[Dict]:
+        return self.channels.get(channel_id)
+
+    def get_channels(
+        self, channel_ids: Iterable[str]
+    ) -> Tuple[Dict[str, Dict], List[str]]:
+        """Returns the cached channels by id, and a list of the ids that are missing."""
+        return self._lookup(self.channels, channel_ids)
+
+    def get_channel_by_name(self, team_id: str, name: str) -> Optional[Dict]:
+        channel_id = self.channel_names.get((team_id, name), count=False)
+        channel = self.channels.get(channel_id, count=False) if channel_id else None
+        # The channel might have been renamed since
+        if channel is not None and channel.get("name") != name:
+            channel = None
+        self.channel_names.record(channel is not None)
+        return channel
+
+    def set_channel(self, channel: Dict) -> Dict:
+        self.channels.set(channel["id"], channel)
+        if channel.get("name"):
+            self.channel_names.set(
+                (channel.get("team_id"), channel["name"]), channel["id"]
+            )
+        return channel
+
+    def invalidate_user(self, user_id: Optional[str] = None):
+        """Removes the given user from the cache, or all users if no id is given."""
+        self.users.invalidate(user_id)
+
+    def invalidate_channel(self, channel_id: Optional[str] = None):
+        """Removes the given channel from the cache, or all channels if no id is
+        given."""
+        self.channels.invalidate(channel_id)
+        if channel_id is None:
+            self.channel_names.invalidate()
+
+    def handle_event(self, event: Dict):
+        """Updates the cache from a (decoded) websocket event."""
+        action = event.get("event")
+        data = event.get("data", {})
+        if action == "user_updated":
+            user = self._merge(self.users, data.get("user"))
+            if user is not None:
+                self.set_user(user)
+        elif action == "channel_updated":
+            channel = self._merge(self.channels, data.get("channel"))
+            if channel is not None:
+                self.set_channel(channel)
+        elif action == "channel_deleted" and data.get("channel_id"):
+            self.invalidate_channel(data["channel_id"])
+
+    def get_stats(self) -> Dict[str, Dict[str, int]]:
+        return {
+            "users": self.users.get_stats(),
+            "channels": self.channels.get_stats(),
+            "channel_names": self.channel_names.get_stats(),
+        }
+
+    @staticmethod
+    def _lookup(cache: TTLCache, keys: Iterable[str]):
+        found, missing = {}, []
+        for key in keys:
+            value = cache.get(key)
+            if value is None:
+                missing.append(key)
+            else:
+                found[key] = value
+        return found, missing
+
+    @staticmethod
+    def _merge(cache: TTLCache, value: Optional[Dict]) -> Optional[Dict]:
+        # Events may contain a sanitized version (e.g. without email address), so
+        # only update the fields they contain, and only for entries we already have.
+        if not isinstance(value, dict) or "id" not in value:
+            return None
+        cached = cache.get(value["id"], count=False)
+        if cached is None:
+            return None
+        return {**cached, **value}
+
+
+class _CachedThread:
+    """The posts of a thread, and their ids sorted by creation time."""
+
+    __slots__ = ("posts", "keys", "extra", "expires_at")
+
+    def __init__(self, thread_info: Dict, expires_at: float):
+        self.posts = dict(thread_info["posts"])
+        self.keys = sorted(
+            (int(post["create_at"]), post_id) for post_id, post in self.posts.items()
+        )
+        # Any other fields of the response, e.g. next_post_id
+        self.extra = {
+            key: value
+            for key, value in thread_info.items()
+            if key not in ("order", "posts")
+        }
+        self.expires_at = expires_at
+
+    def add(self, post: Dict):
+        self.remove(post["id"])
+        self.posts[post["id"]] = post
+        # Replies are almost always the newest post, so this is usually an append.
+        bisect.insort(self.keys, (int(post["create_at"]), post["id"]))
+
+    def remove(self, post_id: str):
+        post = self.posts.pop(post_id, None)
+        if post is not None:
+            key = (int(post["create_at"]), post_id)
+            index = bisect.bisect_left(self.keys, key)
+            if index < len(self.keys) and self.keys[index] == key:
+                del self.keys[index]
+
+    def to_dict(self) -> Dict:
+        return {
+            **self.extra,
+            "order": [post_id for _, post_id in self.keys],
+            "posts": dict(self.posts),
+        }
+
+
+class ThreadCache:
+    """Caches threads (as returned by `Driver.get_thread`) by their root id, and keeps
+    them up to date with the posted, post_edited and post_deleted websocket events, so
+    that a cached thread can be returned without any request.
+
+    The posts of each thread are kept in sorted order, so a new reply is simply
+    inserted rather than re-sorting the entire thread. Every lookup returns a new dict,
+    which callers may modify without affecting the cache.
+
+    Arguments:
+    - max_size: int, maximum number of threads to keep.
+    - ttl: float, number of seconds after which a thread expires, in case we missed
+        any events (e.g. while the websocket was disconnected).
+    """
+
+    EVENTS = ("posted", "post_edited", "post_deleted")
+
+    def __init__(self, max_size: int = 100, ttl: float = 300.0):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._threads: "OrderedDict[str, _CachedThread]" = OrderedDict()
+        # Maps the id of every cached post to the id of its thread
+        self._roots: Dict[str, str] = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self._threads)
+
+    def get(self, post_id: str) -> Optional[Dict]:
+        """Returns the thread that contains the given post, if it is cached."""
+        with self._lock:
+            root_id = self._roots.get(post_id)
+            thread = self._threads.get(root_id) if root_id else None
+            if thread is not None and thread.expires_at <= time.monotonic():
+                self._evict(root_id)
+                thread = None
+            if thread is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._threads.move_to_end(root_id)
+            return thread.to_dict()
+
+    def set(self, post_id: str, thread_info: Dict) -> Dict:
+        """Caches the thread that contains the given post, and returns it in sorted
+        order."""
+        post = thread_info["posts"].get(post_id, {})
+        root_id = post.get("root_id") or post_id
+        thread = _CachedThread(thread_info, time.monotonic() + self.ttl)
+        with self._lock:
+            self._evict(root_id)
+            self._threads[root_id] = thread
+            for id in thread.posts:
+                self._roots[id] = root_id
+            while len(self._threads) > self.max_size:
+                self._evict(next(iter(self._threads)))
+        return thread.to_dict()
+
+    def add_post(self, post: Dict):
+        """Adds a new or edited post to its thread, if that thread is cached."""
+        if not isinstance(post, dict) or "id" not in post:
+            return
+        root_id = post.get("root_id") or post["id"]
+        with self._lock:
+            thread = self._threads.get(root_id)
+            if thread is not None:
+                # Copy the post, since the EventHandler modifies the message text
+                thread.add(dict(post))
+                self._roots[post["id"]] = root_id
+
+    def remove_post(self, post: Dict):
+        """Removes a deleted post from its thread, or the entire thread if it was the
+        root post."""
+        root_id = post.get("root_id")
+        with self._lock:
+            if not root_id:
+                self._evict(post["id"])
+            elif root_id in self._threads:
+                self._threads[root_id].remove(post["id"])
+                self._roots.pop(post["id"], None)
+
+    def invalidate(self, root_id: Optional[str] = None):
+        """Removes the given thread from the cache, or all threads if no id is given."""
+        with self._lock:
+            if root_id is None:
+                self._threads.clear()
+                self._roots.clear()
+            else:
+                self._evict(root_id)
+
+    def handle_event(self, event: Dict):
+        """Updates the cache from a (decoded) websocket event."""
+        post = event.get("data", {}).get("post")
+        if not isinstance(post, dict) or "id" not in post:
+            return
+        if event.get("event") == "post_deleted":
+            self.remove_post(post)
+        else:
+            self.add_post(post)
+
+    def get_stats(self) -> Dict[str, int]:
+        return {"hits": self.hits, "misses": self.misses, "size": len(self)}
+
+    def _evict(self, root_id: str):
+        # Should be called with the lock held.
+        thread = self._threads.pop(root_id, None)
+        if thread is not None:
+            for id in thread.posts:
+                if self._roots.get(id) == root_id:
+                    del self._roots[id]
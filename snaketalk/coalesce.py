@@ -0,0 +1,184 @@
+import asyncio
+import threading
+import time
+from concurrent.futures import Future, wait
+from typing import Awaitable, Callable, Dict, List, Optional, Sequence, Tuple
+
+from snaketalk.utils import in_event_loop
+
+# Default maximum length of a post on Mattermost servers.
+MAX_POST_LENGTH = 16383
+
+
+def split_message(message: str, max_length: int) -> List[str]:
+    """Splits a message into pieces of at most max_length characters, preferably at
+    newlines."""
+    pieces = []
+    while len(message) > max_length:
+        end = message.rfind("\n", 0, max_length + 1)
+        if end <= 0:
+            pieces.append(message[:max_length])
+            message = message[max_length:]
+        else:
+            pieces.append(message[:end])
+            message = message[end + 1 :]
+    pieces.append(message)
+    return pieces
+
+
+class _Batch:
+    """Messages that will be sent together, and the future of the resulting posts."""
+
+    __slots__ = ("messages", "future", "previous", "chunk_of")
+
+    def __init__(self, previous: Optional[Future]):
+        self.messages: List[str] = []
+        self.future = Future()
+        # Future of the previous batch for the same thread, which is sent first.
+        self.previous = previous
+        # For each message, the index of the post it ended up in.
+        self.chunk_of: List[int] = []
+
+
+class PostCoalescer:
+    """Merges posts to the same channel and thread that are created within a short
+    window of each other into a single post.
+
+    The first caller for a (channel_id, root_id) pair waits for the window to pass and
+    then sends all messages that were added in the meantime, joined by the separator.
+    Merged messages that would exceed the maximum post length are spread over several
+    posts. Every caller blocks (or awaits) until its message was sent, and receives the
+    post that contains it.
+
+    Works for both threads and coroutines, and batches for the same thread are sent in
+    order. A synchronous call from a thread that runs an event loop (e.g. a coroutine
+    calling `create_post` rather than `create_post_async`) is sent right away instead,
+    since blocking that thread would stall the loop.
+
+    Arguments:
+    - window: float, number of seconds to wait for more messages.
+    - max_length: int, maximum number of characters in a single post.
+    - separator: str, string to put between merged messages.
+    """
+
+    def __init__(
+        self,
+        window: float,
+        max_length: int = MAX_POST_LENGTH,
+        separator: str = "\n",
+    ):
+        self.window = window
+        self.max_length = max_length
+        self.separator = separator
+        self._lock = threading.Lock()
+        self._batches: Dict[Tuple[str, str], _Batch] = {}
+        # Future of the last batch per thread, until it is sent.
+        self._tails: Dict[Tuple[str, str], Future] = {}
+
+        # Counters
+        self.received = 0
+        self.sent = 0
+
+    def submit(
+        self, channel_id: str, root_id: str, message: str, send: Callable[[str], Dict]
+    ) -> Dict:
+        """Adds a message to the batch for its thread and blocks until it was sent.
+
+        Arguments:
+        - send: function that creates a post with the given text and returns it.
+        """
+        if in_event_loop():
+            # Waiting for the window, or for a batch that a coroutine on this loop is
+            # about to send, would block that loop forever.
+            with self._lock:
+                self.received += 1
+                self.sent += 1
+            return send(message)
+
+        key = (channel_id, root_id)
+        batch, index, leader = self._add(key, message)
+        if leader:
+            try:
+                time.sleep(self.window)
+                if batch.previous is not None:
+                    wait([batch.previous])
+                chunks = self._take(key, batch)
+                batch.future.set_result([send(chunk) for chunk in chunks])
+            except BaseException as e:
+                batch.future.set_exception(e)
+            finally:
+                self._release(key, batch)
+        return batch.future.result()[batch.chunk_of[index]]
+
+    async def submit_async(
+        self,
+        channel_id: str,
+        root_id: str,
+        message: str,
+        send: Callable[[str], Awaitable[Dict]],
+    ) -> Dict:
+        """Awaitable version of `submit`, where send is a coroutine function."""
+        key = (channel_id, root_id)
+        batch, index, leader = self._add(key, message)
+        if leader:
+            try:
+                await asyncio.sleep(self.window)
+                if batch.previous is not None:
+                    await asyncio.wait([asyncio.wrap_future(batch.previous)])
+                chunks = self._take(key, batch)
+                batch.future.set_result([await send(chunk) for chunk in chunks])
+            except BaseException as e:
+                # Also when cancelled, so that the other callers don't wait forever.
+                batch.future.set_exception(e)
+            finally:
+                self._release(key, batch)
+        posts = await asyncio.wrap_future(batch.future)
+        return posts[batch.chunk_of[index]]
+
+    def merge(self, messages: Sequence[str]) -> Tuple[List[str], List[int]]:
+        """Joins the messages into as few posts as possible. Returns the text of each
+        post, and for each message the index of the post it starts in."""
+        chunks: List[str] = []
+        chunk_of = []
+        for message in messages:
+            pieces = split_message(message, self.max_length)
+            if (
+                chunks
+                and len(chunks[-1]) + len(self.separator) + len(pieces[0])
+                <= self.max_length
+            ):
+                chunk_of.append(len(chunks) - 1)
+                chunks[-1] += self.separator + pieces.pop(0)
+            else:
+                chunk_of.append(len(chunks))
+            chunks.extend(pieces)
+        return chunks, chunk_of
+
+    def _add(self, key: Tuple[str, str], message: str) -> Tuple[_Batch, int, bool]:
+        # Returns the batch the message was added to, its index in that batch and
+        # whether the caller should send the batch.
+        with self._lock:
+            self.received += 1
+            batch = self._batches.get(key)
+            leader = batch is None
+            if leader:
+                batch = self._batches[key] = _Batch(self._tails.get(key))
+                self._tails[key] = batch.future
+            batch.messages.append(message)
+            return batch, len(batch.messages) - 1, leader
+
+    def _take(self, key: Tuple[str, str], batch: _Batch) -> List[str]:
+        # Closes the batch, so that new messages start a new one.
+        with self._lock:
+            del self._batches[key]
+            chunks, batch.chunk_of = self.merge(batch.messages)
+            self.sent += len(chunks)
+        return chunks
+
+    def _release(self, key: Tuple[str, str], batch: _Batch):
+        with self._lock:
+            # If the batch failed before it was taken, it is still open.
+            if self._batches.get(key) is batch:
+                del self._batches[key]
+            if self._tails.get(key) is batch.future:
+                del self._tails[key]
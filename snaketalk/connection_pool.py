@@ -0,0 +1,117 @@
+import threading
+import time
+from functools import partial
+from typing import Dict
+
+from requests.adapters import HTTPAdapter
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+from urllib3.exceptions import EmptyPoolError
+
+
+class PoolStats:
+    """Thread-safe counters of how often a connection could be reused (hits), how often
+    a new one had to be opened (misses), how long threads waited for a free one and how
+    often a pool had to grow because none became free in time."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.total_wait_time = 0.0
+        self.max_wait_time = 0.0
+        self.grown = 0
+
+    def record(self, hit: bool, wait_time: float):
+        with self._lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+            self.total_wait_time += wait_time
+            self.max_wait_time = max(self.max_wait_time, wait_time)
+
+    def record_growth(self):
+        with self._lock:
+            self.grown += 1
+
+    def get_stats(self) -> Dict[str, float]:
+        with self._lock:
+            requests = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "mean_wait_time": self.total_wait_time / requests if requests else 0.0,
+                "max_wait_time": self.max_wait_time,
+                "grown": self.grown,
+            }
+
+
+class _InstrumentedPool:
+    # Mixin for urllib3 connection pools that records every connection checkout, and
+    # grows the pool rather than letting a thread wait for more than pool_timeout.
+
+    def __init__(self, *args, stats: PoolStats, pool_timeout: float, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.stats = stats
+        self.pool_timeout = pool_timeout
+
+    def _get_conn(self, timeout=None):
+        start = time.perf_counter()
+        try:
+            conn = super()._get_conn(self.pool_timeout if timeout is None else timeout)
+        except EmptyPoolError:
+            # More threads are sending requests than the pool was sized for (e.g. those
+            # of a plugin's own threadpool), so make room for one more connection.
+            with self.pool.mutex:
+                self.pool.maxsize += 1
+            self.stats.record_growth()
+            conn = self._new_conn()
+        # New and dropped connections have no socket yet, so will have to connect.
+        self.stats.record(
+            hit=getattr(conn, "sock", None) is not None,
+            wait_time=time.perf_counter() - start,
+        )
+        return conn
+
+
+class _InstrumentedHTTPConnectionPool(_InstrumentedPool, HTTPConnectionPool):
+    pass
+
+
+class _InstrumentedHTTPSConnectionPool(_InstrumentedPool, HTTPSConnectionPool):
+    pass
+
+
+class PooledAdapter(HTTPAdapter):
+    """requests adapter that keeps up to pool_size connections per host alive, and
+    makes any additional threads wait for one of those instead of opening (and then
+    throwing away) extra connections.
+
+    The pool should therefore be at least as large as the number of threads that may
+    usually send requests at the same time. If a thread still has to wait for longer
+    than pool_timeout, the pool grows by one connection instead.
+
+    Arguments:
+    - pool_size: int, number of connections to keep per host.
+    - pool_timeout: float, maximum number of seconds to wait for a free connection.
+    """
+
+    def __init__(self, pool_size: int = 10, pool_timeout: float = 1.0):
+        self.stats = PoolStats()
+        self.pool_timeout = pool_timeout
+        super().__init__(pool_maxsize=pool_size, pool_block=True)
+
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {
+            "http": partial(
+                _InstrumentedHTTPConnectionPool,
+                stats=self.stats,
+                pool_timeout=self.pool_timeout,
+            ),
+            "https": partial(
+                _InstrumentedHTTPSConnectionPool,
+                stats=self.stats,
+                pool_timeout=self.pool_timeout,
+            ),
+        }
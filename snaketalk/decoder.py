@@ -0,0 +1,101 @@
+import json
+import re
+from typing import Callable, Dict, Iterable, Optional
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+def get_json_loads(backend: str = "auto") -> Callable:
+    """Returns the `loads` function of the requested JSON backend.
+
+    Arguments:
+    - backend: str, one of "stdlib", "orjson" or "auto". The latter uses orjson if it
+        is installed, and the standard library json module otherwise.
+    """
+    if backend == "auto":
+        backend = "orjson" if orjson is not None else "stdlib"
+
+    if backend == "orjson":
+        if orjson is None:
+            raise ImportError(
+                "The orjson JSON backend was requested, but orjson is not installed!"
+            )
+        return orjson.loads
+    if backend == "stdlib":
+        return json.loads
+
+    raise ValueError(
+        f"Unknown JSON backend {backend}, choose from 'auto', 'stdlib' or 'orjson'."
+    )
+
+
+class EventDecoder:
+    """Decodes raw websocket frames into event dictionaries, but only if they might be
+    of interest to the bot.
+
+    Most frames (typing, status changes, etc.) are rejected with a cheap string search
+    before they are parsed. The JSON strings nested inside events (such as the post of
+    `posted` events) are decoded in the same pass, so they don't have to be parsed again
+    later on.
+
+    Arguments:
+    - events: iterable of str, the event types that should be decoded.
+    - ignore_user_id: str, if provided, new posts by this user (`posted` events) are
+        rejected as well. Edits and deletions of those posts are still decoded.
+    - json_backend: str, see `get_json_loads`.
+    """
+
+    def __init__(
+        self,
+        events: Iterable[str] = ("posted",),
+        ignore_user_id: Optional[str] = None,
+        json_backend: str = "auto",
+    ):
+        self.events = frozenset(events)
+        self.loads = get_json_loads(json_backend)
+        self._event_matcher = re.compile(
+            r'"event"\s*:\s*"({})"'.format("|".join(map(re.escape, self.events)))
+        )
+        # The post itself is a JSON string inside the frame, so its quotes are escaped.
+        # Its user_id is the first one to appear after the start of that string.
+        self._own_post_marker = (
+            f'\\"user_id\\":\\"{ignore_user_id}\\"' if ignore_user_id else None
+        )
+
+        # Counters to keep track of how much work is being saved.
+        self.frames_skipped = 0
+        self.frames_parsed = 0
+
+    def _is_own_post(self, frame: str) -> bool:
+        start = frame.find('"post":"')
+        if start == -1:
+            return False
+        user_id = frame.find('\\"user_id\\":\\"', start)
+        return user_id != -1 and frame.startswith(self._own_post_marker, user_id)
+
+    def decode(self, frame: str) -> Optional[Dict]:
+        """Returns the decoded event, or None if it can be safely ignored."""
+        match = self._event_matcher.search(frame)
+        if not match or (
+            self._own_post_marker
+            and match.group(1) == "posted"
+            and self._is_own_post(frame)
+        ):
+            self.frames_skipped += 1
+            return None
+
+        self.frames_parsed += 1
+        event = self.loads(frame)
+        if event.get("event") not in self.events:
+            return None
+
+        # For some reason these are JSON strings, so need to parse them as well
+        data = event.get("data", {})
+        for item in ["post", "mentions", "channel"]:
+            value = data.get(item)
+            if value and isinstance(value, str):
+                data[item] = self.loads(value)
+        return event
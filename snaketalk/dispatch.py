@@ -0,0 +1,155 @@
+import re
+from typing import Dict, List, Sequence, Tuple
+
+from snaketalk.function import Function
+
+# Characters that have a special meaning in a regexp when they are not escaped.
+_SPECIAL_CHARACTERS = frozenset(".^$*+?{}[]\\|()")
+# Characters that turn the preceding literal into an optional or repeated one.
+_QUANTIFIERS = frozenset("*+?{")
+# Flags that don't change how a literal prefix or the end anchor `$` is matched.
+_INDEXABLE_FLAGS = re.IGNORECASE | re.UNICODE | re.ASCII | re.DOTALL
+
+
+def literal_prefix(pattern: str) -> Tuple[str, bool]:
+    """Returns the literal text that any string matched by `pattern.match` has to start
+    with, and whether the pattern matches exactly that text and nothing else.
+
+    The pattern is parsed conservatively: as soon as anything other than plain or
+    escaped characters is encountered, the prefix collected so far is returned.
+    """
+    # An alternation anywhere might make the prefix optional, e.g. `^busy|jobs$`.
+    if "|" in pattern:
+        return "", False
+
+    prefix = []
+    # re.match only matches at the start of the string, so the ^ is optional.
+    i = 1 if pattern.startswith("^") else 0
+    while i < len(pattern):
+        char = pattern[i]
+        if char == "$":
+            return "".join(prefix), i == len(pattern) - 1
+        if char == "\\":
+            # Only escaped punctuation is literal; \d, \w, \1 etc. are not.
+            if i + 1 == len(pattern):
+                break
+            char = pattern[i + 1]
+            if not char.isascii() or char.isalnum():
+                break
+            i += 1
+        elif char in _SPECIAL_CHARACTERS:
+            break
+
+        # If this character is followed by a quantifier, it is not required.
+        if i + 1 < len(pattern) and pattern[i + 1] in _QUANTIFIERS:
+            break
+        prefix.append(char)
+        i += 1
+
+    return "".join(prefix), False
+
+
+class _TrieNode:
+    __slots__ = ("children", "indices")
+
+    def __init__(self):
+        self.children: Dict[str, _TrieNode] = {}
+        self.indices: List[int] = []
+
+
+class _LiteralIndex:
+    """Hash table of exact literals plus a trie of literal prefixes, both mapping to
+    the indices of the patterns they belong to."""
+
+    def __init__(self):
+        self.exact: Dict[str, List[int]] = {}
+        self.prefixes = _TrieNode()
+
+    def add_exact(self, literal: str, index: int):
+        self.exact.setdefault(literal, []).append(index)
+
+    def add_prefix(self, prefix: str, index: int):
+        node = self.prefixes
+        for char in prefix:
+            node = node.children.setdefault(char, _TrieNode())
+        node.indices.append(index)
+
+    def candidates(self, text: str, found: List[int]):
+        found.extend(self.exact.get(text, ()))
+        # $ also matches right before a trailing newline.
+        if text.endswith("\n"):
+            found.extend(self.exact.get(text[:-1], ()))
+
+        node = self.prefixes
+        for char in text:
+            node = node.children.get(char)
+            if node is None:
+                break
+            found.extend(node.indices)
+
+
+class ListenerIndex:
+    """Index over a dictionary of {regexp: listeners} that finds all regexps matching
+    a piece of text without trying each of them.
+
+    Anchored literals like `^ping$` are stored in a hash table, patterns that start
+    with a literal (e.g. click commands `^command (.*)?`) in a prefix trie, and any
+    other pattern is simply tried on every text. Only the candidates found this way are
+    matched with their actual regexp, so the results are identical to a linear scan.
+
+    Arguments:
+    - listeners: dict, maps compiled regexps to the functions listening to them.
+    """
+
+    def __init__(self, listeners: Dict[re.Pattern, Sequence[Function]]):
+        self.listeners: List[Tuple[re.Pattern, Sequence[Function]]] = list(
+            listeners.items()
+        )
+        self._case_sensitive = _LiteralIndex()
+        # Case-insensitive literals are stored in lowercase, and can only be looked up
+        # for ASCII text (where lowercasing is equivalent to re.IGNORECASE).
+        self._case_insensitive = _LiteralIndex()
+        self._case_insensitive_indices: List[int] = []
+        self._unindexed: List[int] = []
+
+        for index, (matcher, _) in enumerate(self.listeners):
+            self._add(index, matcher)
+
+    def _add(self, index: int, matcher: re.Pattern):
+        prefix, exact = literal_prefix(matcher.pattern)
+        if not prefix or matcher.flags & ~_INDEXABLE_FLAGS:
+            self._unindexed.append(index)
+            return
+
+        literals = self._case_sensitive
+        if matcher.flags & re.IGNORECASE:
+            if not prefix.isascii():
+                self._unindexed.append(index)
+                return
+            literals = self._case_insensitive
+            self._case_insensitive_indices.append(index)
+            prefix = prefix.lower()
+
+        if exact:
+            literals.add_exact(prefix, index)
+        else:
+            literals.add_prefix(prefix, index)
+
+    def match(self, text: str) -> List[Tuple[re.Pattern, Sequence[Function], re.Match]]:
+        """Returns (regexp, listeners, match) for every regexp that matches the given
+        text, in the order in which the regexps were registered."""
+        candidates = list(self._unindexed)
+        self._case_sensitive.candidates(text, candidates)
+        if text.isascii():
+            self._case_insensitive.candidates(text.lower(), candidates)
+        else:
+            candidates.extend(self._case_insensitive_indices)
+
+        results = []
+        # A pattern can't be found twice, but the registration order should be kept.
+        for index in sorted(candidates):
+            matcher, functions = self.listeners[index]
+            match = matcher.match(text)
+            if match:
+                results.append((matcher, functions, match))
+        return results
@@ -1,11 +1,36 @@
+import asyncio
+import logging
 import queue
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
-from typing import Dict, List, Optional, Sequence, Union
+from typing import (
+    AsyncIterator,
+    Callable,
+    Dict,
+    Iterator,
+    List,
+    Optional,
+    Sequence,
+    Union,
+)
 
 import mattermostdriver
 from aiohttp.client import ClientSession
 
+from snaketalk.async_client import AsyncClient
+from snaketalk.cache import MetadataCache, ThreadCache
+from snaketalk.coalesce import MAX_POST_LENGTH, PostCoalescer
+from snaketalk.outbound import ScheduledClient
+from snaketalk.pagination import (
+    ChannelPages,
+    ThreadPages,
+    iterate_pages,
+    iterate_pages_async,
+)
+from snaketalk.process_pool import ProcessPool
+from snaketalk.singleflight import SingleFlight
 from snaketalk.threadpool import ThreadPool
+from snaketalk.uploads import ProgressPayload, ProgressReader, UploadProgress
 from snaketalk.webhook_server import WebHookServer
 from snaketalk.wrappers import Message, WebHookEvent
 
@@ -14,17 +39,65 @@ class Driver(mattermostdriver.Driver):
     user_id: str = ""
     username: str = ""
 
-    def __init__(self, *args, num_threads=10, **kwargs):
+    def __init__(
+        self,
+        *args,
+        num_threads=10,
+        max_threads=None,
+        num_processes=None,
+        coalesce_window=None,
+        max_post_length=MAX_POST_LENGTH,
+        cache_size=1000,
+        cache_ttl=300.0,
+        pool_size=None,
+        thread_cache_size=100,
+        **kwargs,
+    ):
         """Wrapper around the mattermostdriver Driver with some convenience functions
         and attributes.
 
         Arguments:
         - num_threads: int, number of threads to use for the default worker threadpool.
+        - max_threads: int, if larger than num_threads, the threadpool will start extra
+            threads (up to this number) when tasks have to wait for a free worker.
+        - num_processes: int, number of processes in the process pool, which is only
+            started if any functions use it. Defaults to the number of CPUs.
+        - coalesce_window: float, if set, plain posts to the same channel and thread
+            that are created within this many seconds of each other are merged into one.
+        - max_post_length: int, maximum number of characters of a merged post.
+        - cache_size: int, maximum number of users and of channels to cache.
+        - cache_ttl: float, number of seconds to cache user and channel info for.
+        - thread_cache_size: int, maximum number of threads to cache.
+        - pool_size: int, number of connections to the server to keep alive. Defaults
+            to enough for every worker thread, plus the scheduler and webhook threads.
+            The pool grows if other threads (e.g. of plugins with their own
+            threadpool) keep it busy.
         """
+        # Sends all requests through an OutboundScheduler that respects the rate limits
+        # of the server.
+        kwargs.setdefault("client_cls", ScheduledClient)
         super().__init__(*args, **kwargs)
-        self.threadpool = ThreadPool(num_workers=num_threads)
+        self.threadpool = ThreadPool(num_workers=num_threads, max_workers=max_threads)
+        if isinstance(self.client, ScheduledClient):
+            self.client.set_pool_size(
+                pool_size or max(num_threads, max_threads or 0) + 2
+            )
+        self.process_pool = ProcessPool(self, num_processes=num_processes)
+        # Used by the awaitable (*_async) counterparts of the functions below.
+        self.async_client = AsyncClient(self.client)
+        self.coalescer = (
+            PostCoalescer(coalesce_window, max_length=max_post_length)
+            if coalesce_window
+            else None
+        )
+        # User and channel info, kept up to date by the EventHandler
+        self.cache = MetadataCache(max_size=cache_size, ttl=cache_ttl)
+        self.thread_cache = ThreadCache(max_size=thread_cache_size, ttl=cache_ttl)
+        # Lets concurrent identical GET requests share a single call to the server
+        self.single_flight = SingleFlight()
         # Queue to communicate with the WebHookServer
         self.response_queue: Optional[queue.Queue] = None
+        self.webhook_server: Optional[WebHookServer] = None
         self.webhook_url = None
 
     def login(self, *args, **kwargs):
@@ -34,6 +107,7 @@ class Driver(mattermostdriver.Driver):
 
     def register_webhook_server(self, server: WebHookServer):
         self.response_queue = server.response_queue
+        self.webhook_server = server
         self.webhook_url = f"{server.url}:{server.port}/hooks"
 
     def create_post(
@@ -49,63 +123,315 @@ class Driver(mattermostdriver.Driver):
 
         Supports sending ephemeral messages if bot permissions allow it. If any file
         paths are specified, those files will be uploaded to mattermost first and then
-        attached.
+        attached. If post coalescing is enabled, posts without files, props or an
+        ephemeral user may be merged with other posts to the same thread, in which case
+        the merged post is returned once it was created.
         """
+        if self._should_coalesce(file_paths, props, ephemeral_user_id):
+            return self.coalescer.submit(
+                channel_id,
+                root_id,
+                message,
+                lambda text: self._created(
+                    self.posts.create_post(
+                        self._post_options(channel_id, text, [], root_id, {})
+                    )
+                ),
+            )
+
         file_ids = (
             self.upload_files(file_paths, channel_id) if len(file_paths) > 0 else []
         )
+        post = self._post_options(channel_id, message, file_ids, root_id, props)
         if ephemeral_user_id:
             return self.posts.create_ephemeral_post(
-                {
-                    "user_id": ephemeral_user_id,
-                    "post": {
-                        "channel_id": channel_id,
-                        "message": message,
-                        "file_ids": file_ids,
-                        "root_id": root_id,
-                        "props": props,
-                    },
-                }
-            )
-
-        return self.posts.create_post(
-            {
-                "channel_id": channel_id,
-                "message": message,
-                "file_ids": file_ids,
-                "root_id": root_id,
-                "props": props,
-            }
+                {"user_id": ephemeral_user_id, "post": post}
+            )
+
+        return self._created(self.posts.create_post(post))
+
+    async def create_post_async(
+        self,
+        channel_id: str,
+        message: str,
+        file_paths: Sequence[str] = [],
+        root_id: str = "",
+        props: Dict = {},
+        ephemeral_user_id: Optional[str] = None,
+    ):
+        """Awaitable version of `create_post`."""
+        if self._should_coalesce(file_paths, props, ephemeral_user_id):
+
+            async def send(text: str):
+                return self._created(
+                    await self.async_client.post(
+                        "/posts", self._post_options(channel_id, text, [], root_id, {})
+                    )
+                )
+
+            return await self.coalescer.submit_async(channel_id, root_id, message, send)
+
+        file_ids = (
+            await self.upload_files_async(file_paths, channel_id)
+            if len(file_paths) > 0
+            else []
         )
+        post = self._post_options(channel_id, message, file_ids, root_id, props)
+        if ephemeral_user_id:
+            return await self.async_client.post(
+                "/posts/ephemeral", {"user_id": ephemeral_user_id, "post": post}
+            )
+
+        return self._created(await self.async_client.post("/posts", post))
+
+    def _created(self, post: Dict):
+        # Our own posts are filtered out before they reach the EventHandler, so add them
+        # to the thread cache here.
+        self.thread_cache.add_post(post)
+        return post
+
+    def _should_coalesce(
+        self, file_paths: Sequence[str], props: Dict, ephemeral_user_id: Optional[str]
+    ) -> bool:
+        return (
+            self.coalescer is not None
+            and len(file_paths) == 0
+            and not props
+            and not ephemeral_user_id
+        )
+
+    @staticmethod
+    def _post_options(
+        channel_id: str, message: str, file_ids: List[str], root_id: str, props: Dict
+    ):
+        return {
+            "channel_id": channel_id,
+            "message": message,
+            "file_ids": file_ids,
+            "root_id": root_id,
+            "props": props,
+        }
 
     def get_thread(self, post_id: str):
         """Wrapper around driver.posts.get_thread, which for some reason returns
-        duplicate and wrongly ordered entries in the ordered list."""
-        thread_info = self.posts.get_thread(post_id)
-
-        id_stamps = []
-        for id, post in thread_info["posts"].items():
-            id_stamps.append((id, int(post["create_at"])))
-        # Sort the posts by their timestamps
-        sorted_stamps = sorted(id_stamps, key=lambda x: x[-1])
-        # Overwrite the order with the sorted list
-        thread_info["order"] = list([id for id, stamp in sorted_stamps])
+        duplicate and wrongly ordered entries in the ordered list. The thread is
+        cached and kept up to date, see `self.thread_cache`."""
+        thread_info = self.thread_cache.get(post_id)
+        if thread_info is None:
+            thread_info = self.single_flight.do(
+                "/posts/{post_id}/thread",
+                (post_id,),
+                lambda: self.thread_cache.set(post_id, self.posts.get_thread(post_id)),
+            )
+        return thread_info
+
+    async def get_thread_async(self, post_id: str):
+        """Awaitable version of `get_thread`."""
+        thread_info = self.thread_cache.get(post_id)
+        if thread_info is None:
+
+            async def fetch():
+                return self.thread_cache.set(
+                    post_id, await self.async_client.get(f"/posts/{post_id}/thread")
+                )
+
+            thread_info = await self.single_flight.do_async(
+                "/posts/{post_id}/thread", (post_id,), fetch
+            )
         return thread_info
 
+    def iter_thread(self, post_id: str, per_page: int = 100) -> Iterator[Dict]:
+        """Yields the posts of the thread that contains the given post, from oldest to
+        newest. The posts are requested per_page at a time, and the next page is
+        requested while the current one is being processed."""
+        return iterate_pages(
+            ThreadPages(post_id, per_page),
+            lambda endpoint, params: self.client.get(endpoint, params=params),
+        )
+
+    def iter_thread_async(
+        self, post_id: str, per_page: int = 100
+    ) -> AsyncIterator[Dict]:
+        """Async generator version of `iter_thread`."""
+        return iterate_pages_async(
+            ThreadPages(post_id, per_page), self.async_client.get
+        )
+
+    def iter_channel_posts(
+        self, channel_id: str, per_page: int = 100
+    ) -> Iterator[Dict]:
+        """Yields the posts of the given channel, from newest to oldest. The posts are
+        requested per_page at a time, and the next page is requested while the current
+        one is being processed."""
+        return iterate_pages(
+            ChannelPages(channel_id, per_page),
+            lambda endpoint, params: self.client.get(endpoint, params=params),
+        )
+
+    def iter_channel_posts_async(
+        self, channel_id: str, per_page: int = 100
+    ) -> AsyncIterator[Dict]:
+        """Async generator version of `iter_channel_posts`."""
+        return iterate_pages_async(
+            ChannelPages(channel_id, per_page), self.async_client.get
+        )
+
     def get_user_info(self, user_id: str):
-        """Returns a dictionary of user info."""
-        return self.users.get_user(user_id)
+        """Returns a dictionary of user info. The result is cached, see `self.cache`."""
+        user = self.cache.get_user(user_id)
+        if user is None:
+            user = self.single_flight.do(
+                "/users/{user_id}",
+                (user_id,),
+                lambda: self.cache.set_user(self.users.get_user(user_id)),
+            )
+        return user
+
+    async def get_user_info_async(self, user_id: str):
+        """Awaitable version of `get_user_info`."""
+        user = self.cache.get_user(user_id)
+        if user is None:
+
+            async def fetch():
+                return self.cache.set_user(
+                    await self.async_client.get(f"/users/{user_id}")
+                )
+
+            user = await self.single_flight.do_async(
+                "/users/{user_id}", (user_id,), fetch
+            )
+        return user
+
+    def get_users_info(self, user_ids: Sequence[str]) -> Dict[str, Dict]:
+        """Returns the user info of all given users by id. Users that aren't cached
+        are requested in a single call."""
+        users, missing = self.cache.get_users(user_ids)
+        if missing:
+            self._cache_users(users, self.users.get_users_by_ids(missing))
+        return users
+
+    async def get_users_info_async(self, user_ids: Sequence[str]) -> Dict[str, Dict]:
+        """Awaitable version of `get_users_info`."""
+        users, missing = self.cache.get_users(user_ids)
+        if missing:
+            self._cache_users(
+                users, await self.async_client.post("/users/ids", missing)
+            )
+        return users
+
+    def _cache_users(self, users: Dict[str, Dict], fetched: Sequence[Dict]):
+        for user in fetched:
+            self.cache.set_user(user)
+            users[user["id"]] = user
+
+    def get_channel_info(self, channel_id: str):
+        """Returns a dictionary of channel info. The result is cached, see
+        `self.cache`."""
+        channel = self.cache.get_channel(channel_id)
+        if channel is None:
+            channel = self.single_flight.do(
+                "/channels/{channel_id}",
+                (channel_id,),
+                lambda: self.cache.set_channel(self.channels.get_channel(channel_id)),
+            )
+        return channel
+
+    async def get_channel_info_async(self, channel_id: str):
+        """Awaitable version of `get_channel_info`."""
+        channel = self.cache.get_channel(channel_id)
+        if channel is None:
+
+            async def fetch():
+                return self.cache.set_channel(
+                    await self.async_client.get(f"/channels/{channel_id}")
+                )
+
+            channel = await self.single_flight.do_async(
+                "/channels/{channel_id}", (channel_id,), fetch
+            )
+        return channel
+
+    def get_channel_by_name(self, team_id: str, channel_name: str):
+        """Returns the channel info of the channel with the given name in the given
+        team. The result is cached, see `self.cache`."""
+        channel = self.cache.get_channel_by_name(team_id, channel_name)
+        if channel is None:
+            channel = self.single_flight.do(
+                "/teams/{team_id}/channels/name/{channel_name}",
+                (team_id, channel_name),
+                lambda: self.cache.set_channel(
+                    self.channels.get_channel_by_name(team_id, channel_name)
+                ),
+            )
+        return channel
+
+    async def get_channel_by_name_async(self, team_id: str, channel_name: str):
+        """Awaitable version of `get_channel_by_name`."""
+        channel = self.cache.get_channel_by_name(team_id, channel_name)
+        if channel is None:
+
+            async def fetch():
+                return self.cache.set_channel(
+                    await self.async_client.get(
+                        f"/teams/{team_id}/channels/name/{channel_name}"
+                    )
+                )
+
+            channel = await self.single_flight.do_async(
+                "/teams/{team_id}/channels/name/{channel_name}",
+                (team_id, channel_name),
+                fetch,
+            )
+        return channel
+
+    def get_channels_info(
+        self, channel_ids: Sequence[str], team_id: str
+    ) -> Dict[str, Dict]:
+        """Returns the channel info of all given (public) channels of a team by id.
+        Channels that aren't cached are requested in a single call."""
+        channels, missing = self.cache.get_channels(channel_ids)
+        if missing:
+            self._cache_channels(
+                channels, self.channels.get_list_of_channels_by_ids(team_id, missing)
+            )
+        return channels
+
+    async def get_channels_info_async(
+        self, channel_ids: Sequence[str], team_id: str
+    ) -> Dict[str, Dict]:
+        """Awaitable version of `get_channels_info`."""
+        channels, missing = self.cache.get_channels(channel_ids)
+        if missing:
+            self._cache_channels(
+                channels,
+                await self.async_client.post(f"/teams/{team_id}/channels/ids", missing),
+            )
+        return channels
+
+    def _cache_channels(self, channels: Dict[str, Dict], fetched: Sequence[Dict]):
+        for channel in fetched:
+            self.cache.set_channel(channel)
+            channels[channel["id"]] = channel
 
     def react_to(self, message: Message, emoji_name: str):
         """Adds an emoji reaction to the given message."""
         return self.reactions.create_reaction(
-            {
-                "user_id": self.user_id,
-                "post_id": message.id,
-                "emoji_name": emoji_name,
-            },
+            self._reaction_options(message, emoji_name)
+        )
+
+    async def react_to_async(self, message: Message, emoji_name: str):
+        """Awaitable version of `react_to`."""
+        return await self.async_client.post(
+            "/reactions", self._reaction_options(message, emoji_name)
         )
 
+    def _reaction_options(self, message: Message, emoji_name: str):
+        return {
+            "user_id": self.user_id,
+            "post_id": message.id,
+            "emoji_name": emoji_name,
+        }
+
     def reply_to(
         self,
         message: Message,
@@ -119,27 +445,43 @@ class Driver(mattermostdriver.Driver):
         Supports sending ephemeral messages if the bot permissions allow it. If the
         message is part of a thread, the reply will be added to that thread.
         """
-        if ephemeral:
-            return self.create_post(
-                channel_id=message.channel_id,
-                message=response,
-                root_id=message.reply_id,
-                file_paths=file_paths,
-                props=props,
-                ephemeral_user_id=message.user_id,
-            )
-
         return self.create_post(
-            channel_id=message.channel_id,
-            message=response,
-            root_id=message.reply_id,
-            file_paths=file_paths,
-            props=props,
+            **self._reply_options(message, response, file_paths, props, ephemeral)
+        )
+
+    async def reply_to_async(
+        self,
+        message: Message,
+        response: str,
+        file_paths: Sequence[str] = [],
+        props: Dict = {},
+        ephemeral: bool = False,
+    ):
+        """Awaitable version of `reply_to`."""
+        return await self.create_post_async(
+            **self._reply_options(message, response, file_paths, props, ephemeral)
         )
 
+    @staticmethod
+    def _reply_options(
+        message: Message,
+        response: str,
+        file_paths: Sequence[str],
+        props: Dict,
+        ephemeral: bool,
+    ):
+        return {
+            "channel_id": message.channel_id,
+            "message": response,
+            "root_id": message.reply_id,
+            "file_paths": file_paths,
+            "props": props,
+            "ephemeral_user_id": message.user_id if ephemeral else None,
+        }
+
     def respond_to_web(self, event: WebHookEvent, response):
         """Send a web response to the given WebHookEvent."""
-        self.response_queue.put((event.request_id, response))
+        self.webhook_server.respond(event.request_id, response)
         event.responded = True
 
     async def trigger_own_webhook(self, webhook_id: str, data: Dict):
@@ -154,14 +496,91 @@ class Driver(mattermostdriver.Driver):
             )
 
     def upload_files(
-        self, file_paths: Sequence[Union[str, Path]], channel_id: str
+        self,
+        file_paths: Sequence[Union[str, Path]],
+        channel_id: str,
+        max_concurrency: int = 4,
+        progress: Optional[Callable[[UploadProgress], None]] = None,
     ) -> List[str]:
         """Given a list of file paths and the channel id, uploads the corresponding
-        files and returns a list their internal file IDs."""
-        file_dict = {}
-        for path in file_paths:
-            path = Path(path)
-            file_dict[path.name] = Path(path).read_bytes()
-
-        result = self.files.upload_file(channel_id, file_dict)
-        return list(info["id"] for info in result["file_infos"])
+        files and returns a list their internal file IDs.
+
+        Each file is streamed from disk in a separate request, rather than read into
+        memory first, and up to max_concurrency files are uploaded at the same time.
+
+        Arguments:
+        - max_concurrency: int, maximum number of files to upload in parallel.
+        - progress: function that is called with an UploadProgress (containing the
+            number of bytes sent and the throughput) whenever a chunk of a file was
+            sent. May be called from several threads.
+        """
+        if len(file_paths) <= 1:
+            return [
+                self._upload_file(path, channel_id, progress) for path in file_paths
+            ]
+
+        # Not the driver threadpool, since the caller might be one of its workers.
+        with ThreadPoolExecutor(min(max_concurrency, len(file_paths))) as executor:
+            return list(
+                executor.map(
+                    lambda path: self._upload_file(path, channel_id, progress),
+                    file_paths,
+                )
+            )
+
+    def _upload_file(
+        self,
+        path: Union[str, Path],
+        channel_id: str,
+        progress: Optional[Callable[[UploadProgress], None]],
+    ) -> str:
+        path = Path(path)
+        with path.open("rb") as file:
+            reader = ProgressReader(file, path.name, progress)
+            result = self.client.post(
+                "/files",
+                params={"channel_id": channel_id, "filename": path.name},
+                data=reader,
+            )
+        self._log_upload(reader.progress)
+        return result["file_infos"][0]["id"]
+
+    async def upload_files_async(
+        self,
+        file_paths: Sequence[Union[str, Path]],
+        channel_id: str,
+        max_concurrency: int = 4,
+        progress: Optional[Callable[[UploadProgress], None]] = None,
+    ) -> List[str]:
+        """Awaitable version of `upload_files`."""
+        semaphore = asyncio.Semaphore(max_concurrency)
+
+        async def upload(path: Union[str, Path]):
+            async with semaphore:
+                return await self._upload_file_async(path, channel_id, progress)
+
+        return list(await asyncio.gather(*[upload(path) for path in file_paths]))
+
+    async def _upload_file_async(
+        self,
+        path: Union[str, Path],
+        channel_id: str,
+        progress: Optional[Callable[[UploadProgress], None]],
+    ) -> str:
+        path = Path(path)
+        with path.open("rb") as file:
+            reader = ProgressReader(file, path.name, progress)
+            result = await self.async_client.post(
+                "/files",
+                params={"channel_id": channel_id, "filename": path.name},
+                data=ProgressPayload(reader),
+            )
+        self._log_upload(reader.progress)
+        return result["file_infos"][0]["id"]
+
+    @staticmethod
+    def _log_upload(progress: UploadProgress):
+        logging.debug(
+            f"Uploaded {progress.filename} ({progress.total} bytes) in"
+            f" {progress.elapsed:.2f}s ({progress.throughput / 1e6:.2f} MB/s)."
+        )
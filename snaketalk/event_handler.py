@@ -1,14 +1,19 @@
-import asyncio
-import json
 import logging
-import queue
 import re
 from collections import defaultdict
 from typing import Sequence
 
+from snaketalk.admission import ADMIT, BUSY, AdmissionController
+from snaketalk.cache import MetadataCache, ThreadCache
+from snaketalk.decoder import EventDecoder
+from snaketalk.dispatch import ListenerIndex
 from snaketalk.driver import Driver
 from snaketalk.plugins import Plugin
+from snaketalk.plugins.base import BUSY_MESSAGE
+from snaketalk.ratelimit import RateLimiter
 from snaketalk.settings import Settings
+from snaketalk.supervisor import TaskSupervisor
+from snaketalk.utils import AsyncQueue
 from snaketalk.webhook_server import NoResponse
 from snaketalk.wrappers import Message, WebHookEvent
 
@@ -29,6 +34,12 @@ class EventHandler(object):
         self.plugins = plugins
 
         self._name_matcher = re.compile(rf"^@?{self.driver.username}\:?\s?")
+        # Rejects irrelevant websocket frames (and maybe our own new posts) unparsed
+        self.decoder = EventDecoder(
+            events=[*ThreadCache.EVENTS, *MetadataCache.EVENTS],
+            ignore_user_id=self.driver.user_id if ignore_own_messages else None,
+            json_backend=settings.JSON_BACKEND,
+        )
 
         # Collect the listeners from all plugins
         self.message_listeners = defaultdict(list)
@@ -38,6 +49,27 @@ class EventHandler(object):
                 self.message_listeners[matcher].extend(functions)
             for matcher, functions in plugin.webhook_listeners.items():
                 self.webhook_listeners[matcher].extend(functions)
+        # Index the message listeners so we don't have to try every regexp on every
+        # incoming message.
+        self._message_index = ListenerIndex(self.message_listeners)
+        # Runs the listener functions, at most MAX_LISTENER_TASKS at the same time
+        self.supervisor = TaskSupervisor(max_tasks=settings.MAX_LISTENER_TASKS)
+        # Limits how often each user and channel can trigger the bot
+        self._user_rate_limiter = (
+            RateLimiter(settings.USER_RATE_LIMIT) if settings.USER_RATE_LIMIT else None
+        )
+        self._channel_rate_limiter = (
+            RateLimiter(settings.CHANNEL_RATE_LIMIT)
+            if settings.CHANNEL_RATE_LIMIT
+            else None
+        )
+        # Sheds load when the threadpools or process pool can't keep up
+        self.admission = AdmissionController(
+            self.driver.threadpool,
+            max_queue_length=settings.SHED_QUEUE_LENGTH,
+            max_queue_age=settings.SHED_QUEUE_AGE,
+            process_pool=getattr(self.driver, "process_pool", None),
+        )
 
     def start(self):
         # This is blocking, will loop forever
@@ -52,27 +84,44 @@ class EventHandler(object):
             else False
         ) or (self.ignore_own_messages and message.sender_name == self.driver.username)
 
-    async def _check_queue_loop(self, webhook_queue: queue.Queue):
+    def _is_rate_limited(self, message: Message):
+        # Check the limits of the sender first, so a spamming user doesn't use up the
+        # quota of the entire channel.
+        for limiter, key in [
+            (self._user_rate_limiter, message.user_id),
+            (self._channel_rate_limiter, message.channel_id),
+        ]:
+            if limiter is not None and not limiter.allow(key):
+                logging.debug(f"Rate limit exceeded, ignoring message {message.id}.")
+                return True
+        return False
+
+    async def _check_queue_loop(self, webhook_queue: AsyncQueue):
         logging.info("EventHandlerWebHook queue listener started.")
         while True:
-            try:
-                event = webhook_queue.get_nowait()
-                await self._handle_webhook(event)
-            except queue.Empty:
-                pass
-            await asyncio.sleep(0.0001)
+            event = await webhook_queue.get_async()
+            await self._handle_webhook(event)
 
     async def _handle_event(self, data):
-        post = json.loads(data)
+        post = self.decoder.decode(data)
+        if post is None:
+            return
+
         event_action = post.get("event")
+        if event_action in ThreadCache.EVENTS:
+            self.driver.thread_cache.handle_event(post)
         if event_action == "posted":
             await self._handle_post(post)
+        elif event_action in MetadataCache.EVENTS:
+            self.driver.cache.handle_event(post)
 
     async def _handle_post(self, post):
-        # For some reason these are JSON strings, so need to parse them first
+        # For some reason these are JSON strings, so need to parse them first (unless
+        # the decoder already did so).
         for item in ["post", "mentions"]:
-            if post.get("data", {}).get(item):
-                post["data"][item] = json.loads(post["data"][item])
+            value = post.get("data", {}).get(item)
+            if value and isinstance(value, str):
+                post["data"][item] = self.decoder.loads(value)
 
         # If the post starts with a mention of this bot, strip off that part.
         post["data"]["post"]["message"] = self._name_matcher.sub(
@@ -82,43 +131,64 @@ class EventHandler(object):
         if self._should_ignore(message):
             return
 
-        # Find all the listeners that match this message, and have their plugins handle
-        # the rest.
-        tasks = []
-        for matcher, functions in self.message_listeners.items():
-            match = matcher.match(message.text)
-            if match:
-                groups = list([group for group in match.groups() if group != ""])
-                for function in functions:
-                    # Create an asyncio task to handle this callback
-                    tasks.append(
-                        asyncio.create_task(
-                            function.plugin.call_function(
-                                function, message, groups=groups
-                            )
-                        )
+        # Find all the listeners that match this message and should respond to it.
+        candidates = []
+        for matcher, functions, match in self._message_index.match(message.text):
+            groups = list([group for group in match.groups() if group != ""])
+            for function in functions:
+                # Filter out messages this function shouldn't respond to before
+                # scheduling anything.
+                if function.has_restrictions and not function.should_respond(message):
+                    continue
+                candidates.append((function, groups))
+
+        # Only messages that would actually trigger something count towards the rate
+        # limits, so regular conversations don't use up anyone's quota.
+        if not candidates or self._is_rate_limited(message):
+            return
+
+        # Have the plugins of the listeners handle the rest
+        for function, groups in candidates:
+            if function.is_rate_limited(message):
+                continue
+
+            if function.has_restrictions and not function.is_allowed(message):
+                self.driver.threadpool.add_task(
+                    function.reply_permission_denied, message
+                )
+                continue
+
+            # If the bot is overloaded, skip this function or send a cheap reply
+            admission = self.admission.admit(function)
+            if admission != ADMIT:
+                if admission == BUSY:
+                    await self.supervisor.spawn(
+                        self.driver.reply_to_async(message, BUSY_MESSAGE),
+                        name="busy_reply",
                     )
-        # Execute the callbacks in parallel
-        asyncio.gather(*tasks)
+                continue
+
+            # Create an asyncio task to handle this callback. If too many are running
+            # already, this waits (and so do any new events).
+            await self.supervisor.spawn(
+                function.plugin.call_function(function, message, groups=groups),
+                name=function.name,
+            )
 
     async def _handle_webhook(self, event: WebHookEvent):
         # Find all the listeners that match this webhook id, and have their plugins
         # handle the rest.
-        tasks = []
+        matched_functions = []
         for matcher, functions in self.webhook_listeners.items():
-            match = matcher.match(event.webhook_id)
-            if match:
-                for function in functions:
-                    # Create an asyncio task to handle this callback
-                    tasks.append(
-                        asyncio.create_task(
-                            function.plugin.call_function(function, event)
-                        )
-                    )
+            if matcher.match(event.webhook_id):
+                matched_functions.extend(functions)
+
         # If this webhook doesn't correspond to any listeners, signal the WebHookServer
         # to not wait for any response
-        if len(tasks) == 0:
+        if len(matched_functions) == 0:
             self.driver.respond_to_web(event, NoResponse)
         # If it does, execute the callbacks in parallel
-        else:
-            asyncio.gather(*tasks)
+        for function in matched_functions:
+            await self.supervisor.spawn(
+                function.plugin.call_function(function, event), name=function.name
+            )
@@ -5,20 +5,34 @@ import inspect
 import logging
 import re
 from abc import ABC, abstractmethod
-from typing import Callable, Optional, Sequence
+from typing import Callable, Optional, Sequence, Tuple
 
 import click
 
-from snaketalk.utils import completed_future, spaces
+from snaketalk.ratelimit import RateLimiter
+from snaketalk.utils import Priority, completed_future, spaces
 from snaketalk.webhook_server import NoResponse
 from snaketalk.wrappers import Message, WebHookEvent
 
 
+def message_key(message: Message, key: Optional[str]) -> Optional[str]:
+    """Returns the channel id, thread (root) id or user id of the message, depending on
+    the key."""
+    if key == "channel":
+        return message.channel_id
+    if key == "root_id":
+        return message.reply_id
+    if key == "user":
+        return message.user_id
+    return None
+
+
 class Function(ABC):
     def __init__(
         self,
         function: Callable,
         matcher: re.Pattern,
+        priority: int = Priority.NORMAL,
     ):
         # If another Function was passed, keep track of all these siblings.
         # We later use them to register not only the outermost Function, but also any
@@ -31,6 +45,8 @@ class Function(ABC):
         self.function = function
         self.is_coroutine = asyncio.iscoroutinefunction(function)
         self.matcher = matcher
+        # Priority in the threadpool, only relevant for regular (non-async) functions.
+        self.priority = priority
 
         # To be set in the child class or from the parent plugin
         self.plugin = None
@@ -59,6 +75,13 @@ class MessageFunction(Function):
         direct_only: bool = False,
         needs_mention: bool = False,
         allowed_users: Sequence[str] = [],
+        executor: Optional[str] = None,
+        serialize_by: Optional[str] = None,
+        max_concurrency: Optional[int] = None,
+        timeout: Optional[float] = None,
+        overflow: str = "queue",
+        rate_limit: Optional[Tuple[int, float]] = None,
+        rate_limit_by: str = "user",
         **kwargs,
     ):
         super().__init__(*args, **kwargs)
@@ -67,6 +90,45 @@ class MessageFunction(Function):
         self.direct_only = direct_only
         self.needs_mention = needs_mention
         self.allowed_users = [user.lower() for user in allowed_users]
+        # Precomputed so that the EventHandler can skip the checks below for the
+        # (common) case where a function has no restrictions at all.
+        self.has_restrictions = bool(direct_only or needs_mention or allowed_users)
+        self._allowed_users = frozenset(self.allowed_users)
+
+        # If None, the executor of the plugin will be used.
+        if executor not in (None, "thread", "process"):
+            raise ValueError(
+                f"Unknown executor {executor}, choose from 'thread' or 'process'."
+            )
+        if executor == "process" and self.is_coroutine:
+            raise ValueError(
+                "Coroutines are executed on the event loop, so they can't be executed"
+                " in the process pool!"
+            )
+        self.executor = executor
+
+        if serialize_by not in (None, "channel", "root_id", "user"):
+            raise ValueError(
+                f"Can't serialize by {serialize_by}, choose from 'channel', 'root_id'"
+                " or 'user'."
+            )
+        self.serialize_by = serialize_by
+
+        if overflow not in ("queue", "drop", "busy"):
+            raise ValueError(
+                f"Unknown overflow behaviour {overflow}, choose from 'queue', 'drop' or"
+                " 'busy'."
+            )
+        self.max_concurrency = max_concurrency
+        self.timeout = timeout
+        self.overflow = overflow
+
+        if rate_limit_by not in ("channel", "user"):
+            raise ValueError(
+                f"Can't rate limit by {rate_limit_by}, choose from 'channel' or 'user'."
+            )
+        self.rate_limit_by = rate_limit_by
+        self.rate_limiter = RateLimiter(rate_limit) if rate_limit else None
 
         if self.is_click_function:
             _function = self.function.callback
@@ -103,18 +165,11 @@ class MessageFunction(Function):
         return_value = None if not self.is_coroutine else completed_future()
 
         # Check if this message meets our requirements
-        if self.direct_only and not message.is_direct_message:
+        if not self.should_respond(message):
             return return_value
 
-        if self.needs_mention and not (
-            message.is_direct_message or self.plugin.driver.user_id in message.mentions
-        ):
-            return return_value
-
-        if self.allowed_users and message.sender_name not in self.allowed_users:
-            self.plugin.driver.reply_to(
-                message, "You do not have permission to perform this action!"
-            )
+        if not self.is_allowed(message):
+            self.reply_permission_denied(message)
             return return_value
 
         if self.is_click_function:
@@ -135,6 +190,44 @@ class MessageFunction(Function):
 
         return self.function(self.plugin, message, *args)
 
+    def should_respond(self, message: Message) -> bool:
+        """Whether the message meets the direct_only and needs_mention requirements.
+
+        Messages that don't are silently ignored.
+        """
+        if self.direct_only and not message.is_direct_message:
+            return False
+
+        if self.needs_mention and not (
+            message.is_direct_message or self.plugin.driver.user_id in message.mentions
+        ):
+            return False
+
+        return True
+
+    def serialization_key(self, message: Message) -> Optional[str]:
+        """Messages with the same key are handled one at a time, in order of arrival.
+
+        Returns None if this function doesn't need to be serialized.
+        """
+        return message_key(message, self.serialize_by)
+
+    def is_rate_limited(self, message: Message) -> bool:
+        """Whether the rate limit of this function was exceeded by the channel or user
+        this message came from. Consumes a token otherwise."""
+        if self.rate_limiter is None:
+            return False
+        return not self.rate_limiter.allow(message_key(message, self.rate_limit_by))
+
+    def is_allowed(self, message: Message) -> bool:
+        """Whether the sender of the message is allowed to call this function."""
+        return not self._allowed_users or message.sender_name in self._allowed_users
+
+    def reply_permission_denied(self, message: Message):
+        return self.plugin.driver.reply_to(
+            message, "You do not have permission to perform this action!"
+        )
+
     def get_help_string(self):
         string = super().get_help_string()
         if any(
@@ -167,9 +260,42 @@ def listen_to(
     direct_only=False,
     needs_mention=False,
     allowed_users=[],
+    priority: int = Priority.NORMAL,
+    executor: Optional[str] = None,
+    serialize_by: Optional[str] = None,
+    max_concurrency: Optional[int] = None,
+    timeout: Optional[float] = None,
+    overflow: str = "queue",
+    rate_limit: Optional[Tuple[int, float]] = None,
+    rate_limit_by: str = "user",
 ):
     """Wrap the given function in a MessageFunction class so we can register some
-    properties."""
+    properties.
+
+    The priority determines how soon the function is executed when all workers of the
+    threadpool are busy. Quick interactive commands could use Priority.HIGH, while
+    heavy ones could use Priority.LOW so they don't delay anything else.
+
+    CPU-bound functions can use executor="process" to run in the process pool of the
+    driver instead, so that they don't hold up other functions. Only the message and
+    regexp groups are sent to the worker process, and any calls to `self.driver` are
+    executed by the main process. If no executor is specified, that of the plugin is
+    used ("thread" by default).
+
+    Stateful functions can use serialize_by="channel", "root_id" (i.e. thread) or "user"
+    to handle the messages with the same channel, thread or sender one at a time, in
+    the order they arrived. Messages with different keys are still handled in parallel.
+
+    To bound the resources a function can use, max_concurrency limits how many calls
+    run at the same time. Other calls wait for their turn (overflow="queue"), are
+    ignored (overflow="drop") or get a reply that the bot is busy (overflow="busy").
+    Calls that take longer than timeout seconds are cancelled if they are coroutines.
+    Regular functions can't be interrupted, so those are abandoned instead.
+
+    A rate_limit of e.g. (5, 60.0) allows each user (or each channel, depending on
+    rate_limit_by) to trigger this function at most 5 times per minute. Messages over
+    that limit are ignored.
+    """
 
     def wrapped_func(func):
         reg = regexp
@@ -193,6 +319,14 @@ def listen_to(
             direct_only=direct_only,
             needs_mention=needs_mention,
             allowed_users=allowed_users,
+            priority=priority,
+            executor=executor,
+            serialize_by=serialize_by,
+            max_concurrency=max_concurrency,
+            timeout=timeout,
+            overflow=overflow,
+            rate_limit=rate_limit,
+            rate_limit_by=rate_limit_by,
         )
 
     return wrapped_func
@@ -245,6 +379,8 @@ class WebHookFunction(Function):
 
 def listen_webhook(
     regexp: str,
+    *,
+    priority: int = Priority.NORMAL,
 ):
     """Wrap the given function in a WebHookFunction class with the specified regexp."""
 
@@ -253,6 +389,7 @@ def listen_webhook(
         return WebHookFunction(
             func,
             matcher=pattern,
+            priority=priority,
         )
 
     return wrapped_func
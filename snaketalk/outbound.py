@@ -0,0 +1,303 @@
+import asyncio
+import heapq
+import itertools
+import logging
+import random
+import threading
+import time
+from contextvars import ContextVar
+from typing import Dict, List, Optional, Tuple
+
+import requests
+from mattermostdriver.client import Client
+from mattermostdriver.exceptions import (
+    ContentTooLarge,
+    FeatureDisabled,
+    InvalidOrMissingParameters,
+    MethodNotAllowed,
+    NoAccessTokenProvided,
+    NotEnoughPermissions,
+    ResourceNotFound,
+)
+
+from snaketalk.connection_pool import PooledAdapter
+from snaketalk.utils import Priority
+
+# Priority of the outgoing requests made from the current thread or task. The
+# ThreadPool and Plugin set this to the priority of the function they execute, so that
+# replies to users are sent before the posts of low-priority (e.g. scheduled) jobs.
+outbound_priority: ContextVar[int] = ContextVar(
+    "outbound_priority", default=Priority.NORMAL
+)
+
+# Too Many Requests, or the server (or a proxy in front of it) being temporarily
+# unavailable. Other 5xx errors might have been processed already, so aren't retried.
+RETRY_STATUSES = frozenset([429, 502, 503, 504])
+
+# The exceptions that mattermostdriver raises for these statuses.
+STATUS_EXCEPTIONS = {
+    400: InvalidOrMissingParameters,
+    401: NoAccessTokenProvided,
+    403: NotEnoughPermissions,
+    404: ResourceNotFound,
+    405: MethodNotAllowed,
+    413: ContentTooLarge,
+    501: FeatureDisabled,
+}
+
+# How often waiters that can't be notified directly (coroutines) check their turn.
+_POLL_INTERVAL = 0.05
+
+
+class OutboundScheduler:
+    """Decides when requests to the Mattermost server may be sent, based on the
+    X-Ratelimit-Remaining and X-Ratelimit-Reset headers of earlier responses.
+
+    As long as the server allows it, requests are sent right away. Once only a few
+    requests remain, they are spaced out over the rest of the rate limit window, and
+    once none remain (or the server answered with a 429), they wait for the window to
+    reset. Waiting requests are sent in order of priority, then in order of arrival.
+
+    The scheduler is shared by the synchronous and asynchronous clients of a Driver.
+
+    Arguments:
+    - max_retries: int, how often to retry a request that failed with a 429 or 5xx.
+    - backoff: float, base delay in seconds for the (jittered, exponential) backoff.
+    - max_backoff: float, maximum delay in seconds between retries.
+    - spacing_threshold: int, start spacing requests once fewer remain than this.
+    """
+
+    def __init__(
+        self,
+        max_retries: int = 3,
+        backoff: float = 0.5,
+        max_backoff: float = 30.0,
+        spacing_threshold: int = 10,
+    ):
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.spacing_threshold = spacing_threshold
+
+        self._condition = threading.Condition()
+        # Rate limit state as reported by the server, None if unknown.
+        self.remaining: Optional[int] = None
+        self.reset_at: Optional[float] = None
+        self._next_slot = 0.0
+        # Heap of (priority, sequence number) of the requests waiting for their turn.
+        self._waiting: List[Tuple[int, int]] = []
+        self._sequence = itertools.count()
+
+        # Counters
+        self.throttled = 0
+        self.retries = 0
+
+    def acquire(self, priority: int = Priority.NORMAL):
+        """Blocks until a request with the given priority may be sent."""
+        ticket = self._enqueue(priority)
+        waited = False
+        with self._condition:
+            try:
+                delay = self._try_acquire(ticket)
+                while delay > 0:
+                    waited = True
+                    self._condition.wait(delay)
+                    delay = self._try_acquire(ticket)
+            finally:
+                self._dequeue(ticket)
+        if waited:
+            self.throttled += 1
+
+    async def acquire_async(self, priority: int = Priority.NORMAL):
+        """Waits until a request with the given priority may be sent, without blocking
+        the event loop."""
+        ticket = self._enqueue(priority)
+        waited = False
+        try:
+            while True:
+                with self._condition:
+                    delay = self._try_acquire(ticket)
+                if delay <= 0:
+                    break
+                waited = True
+                await asyncio.sleep(min(delay, _POLL_INTERVAL))
+        finally:
+            with self._condition:
+                self._dequeue(ticket)
+        if waited:
+            self.throttled += 1
+
+    def update(self, status: int, headers: Dict[str, str]):
+        """Updates the rate limit state from the response to a request."""
+        remaining = headers.get("X-Ratelimit-Remaining")
+        reset = headers.get("X-Ratelimit-Reset")
+        with self._condition:
+            now = time.monotonic()
+            if remaining is not None:
+                self.remaining = int(remaining)
+            if reset is not None:
+                reset = float(reset)
+                # Either a number of seconds, or a UNIX timestamp
+                if reset > 1e9:
+                    reset -= time.time()
+                self.reset_at = now + max(reset, 0.0)
+            if status == 429:
+                self.remaining = 0
+                if self.reset_at is None or self.reset_at <= now:
+                    self.reset_at = now + self.backoff
+            self._condition.notify_all()
+
+    def should_retry(self, status: int, attempt: int) -> bool:
+        return status in RETRY_STATUSES and attempt < self.max_retries
+
+    def get_backoff(self, attempt: int) -> float:
+        """Returns a random delay before the given retry attempt (full jitter)."""
+        self.retries += 1
+        return random.uniform(0, min(self.max_backoff, self.backoff * 2**attempt))
+
+    def _enqueue(self, priority: int) -> Tuple[int, int]:
+        ticket = (priority, next(self._sequence))
+        with self._condition:
+            heapq.heappush(self._waiting, ticket)
+        return ticket
+
+    def _dequeue(self, ticket: Tuple[int, int]):
+        # Should be called with the lock held.
+        if ticket in self._waiting:
+            self._waiting.remove(ticket)
+            heapq.heapify(self._waiting)
+            self._condition.notify_all()
+
+    def _try_acquire(self, ticket: Tuple[int, int]) -> float:
+        """Returns 0 if the request may be sent now, or the number of seconds to wait
+        before trying again. Should be called with the lock held."""
+        now = time.monotonic()
+        if self.reset_at is not None and now >= self.reset_at:
+            # A new window started, so we don't know the limits anymore.
+            self.remaining = None
+            self.reset_at = None
+            self._next_slot = 0.0
+
+        # Let the requests with a higher priority go first.
+        if self._waiting[0] != ticket:
+            return _POLL_INTERVAL
+        if self.remaining is not None and self.remaining <= 0:
+            if self.reset_at is None:
+                return _POLL_INTERVAL
+            return max(self.reset_at - now, 0.001)
+        if now < self._next_slot:
+            return self._next_slot - now
+
+        if self.remaining is not None:
+            self.remaining -= 1
+            # Spread the last few requests over the rest of the window
+            if self.remaining < self.spacing_threshold and self.reset_at is not None:
+                self._next_slot = now + (self.reset_at - now) / (self.remaining + 1)
+        self._dequeue(ticket)
+        return 0.0
+
+
+def _rewind_files(files: Optional[Dict], data=None):
+    # Files that were already sent once have to be read again when retrying.
+    handles = [
+        value[1] if isinstance(value, tuple) else value
+        for value in (files or {}).values()
+    ]
+    for handle in handles + [data]:
+        if hasattr(handle, "seek"):
+            handle.seek(0)
+
+
+class ScheduledClient(Client):
+    """mattermostdriver Client that sends its requests through an OutboundScheduler,
+    and retries them if the server is rate limiting us or temporarily unavailable.
+
+    Unlike the original Client, which opens a new connection for every request, this one
+    reuses the connections of a session. See `set_pool_size`.
+    """
+
+    def __init__(self, options):
+        super().__init__(options)
+        self.scheduler = OutboundScheduler()
+        self.session = requests.Session()
+        self.set_pool_size(10)
+
+    def set_pool_size(self, pool_size: int, pool_timeout: float = 1.0):
+        """Keeps up to pool_size connections to the server alive. Threads that send a
+        request while all of those are in use wait for one to become available, for at
+        most pool_timeout seconds. After that, the pool grows by one connection."""
+        self.adapter = PooledAdapter(pool_size, pool_timeout)
+        self.session.mount("http://", self.adapter)
+        self.session.mount("https://", self.adapter)
+
+    def get_pool_stats(self):
+        return self.adapter.stats.get_stats()
+
+    def make_request(self, method, endpoint, *args, **kwargs):
+        priority = outbound_priority.get()
+        for attempt in itertools.count():
+            self.scheduler.acquire(priority)
+            try:
+                response = self._send(method, endpoint, *args, **kwargs)
+            except requests.HTTPError as e:
+                status = e.response.status_code
+                self.scheduler.update(status, e.response.headers)
+                if not self.scheduler.should_retry(status, attempt):
+                    raise
+                delay = self.scheduler.get_backoff(attempt)
+                logging.warning(
+                    f"{method.upper()} {endpoint} failed with status {status},"
+                    f" retrying in {delay:.2f}s."
+                )
+                time.sleep(delay)
+                _rewind_files(kwargs.get("files"), kwargs.get("data"))
+                continue
+
+            self.scheduler.update(response.status_code, response.headers)
+            return response
+
+    def _send(
+        self,
+        method,
+        endpoint,
+        options=None,
+        params=None,
+        data=None,
+        files=None,
+        basepath=None,
+    ):
+        # Same as Client.make_request, but using our session, and the exceptions keep
+        # the response, so that its status and rate limit headers can be read.
+        if basepath:
+            url = (
+                f"{self._options['scheme']}://{self._options['url']}:"
+                f"{self._options['port']}{basepath}"
+            )
+        else:
+            url = self.url
+        response = self.session.request(
+            method.lower(),
+            url + endpoint,
+            headers=self.auth_header(),
+            verify=self._verify,
+            json={} if options is None else options,
+            params={} if params is None else params,
+            data={} if data is None else data,
+            files=files,
+            timeout=self.request_timeout,
+            auth=self._auth() if self._auth is not None else None,
+        )
+        if response.status_code < 400:
+            return response
+
+        try:
+            data = response.json()
+            message = data.get("message", data)
+        except ValueError:
+            message = response.text
+        logging.error(message)
+        if response.status_code in STATUS_EXCEPTIONS:
+            raise STATUS_EXCEPTIONS[response.status_code](
+                message, response=response
+            ) from None
+        response.raise_for_status()
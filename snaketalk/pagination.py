@@ -0,0 +1,116 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from typing import AsyncIterator, Awaitable, Callable, Dict, Iterator, List, Tuple
+
+
+class ChannelPages:
+    """Pages through the posts of a channel, from newest to oldest.
+
+    Uses the id of the oldest post so far as cursor, so new posts that arrive while
+    iterating don't shift the pages.
+
+    Arguments:
+    - channel_id: str, the channel to read.
+    - per_page: int, number of posts per request.
+    """
+
+    def __init__(self, channel_id: str, per_page: int = 100):
+        self.channel_id = channel_id
+        self.per_page = per_page
+        self.before = None
+        self.done = False
+
+    def request(self) -> Tuple[str, Dict]:
+        """Returns the endpoint and parameters of the next page."""
+        params = {"per_page": str(self.per_page)}
+        if self.before:
+            params["before"] = self.before
+        return f"/channels/{self.channel_id}/posts", params
+
+    def parse(self, response: Dict) -> List[Dict]:
+        """Returns the posts of a page, and moves the cursor past them."""
+        order = response.get("order", [])
+        self.done = len(order) < self.per_page
+        if order:
+            self.before = order[-1]
+        return [response["posts"][post_id] for post_id in order]
+
+
+class ThreadPages:
+    """Pages through the posts of a thread, from oldest to newest.
+
+    Servers that don't support paginated threads (before Mattermost 6.0) return the
+    entire thread in the first page.
+
+    Arguments:
+    - post_id: str, id of any post in the thread.
+    - per_page: int, number of posts per request.
+    """
+
+    def __init__(self, post_id: str, per_page: int = 100):
+        self.post_id = post_id
+        self.per_page = per_page
+        # (create_at, id) of the last post so far
+        self.cursor = None
+        self.done = False
+
+    def request(self) -> Tuple[str, Dict]:
+        params = {"perPage": str(self.per_page), "direction": "down"}
+        if self.cursor:
+            params["fromCreateAt"] = str(self.cursor[0])
+            params["fromPost"] = self.cursor[1]
+        return f"/posts/{self.post_id}/thread", params
+
+    def parse(self, response: Dict) -> List[Dict]:
+        posts = sorted(
+            response.get("posts", {}).values(),
+            key=lambda post: (int(post["create_at"]), post["id"]),
+        )
+        # Skip anything we've already seen, in case the server includes the cursor
+        if self.cursor:
+            posts = [
+                post
+                for post in posts
+                if (int(post["create_at"]), post["id"]) > self.cursor
+            ]
+        self.done = not posts or not response.get("has_next", False)
+        if posts:
+            self.cursor = (int(posts[-1]["create_at"]), posts[-1]["id"])
+        return posts
+
+
+def iterate_pages(pages, fetch: Callable[[str, Dict], Dict]) -> Iterator[Dict]:
+    """Yields the posts of all pages, fetching the next page in a background thread
+    while the current one is being processed. At most two pages are kept in memory.
+
+    Arguments:
+    - pages: ChannelPages or ThreadPages.
+    - fetch: function that sends a GET request, given the endpoint and parameters.
+    """
+    # Not the driver threadpool: its workers may be the ones iterating, and could end
+    # up waiting for prefetches that are queued behind themselves.
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        future = executor.submit(fetch, *pages.request())
+        while future is not None:
+            posts = pages.parse(future.result())
+            future = None if pages.done else executor.submit(fetch, *pages.request())
+            yield from posts
+
+
+async def iterate_pages_async(
+    pages, fetch: Callable[[str, Dict], Awaitable[Dict]]
+) -> AsyncIterator[Dict]:
+    """Awaitable version of `iterate_pages`, where fetch is a coroutine function."""
+    task = asyncio.ensure_future(fetch(*pages.request()))
+    try:
+        while task is not None:
+            posts = pages.parse(await task)
+            task = (
+                None if pages.done else asyncio.ensure_future(fetch(*pages.request()))
+            )
+            for post in posts:
+                yield post
+    finally:
+        # The caller stopped early
+        if task is not None and not task.done():
+            task.cancel()
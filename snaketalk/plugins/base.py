@@ -1,16 +1,24 @@
 from __future__ import annotations
 
+import asyncio
 import logging
 import re
+import time
 from abc import ABC
 from collections import defaultdict
-from typing import Dict, Optional, Sequence
+from concurrent.futures import Future
+from contextlib import asynccontextmanager
+from typing import Dict, Hashable, Optional, Sequence, Set
 
 from snaketalk.driver import Driver
 from snaketalk.function import Function, MessageFunction, WebHookFunction, listen_to
+from snaketalk.outbound import outbound_priority
 from snaketalk.settings import Settings
+from snaketalk.threadpool import TaskFuture, ThreadPool
 from snaketalk.wrappers import EventWrapper, Message
 
+BUSY_MESSAGE = "I'm too busy to handle this right now, please try again later!"
+
 
 class Plugin(ABC):
     """A Plugin is a self-contained class that defines what functions should be executed
@@ -19,10 +27,39 @@ class Plugin(ABC):
     It will be called by the EventHandler whenever one of its listeners is triggered,
     but execution of the corresponding function is handled by the plugin itself. This
     way, you can implement multithreading or multiprocessing as desired.
+
+    To prevent a plugin with slow functions from taking up all workers of the shared
+    threadpool, it can limit its own number of simultaneous function calls with
+    `worker_quota`, or use a dedicated threadpool of `num_threads` workers instead.
     """
 
+    # Executor for the regular (non-async) functions of this plugin that don't specify
+    # one themselves: "thread" or "process".
+    executor: str = "thread"
+    # If set, this plugin's functions run on a dedicated threadpool with this many
+    # workers, rather than on the shared threadpool of the driver.
+    num_threads: Optional[int] = None
+    # If set, at most this many functions of this plugin run at the same time. Other
+    # calls wait on the event loop without taking up a worker.
+    worker_quota: Optional[int] = None
+
     def __init__(self):
         self.driver = None
+        self.threadpool: Optional[ThreadPool] = None
+        # Bookkeeping for get_stats
+        self._quota: Optional[asyncio.Semaphore] = None
+        self._waiting_for_quota = 0
+        self._in_flight: Set[Future] = set()
+        self._completed = 0
+        self._total_wait_time = 0.0
+        self._max_wait_time = 0.0
+        self._timed_out = 0
+        self._dropped = 0
+        # Semaphores for functions with a max_concurrency
+        self._concurrency_limits: Dict[Function, asyncio.Semaphore] = {}
+        # Last function call of each serialization key, see _serialized. Keys are
+        # removed as soon as their last call finishes.
+        self._serial_tails: Dict[Hashable, asyncio.Future] = {}
         self.message_listeners: Dict[
             re.Pattern, Sequence[MessageFunction]
         ] = defaultdict(list)
@@ -37,6 +74,11 @@ class Plugin(ABC):
 
     def initialize(self, driver: Driver, settings: Optional[Settings] = None):
         self.driver = driver
+        self.threadpool = (
+            ThreadPool(num_workers=self.num_threads)
+            if self.num_threads
+            else driver.threadpool
+        )
 
         # Register listeners for any listener functions we might have
         for attribute in dir(self):
@@ -47,6 +89,10 @@ class Plugin(ABC):
                     function.plugin = self
                     if isinstance(function, MessageFunction):
                         self.message_listeners[function.matcher].append(function)
+                        if function.executor is None and not function.is_coroutine:
+                            function.executor = self.executor
+                        if function.executor == "process":
+                            driver.process_pool.register(function)
                     elif isinstance(function, WebHookFunction):
                         self.webhook_listeners[function.matcher].append(function)
                     else:
@@ -73,18 +119,196 @@ class Plugin(ABC):
         logging.debug(f"Plugin {self.__class__.__name__} stopped!")
         return self
 
+    @property
+    def has_own_threadpool(self) -> bool:
+        return self.threadpool is not None and self.threadpool is not getattr(
+            self.driver, "threadpool", None
+        )
+
     async def call_function(
         self,
         function: Function,
         event: EventWrapper,
         groups: Optional[Sequence[str]] = [],
     ):
-        if function.is_coroutine:
-            await function(event, *groups)  # type:ignore
-        else:
-            # By default, we use the global threadpool of the driver, but we could use
-            # a plugin-specific thread or process pool if we wanted.
-            self.driver.threadpool.add_task(function, event, *groups)
+        key = None
+        if getattr(function, "serialize_by", None):
+            key = (function.serialize_by, function.serialization_key(event))
+        if key is None:
+            return await self._execute(function, event, groups)
+
+        async with self._serialized(key):
+            await self._execute(function, event, groups)
+
+    @asynccontextmanager
+    async def _serialized(self, key: Hashable):
+        """Waits until the previous call with the same key has finished.
+
+        Every call only waits for its direct predecessor, so no bookkeeping is needed
+        besides the last call of every key that is still running or waiting.
+        """
+        previous = self._serial_tails.get(key)
+        done = asyncio.get_running_loop().create_future()
+        self._serial_tails[key] = done
+
+        def finish(*args):
+            done.set_result(None)
+            if self._serial_tails.get(key) is done:
+                del self._serial_tails[key]
+
+        try:
+            if previous is not None:
+                await asyncio.shield(previous)
+            yield
+        finally:
+            # If we were cancelled while waiting, our successor still has to wait for
+            # our predecessor.
+            if previous is None or previous.done():
+                finish()
+            else:
+                previous.add_done_callback(finish)
+
+    async def _execute(
+        self,
+        function: Function,
+        event: EventWrapper,
+        groups: Optional[Sequence[str]] = [],
+    ):
+        # Apply the concurrency limit of this specific function, if any
+        limit = self._get_concurrency_limit(function)
+        if limit is not None:
+            if limit.locked() and function.overflow != "queue":
+                self._dropped += 1
+                logging.warning(
+                    f"{function.name} is already running {function.max_concurrency}"
+                    " times, ignoring this call."
+                )
+                if function.overflow == "busy":
+                    await self.driver.reply_to_async(event, BUSY_MESSAGE)
+                return
+            await limit.acquire()
+
+        try:
+            timeout = getattr(function, "timeout", None)
+            if function.is_coroutine:
+                # Requests made by the coroutine are sent according to its priority.
+                # Each task has its own context, so this doesn't affect anything else.
+                outbound_priority.set(function.priority)
+                # The coroutine is cancelled if it takes too long
+                await asyncio.wait_for(function(event, *groups), timeout)
+            else:
+                await self._submit(function, event, groups, timeout)
+        except asyncio.TimeoutError:
+            self._timed_out += 1
+            logging.warning(f"{function.name} timed out after {timeout}s.")
+        finally:
+            if limit is not None:
+                limit.release()
+
+    def _get_concurrency_limit(self, function: Function) -> Optional[asyncio.Semaphore]:
+        max_concurrency = getattr(function, "max_concurrency", None)
+        if not max_concurrency:
+            return None
+        if function not in self._concurrency_limits:
+            self._concurrency_limits[function] = asyncio.Semaphore(max_concurrency)
+        return self._concurrency_limits[function]
+
+    async def _submit(
+        self,
+        function: Function,
+        event: EventWrapper,
+        groups: Sequence[str],
+        timeout: Optional[float] = None,
+    ):
+        """Executes a regular function on the threadpool or process pool."""
+        called_at = time.perf_counter()
+        if self.worker_quota:
+            if self._quota is None:
+                self._quota = asyncio.Semaphore(self.worker_quota)
+            self._waiting_for_quota += 1
+            try:
+                await self._quota.acquire()
+            finally:
+                self._waiting_for_quota -= 1
+
+        try:
+            if getattr(function, "executor", "thread") == "process":
+                future = self.driver.process_pool.submit(function, event, *groups)
+                started_at = time.perf_counter()
+            else:
+                # By default, we use the global threadpool of the driver, unless this
+                # plugin has a threadpool of its own.
+                future = self.threadpool.add_task(
+                    function, event, *groups, priority=function.priority
+                )
+                started_at = None
+
+            self._in_flight.add(future)
+            try:
+                # A thread can't be cancelled, so on timeout we simply stop waiting
+                # for it. If it didn't start yet, it will be skipped.
+                await asyncio.wait_for(asyncio.wrap_future(future), timeout)
+            except asyncio.TimeoutError:
+                future.abandoned = True
+                raise
+            except Exception:
+                # The threadpool already logged and counted this failure, so don't
+                # pass it on to be reported again. The process pool doesn't, though.
+                if isinstance(future, TaskFuture):
+                    return
+                raise
+            finally:
+                self._in_flight.discard(future)
+        finally:
+            if self._quota is not None:
+                self._quota.release()
+
+        # Process pool futures don't know when they were started, so for those we only
+        # count the time spent waiting for the quota.
+        started_at = getattr(future, "started_at", None) or started_at
+        wait_time = started_at - called_at
+        self._completed += 1
+        self._total_wait_time += wait_time
+        self._max_wait_time = max(self._max_wait_time, wait_time)
+        logging.debug(
+            f"{function.name} waited {wait_time:.3f}s and ran for"
+            f" {time.perf_counter() - started_at:.3f}s."
+        )
+
+    def get_stats(self) -> Dict:
+        """Reports how busy the executor of this plugin is.
+
+        Returns a dictionary with:
+        - in_flight: number of function calls that were submitted to an executor.
+        - queued: number of those that didn't start yet, plus those still waiting for
+            the worker quota.
+        - capacity: the worker quota or number of dedicated threads, if any.
+        - saturation: in_flight divided by capacity.
+        - completed: number of finished function calls.
+        - mean_wait_time / max_wait_time: seconds between the call and the start of
+            execution.
+        - timed_out: number of function calls that exceeded their timeout.
+        - dropped: number of function calls that were ignored because the function was
+            already running max_concurrency times.
+        """
+        in_flight = len(self._in_flight)
+        queued = self._waiting_for_quota + sum(
+            not (future.running() or future.done()) for future in self._in_flight
+        )
+        capacity = self.worker_quota or (
+            self.threadpool.max_workers if self.has_own_threadpool else None
+        )
+        return {
+            "in_flight": in_flight,
+            "queued": queued,
+            "capacity": capacity,
+            "saturation": in_flight / capacity if capacity else None,
+            "completed": self._completed,
+            "mean_wait_time": self._total_wait_time / max(self._completed, 1),
+            "max_wait_time": self._max_wait_time,
+            "timed_out": self._timed_out,
+            "dropped": self._dropped,
+        }
 
     def get_help_string(self):
         string = f"Plugin {self.__class__.__name__} has the following functions:\n"
@@ -103,4 +327,4 @@ class Plugin(ABC):
 
     async def help(self, message: Message):
         """Prints the list of functions registered on every active plugin."""
-        self.driver.reply_to(message, self.get_help_string())
+        await self.driver.reply_to_async(message, self.get_help_string())
@@ -28,14 +28,14 @@ class WebHookExample(Plugin):
                 },
             )
         else:
-            self.driver.create_post(
+            await self.driver.create_post_async(
                 event.body["channel_id"], f"Webhook {event.webhook_id} triggered!"
             )
 
     @listen_to("!button", direct_only=False)
     async def webhook_button(self, message: Message):
         """Creates a button that will trigger a webhook depending on the choice."""
-        self.driver.reply_to(
+        await self.driver.reply_to_async(
             message,
             "",
             props={
@@ -0,0 +1,227 @@
+import logging
+import multiprocessing
+import os
+import pickle
+import threading
+import time
+from concurrent.futures import Future, ProcessPoolExecutor, wait
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+
+from snaketalk.wrappers import Message
+
+# Inside a worker process, the functions of the pool it belongs to.
+_worker_functions: Dict[int, Callable] = {}
+
+# Values that are returned as-is when accessed on a DriverProxy.
+_PLAIN_TYPES = (str, bytes, int, float, bool, type(None), list, tuple, dict)
+
+
+class DriverProxy:
+    """Stand-in for the Driver inside a worker process, which forwards any method
+    calls to the real Driver in the parent process.
+
+    Plain attributes (e.g. `user_id`) are read from the copy of the driver that was
+    inherited when forking. Nested objects (e.g. `driver.posts`) are proxied as well.
+
+    Arguments:
+    - target: the (inherited) object this proxy stands in for.
+    - call: function that executes a call in the parent process, given the attribute
+        path of the method and its arguments.
+    - path: tuple of str, attribute path from the driver to the target.
+    """
+
+    def __init__(self, target: Any, call: Callable, path: Tuple[str, ...] = ()):
+        self._target = target
+        self._call = call
+        self._path = path
+
+    def __getattr__(self, name: str):
+        value = getattr(self._target, name)
+        path = self._path + (name,)
+        if callable(value):
+            return lambda *args, **kwargs: self._call(path, args, kwargs)
+        if isinstance(value, _PLAIN_TYPES):
+            return value
+        return DriverProxy(value, self._call, path)
+
+
+class _ParentCaller:
+    """Sends driver calls from a worker process to the parent and waits for the
+    result."""
+
+    def __init__(self, requests, responses, slot: int):
+        self.requests = requests
+        self.responses = responses
+        self.slot = slot
+
+    def __call__(self, path: Tuple[str, ...], args: Sequence, kwargs: Dict):
+        self.requests.put((self.slot, path, args, kwargs))
+        success, result = pickle.loads(self.responses.get())
+        if not success:
+            raise result
+        return result
+
+
+def _initialize_worker(functions: Dict, driver, requests, responses: Sequence, slots):
+    _worker_functions.update(functions)
+    # Each worker process gets its own response queue.
+    slot = slots.get()
+    proxy = DriverProxy(driver, _ParentCaller(requests, responses[slot], slot))
+    for function in functions.values():
+        plugin = getattr(function, "plugin", None)
+        if plugin is not None:
+            plugin.driver = proxy
+
+
+def _noop():
+    return os.getpid()
+
+
+def _run_message_function(function_id: int, body: Dict, groups: Sequence[str]):
+    if function_id not in _worker_functions:
+        raise RuntimeError(
+            "This function was registered after the process pool was started, so it"
+            " can't be executed in a worker process!"
+        )
+    _worker_functions[function_id](Message(body), *groups)
+    # The return value might not be picklable, and isn't used anyway.
+    return None
+
+
+class ProcessPool:
+    """Persistent pool of forked worker processes to execute CPU-bound listener
+    functions in, so that they don't hold the GIL of the main process.
+
+    Only the body of a message and the regexp groups are sent to the workers. Any calls
+    the function makes to `self.driver` are forwarded to the Driver of the main
+    process, which executes them on its threadpool.
+
+    Arguments:
+    - driver: the Driver that worker processes should forward their calls to.
+    - num_processes: int, number of worker processes. Defaults to the number of CPUs.
+    """
+
+    def __init__(self, driver, num_processes: Optional[int] = None):
+        self.driver = driver
+        self.num_processes = num_processes or os.cpu_count() or 1
+        self.alive = False
+        # Functions that may be executed in the process pool, by id. The worker
+        # processes are forked, so they inherit these and only the id has to be sent.
+        self.functions: Dict[int, Callable] = {}
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self._requests = None
+        self._listener: Optional[threading.Thread] = None
+        # Calls that were submitted but didn't finish yet, with their submission time.
+        # Calls are started in this order, so the first num_processes are running.
+        self._pending: Dict[Future, float] = {}
+        self._lock = threading.Lock()
+
+    def register(self, function: Callable):
+        """Registers a function so it can be executed by the worker processes.
+
+        Should be called before the pool is started, since worker processes only know
+        about the functions that were registered before they were forked.
+        """
+        self.functions[id(function)] = function
+
+    def start(self):
+        """Forks the worker processes, if any functions were registered."""
+        if self.alive or not self.functions:
+            return
+
+        context = multiprocessing.get_context("fork")
+        self._requests = context.Queue()
+        responses = [context.Queue() for _ in range(self.num_processes)]
+        slots = context.Queue()
+        for slot in range(self.num_processes):
+            slots.put(slot)
+
+        self._executor = ProcessPoolExecutor(
+            self.num_processes,
+            mp_context=context,
+            initializer=_initialize_worker,
+            initargs=(self.functions, self.driver, self._requests, responses, slots),
+        )
+        self.alive = True
+        self._listener = threading.Thread(
+            target=self._handle_calls, args=(responses,), daemon=True
+        )
+        self._listener.start()
+        # Make sure all workers are forked now, rather than whenever they are first
+        # needed, so that they know about all registered functions.
+        wait([self._executor.submit(_noop) for _ in range(self.num_processes)])
+        logging.info(f"Process pool started with {self.num_processes} processes.")
+
+    def stop(self):
+        if not self.alive:
+            return
+        self.alive = False
+        self._executor.shutdown(wait=True)
+        self._requests.put(None)
+        self._listener.join()
+        logging.info("Process pool stopped.")
+
+    def submit(self, function: Callable, message: Message, *groups: str) -> Future:
+        """Executes a registered message function in one of the worker processes."""
+        if not self.alive:
+            raise RuntimeError("The process pool has not been started!")
+        if id(function) not in self.functions:
+            raise ValueError(f"Function {function} was not registered!")
+        future = self._executor.submit(
+            _run_message_function, id(function), message.body, groups
+        )
+        with self._lock:
+            self._pending[future] = time.perf_counter()
+        future.add_done_callback(self._finished)
+        return future
+
+    def get_queue_length(self) -> int:
+        """Returns the number of calls waiting for a worker process."""
+        return len(self._get_waiting())
+
+    def get_queue_age(self) -> Optional[float]:
+        """Returns how many seconds the oldest call that is waiting for a worker process
+        has been waiting, or None if no calls are waiting."""
+        waiting = self._get_waiting()
+        if not waiting:
+            return None
+        return time.perf_counter() - waiting[0]
+
+    def _get_waiting(self) -> List[float]:
+        # Returns the submission times of the calls that didn't start yet.
+        with self._lock:
+            pending = [
+                submitted_at
+                for future, submitted_at in self._pending.items()
+                if not future.done()
+            ]
+        return pending[self.num_processes :]
+
+    def _finished(self, future: Future):
+        with self._lock:
+            self._pending.pop(future, None)
+
+    def _handle_calls(self, responses: Sequence):
+        while True:
+            request = self._requests.get()
+            if request is None:
+                return
+            slot, path, args, kwargs = request
+            self.driver.threadpool.add_task(
+                self._execute, responses[slot], path, args, kwargs
+            )
+
+    def _execute(self, response_queue, path: Tuple[str, ...], args, kwargs):
+        # The response is pickled here rather than by the queue, so that we can still
+        # report an error to the worker if that fails.
+        try:
+            target = self.driver
+            for name in path:
+                target = getattr(target, name)
+            response = pickle.dumps((True, target(*args, **kwargs)))
+        except Exception as e:
+            try:
+                response = pickle.dumps((False, e))
+            except Exception:
+                response = pickle.dumps((False, RuntimeError(repr(e))))
+        response_queue.put(response)
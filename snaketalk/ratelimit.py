@@ -0,0 +1,71 @@
+import time
+from collections import OrderedDict
+from typing import Hashable, Optional, Tuple
+
+
+class TokenBucket:
+    """Allows bursts of up to `capacity` events, refilled at `rate` events per second.
+
+    Arguments:
+    - capacity: int, maximum number of tokens.
+    - rate: float, number of tokens added per second.
+    """
+
+    __slots__ = ("capacity", "rate", "tokens", "updated_at")
+
+    def __init__(self, capacity: int, rate: float):
+        self.capacity = capacity
+        self.rate = rate
+        self.tokens = float(capacity)
+        self.updated_at = time.monotonic()
+
+    def consume(self, now: Optional[float] = None) -> bool:
+        """Takes a token if there is one, and returns whether that succeeded."""
+        now = time.monotonic() if now is None else now
+        self.tokens = min(
+            self.capacity, self.tokens + (now - self.updated_at) * self.rate
+        )
+        self.updated_at = now
+        if self.tokens < 1:
+            return False
+        self.tokens -= 1
+        return True
+
+
+class RateLimiter:
+    """Keeps a TokenBucket per key, e.g. per user or per channel.
+
+    Only the most recently used max_keys buckets are kept. A key that was idle long
+    enough to be evicted would have had a full bucket again anyway (unless there are a
+    lot of active keys), so this hardly affects the limits. Not thread-safe, it is meant
+    to be used from the event loop.
+
+    Arguments:
+    - limit: tuple of (int, float), allow this many events per this many seconds.
+    - max_keys: int, maximum number of buckets to keep in memory.
+    """
+
+    def __init__(self, limit: Tuple[int, float], max_keys: int = 10000):
+        self.capacity, period = limit
+        self.rate = self.capacity / period
+        self.max_keys = max_keys
+        self._buckets: "OrderedDict[Hashable, TokenBucket]" = OrderedDict()
+        self.rejected = 0
+
+    def __len__(self):
+        return len(self._buckets)
+
+    def allow(self, key: Hashable) -> bool:
+        """Consumes a token for the given key, and returns whether there was one."""
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            bucket = self._buckets[key] = TokenBucket(self.capacity, self.rate)
+            if len(self._buckets) > self.max_keys:
+                self._buckets.popitem(last=False)
+        else:
+            self._buckets.move_to_end(key)
+
+        if bucket.consume():
+            return True
+        self.rejected += 1
+        return False
@@ -7,6 +7,8 @@ from typing import Optional
 import schedule
 from schedule import default_scheduler
 
+from snaketalk.utils import Priority
+
 
 class OneTimeJob(schedule.Job):
     # Override schedule.Job._schedule_next_run to avoid periodic job generation.
@@ -30,12 +32,20 @@ def _default_scheduler_once(self, trigger_time: datetime):
     return job
 
 
+def _job_priority(job: schedule.Job) -> int:
+    """Jobs can be given a priority by tagging them with it, e.g.
+    `schedule.every(10).seconds.do(job).tag(Priority.HIGH)`. Defaults to low priority,
+    so that scheduled jobs don't delay replies to incoming messages."""
+    priorities = [tag for tag in job.tags if isinstance(tag, Priority)]
+    return min(priorities, default=Priority.LOW)
+
+
 def _run_job(self, job):
     """Overrides default_scheduler._run_job to support running the jobs in a separate
     process.
 
-    Either way, this waits for the result in a dedicated thread to prevent blocking the
-    event loop.
+    Either way, this waits for the result in a worker of the scheduler's threadpool (if
+    one was registered) or in a dedicated thread, to prevent blocking the event loop.
     """
 
     def launch_and_wait():
@@ -57,7 +67,17 @@ def _run_job(self, job):
         if isinstance(result, schedule.CancelJob) or result is schedule.CancelJob:
             self.cancel_job(job)
 
-    Thread(target=launch_and_wait).start()
+    threadpool = getattr(self, "threadpool", None)
+    if threadpool is not None and threadpool.alive:
+        # The job might have to wait in the queue for a while, so make sure it's not
+        # considered due again in the meantime.
+        if isinstance(job, OneTimeJob):
+            self.cancel_job(job)
+        else:
+            job._schedule_next_run()
+        threadpool.add_task(launch_and_wait, priority=_job_priority(job))
+    else:
+        Thread(target=launch_and_wait).start()
 
 
 def _once(trigger_time: Optional[datetime] = None):
@@ -71,5 +91,7 @@ def _once(trigger_time: Optional[datetime] = None):
 
 # Monkey-Patching
 default_scheduler.once = _default_scheduler_once
+# Set by ThreadPool.start_scheduler_thread
+default_scheduler.threadpool = None
 schedule.Scheduler._run_job = _run_job
 schedule.once = _once
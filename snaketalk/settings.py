@@ -1,5 +1,5 @@
 from dataclasses import dataclass, field
-from typing import Sequence
+from typing import Optional, Sequence, Tuple
 
 
 @dataclass
@@ -18,10 +18,48 @@ class Settings:
     WEBHOOK_HOST_ENABLED: bool = True
     WEBHOOK_HOST_URL: str = "http://127.0.0.1"
     WEBHOOK_HOST_PORT: int = 8579
+    # Run the webhook server on the same event loop as the websocket connection,
+    # rather than on a separate event loop that occupies one of the worker threads.
+    WEBHOOK_SINGLE_LOOP: bool = False
     DEBUG: bool = False
     IGNORE_USERS: Sequence[str] = field(default_factory=list)
     # How often to check whether any scheduled jobs need to be run, default every second
     SCHEDULER_PERIOD: float = 1.0
+    # Number of worker threads that run the listeners. The pool grows up to the maximum
+    # when messages have to wait for a free worker, and shrinks again when idle.
+    WORKER_THREADS: int = 10
+    MAX_WORKER_THREADS: int = 20
+    # Number of processes for functions with executor="process", defaults to the
+    # number of CPUs.
+    WORKER_PROCESSES: Optional[int] = None
+    # Maximum number of listener functions in flight. Once reached, new events are only
+    # read once some of those have finished.
+    MAX_LISTENER_TASKS: int = 1000
+    # Load shedding: once the queue of a function's pool (the shared threadpool, its
+    # plugin's own threadpool or the process pool) is longer than this, or its oldest
+    # task has waited this many seconds, low priority functions are rejected. The same
+    # goes for webhooks, based on the shared threadpool. At twice these limits, normal
+    # priority functions reply that the bot is busy.
+    SHED_QUEUE_LENGTH: Optional[int] = None
+    SHED_QUEUE_AGE: Optional[float] = None
+    # Rate limits for triggering the bot, as (number of messages, per seconds), e.g.
+    # (10, 60.0). Messages over the limit of their sender or channel are ignored.
+    USER_RATE_LIMIT: Optional[Tuple[int, float]] = None
+    CHANNEL_RATE_LIMIT: Optional[Tuple[int, float]] = None
+    # If set, plain posts to the same channel and thread that are created within this
+    # many seconds of each other are merged into one post (of at most MAX_POST_LENGTH
+    # characters), which cuts API calls and notifications during bursts.
+    COALESCE_WINDOW: Optional[float] = None
+    MAX_POST_LENGTH: int = 16383
+    # User and channel info is cached for CACHE_TTL seconds, for at most CACHE_SIZE
+    # users and channels. Websocket events keep the cached entries up to date.
+    CACHE_SIZE: int = 1000
+    CACHE_TTL: float = 300.0
+    # Maximum number of threads that get_thread keeps in its cache
+    THREAD_CACHE_SIZE: int = 100
+    # JSON library used to decode websocket events: "stdlib", "orjson" or "auto", which
+    # uses orjson if it is installed.
+    JSON_BACKEND: str = "auto"
 
     SCHEME: str = field(init=False)  # Will be taken from the URL. Defaults to https.
 
@@ -0,0 +1,101 @@
+import asyncio
+import threading
+from collections import Counter
+from concurrent.futures import Future
+from typing import Any, Awaitable, Callable, Dict, Hashable, Tuple
+
+from snaketalk.utils import in_event_loop
+
+
+class SingleFlight:
+    """Makes concurrent identical requests share a single call to the server.
+
+    The first caller for a key executes the request, and any caller that asks for the
+    same key while it is still in flight waits for that result (or exception) instead of
+    sending a request of its own. This works across threads and coroutines, so only use
+    it for idempotent requests whose results may be shared. A synchronous call from a
+    thread that runs an event loop sends its own request, since waiting for a flight
+    led by a coroutine on that loop would deadlock it.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._flights: Dict[Hashable, Future] = {}
+        # Number of requests sent and of requests saved, per endpoint
+        self.requests = Counter()
+        self.deduplicated = Counter()
+
+    def do(self, endpoint: str, key: Tuple, function: Callable[[], Any]):
+        """Returns the result of function(), or of the call that is already in flight
+        for the same endpoint and key.
+
+        Arguments:
+        - endpoint: str, name of the endpoint, used for the counters.
+        - key: tuple, arguments that identify the request (e.g. the user id).
+        - function: the function that executes the request.
+        """
+        if in_event_loop():
+            with self._lock:
+                self.requests[endpoint] += 1
+            return function()
+
+        future, leader = self._join(endpoint, key)
+        if not leader:
+            return future.result()
+        try:
+            result = function()
+        except BaseException as e:
+            self._land(endpoint, key, future, exception=e)
+            raise
+        self._land(endpoint, key, future, result=result)
+        return result
+
+    async def do_async(
+        self, endpoint: str, key: Tuple, function: Callable[[], Awaitable]
+    ):
+        """Awaitable version of `do`, where function is a coroutine function."""
+        future, leader = self._join(endpoint, key)
+        if not leader:
+            return await asyncio.wrap_future(future)
+        try:
+            result = await function()
+        except BaseException as e:
+            # Also when cancelled, so that the other callers don't wait forever.
+            self._land(endpoint, key, future, exception=e)
+            raise
+        self._land(endpoint, key, future, result=result)
+        return result
+
+    def get_stats(self) -> Dict[str, Dict[str, int]]:
+        """Returns the number of requests sent and deduplicated per endpoint."""
+        with self._lock:
+            return {
+                endpoint: {
+                    "requests": self.requests[endpoint],
+                    "deduplicated": self.deduplicated[endpoint],
+                }
+                for endpoint in self.requests
+            }
+
+    def _join(self, endpoint: str, key: Tuple) -> Tuple[Future, bool]:
+        # Returns the future of the flight, and whether the caller should execute it.
+        with self._lock:
+            future = self._flights.get((endpoint, key))
+            if future is not None:
+                self.deduplicated[endpoint] += 1
+                return future, False
+            future = self._flights[(endpoint, key)] = Future()
+            self.requests[endpoint] += 1
+            return future, True
+
+    def _land(
+        self, endpoint: str, key: Tuple, future: Future, result=None, exception=None
+    ):
+        # Calls that arrive from now on start a new flight, since this result might
+        # already be outdated by the time they were made.
+        with self._lock:
+            del self._flights[(endpoint, key)]
+        if exception is not None:
+            future.set_exception(exception)
+        else:
+            future.set_result(result)
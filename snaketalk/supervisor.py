@@ -0,0 +1,79 @@
+import asyncio
+import logging
+from collections import Counter, deque
+from typing import Coroutine, Dict, Optional
+
+
+class TaskSupervisor:
+    """Keeps track of the asyncio tasks that execute listener functions.
+
+    Holds a reference to every task until it finishes, reports any exception with the
+    name of the listener, and limits the number of tasks that run at the same time.
+    Once that limit is reached, `spawn` only returns when another task finishes. The
+    EventHandler awaits it, so a burst of messages slows down reading from the websocket
+    rather than piling up tasks.
+
+    Arguments:
+    - max_tasks: int, maximum number of tasks in flight. None means no limit.
+    """
+
+    def __init__(self, max_tasks: Optional[int] = None):
+        self.max_tasks = max_tasks
+        # Maps each task in flight to the name of its listener
+        self._tasks: Dict[asyncio.Task, str] = {}
+        self._waiters = deque()
+
+        self.started = 0
+        self.failures = Counter()
+
+    @property
+    def in_flight(self) -> int:
+        return len(self._tasks)
+
+    def get_in_flight(self) -> Dict[str, int]:
+        """Returns the number of tasks in flight per listener name."""
+        return dict(Counter(self._tasks.values()))
+
+    async def spawn(self, coroutine: Coroutine, name: str) -> asyncio.Task:
+        """Runs the coroutine in a new task, after waiting for a free slot."""
+        while self.max_tasks is not None and len(self._tasks) >= self.max_tasks:
+            waiter = asyncio.get_running_loop().create_future()
+            self._waiters.append(waiter)
+            try:
+                await waiter
+            except BaseException:
+                coroutine.close()
+                raise
+            finally:
+                if waiter in self._waiters:
+                    self._waiters.remove(waiter)
+
+        task = asyncio.create_task(coroutine)
+        self._tasks[task] = name
+        self.started += 1
+        task.add_done_callback(self._task_done)
+        return task
+
+    async def join(self):
+        """Waits for all tasks that are currently in flight."""
+        if self._tasks:
+            await asyncio.wait(list(self._tasks))
+
+    def _task_done(self, task: asyncio.Task):
+        name = self._tasks.pop(task)
+        # Wake up whoever is waiting for a free slot
+        while self._waiters:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+                break
+
+        if task.cancelled():
+            return
+        exception = task.exception()
+        if exception is not None:
+            self.failures[name] += 1
+            logging.error(
+                f"Exception occurred in listener {name}: ",
+                exc_info=(type(exception), exception, exception.__traceback__),
+            )
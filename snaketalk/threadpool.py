@@ -2,49 +2,243 @@ import asyncio
 import logging
 import threading
 import time
-from queue import Queue
+from collections import Counter, deque
+from concurrent.futures import Future
+from queue import Empty, Queue
+from typing import Callable, Dict, Optional
 
+from snaketalk.outbound import outbound_priority
 from snaketalk.scheduler import default_scheduler
+from snaketalk.utils import AsyncQueue, Priority
 from snaketalk.webhook_server import WebHookServer
 
 
+class TaskFuture(Future):
+    """Future representing a task that was added to the ThreadPool.
+
+    Besides the result or exception of the task, it keeps track of when the task was
+    submitted, started and finished. It can be awaited directly from an event loop.
+    """
+
+    def __init__(self, function: Callable, priority: int = Priority.NORMAL):
+        super().__init__()
+        self.function = function
+        self.priority = priority
+        self.submitted_at = time.perf_counter()
+        self.started_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+        # Set if whoever was waiting for this task gave up on it, e.g. on a timeout.
+        self.abandoned = False
+
+    def __await__(self):
+        return asyncio.wrap_future(self).__await__()
+
+    @property
+    def wait_time(self) -> Optional[float]:
+        """Seconds the task spent in the queue before a worker picked it up."""
+        if self.started_at is None:
+            return None
+        return self.started_at - self.submitted_at
+
+    @property
+    def run_time(self) -> Optional[float]:
+        """Seconds the task took to execute."""
+        if self.started_at is None or self.finished_at is None:
+            return None
+        return self.finished_at - self.started_at
+
+    @property
+    def total_time(self) -> Optional[float]:
+        """Seconds between submitting the task and its completion."""
+        if self.finished_at is None:
+            return None
+        return self.finished_at - self.submitted_at
+
+
+class PriorityLanes(Queue):
+    """Queue of (function, arguments, TaskFuture) tuples with one FIFO lane per
+    priority.
+
+    Tasks are taken from the lane with the highest priority first. To prevent
+    starvation, a task that has been waiting for longer than starvation_timeout is
+    taken first regardless of its priority, oldest first.
+    """
+
+    def __init__(self, starvation_timeout: float = 5.0):
+        self.starvation_timeout = starvation_timeout
+        super().__init__()
+
+    def _init(self, maxsize):
+        self.lanes = {priority: deque() for priority in sorted(Priority)}
+        self._size = 0
+
+    def _qsize(self):
+        return self._size
+
+    def _put(self, item):
+        priority = item[2].priority
+        if priority not in self.lanes:
+            # Support custom priorities as well, while keeping the lanes sorted.
+            self.lanes[priority] = deque()
+            self.lanes = dict(sorted(self.lanes.items()))
+        self.lanes[priority].append(item)
+        self._size += 1
+
+    def _get(self):
+        deadline = time.perf_counter() - self.starvation_timeout
+        lane = None
+        oldest = None
+        for tasks in self.lanes.values():
+            if not tasks:
+                continue
+            if lane is None:
+                lane = tasks
+            submitted_at = tasks[0][2].submitted_at
+            if submitted_at <= deadline and (oldest is None or submitted_at < oldest):
+                lane, oldest = tasks, submitted_at
+        self._size -= 1
+        return lane.popleft()
+
+    def oldest(self) -> Optional[float]:
+        """Returns when the oldest task in the queue was submitted, or None if the queue
+        is empty. Should be called with self.mutex held."""
+        heads = [tasks[0][2].submitted_at for tasks in self.lanes.values() if tasks]
+        return min(heads, default=None)
+
+
 class ThreadPool(object):
-    def __init__(self, num_workers: int):
+    def __init__(
+        self,
+        num_workers: int,
+        max_workers: Optional[int] = None,
+        scale_up_threshold: float = 0.05,
+        idle_timeout: float = 60.0,
+        starvation_timeout: float = 5.0,
+    ):
         """Threadpool class to easily specify a number of worker threads and assign work
         to any of them.
 
+        Tasks with a higher priority (lower value) are executed first, but tasks that
+        have been waiting for too long always get their turn.
+
+        If max_workers is larger than num_workers, the pool is elastic: it grows
+        whenever a task has been waiting in the queue for longer than
+        scale_up_threshold, and shrinks back to num_workers once the extra workers have
+        been idle for idle_timeout seconds.
+
         Arguments:
-        - num_workers: int, how many threads to run simultaneously.
+        - num_workers: int, how many threads to run simultaneously (at least).
+        - max_workers: int, how many threads to run at most. Defaults to num_workers.
+        - scale_up_threshold: float, queue wait time in seconds after which another
+            worker is started.
+        - idle_timeout: float, seconds after which an idle extra worker is stopped.
+        - starvation_timeout: float, seconds after which a waiting task is executed
+            before any tasks with a higher priority.
         """
         self.num_workers = num_workers
+        self.max_workers = max(num_workers, max_workers or num_workers)
+        self.scale_up_threshold = scale_up_threshold
+        self.idle_timeout = idle_timeout
         self.alive = False
-        self._queue = Queue()
-        self._busy_workers = Queue()
+        self._queue = PriorityLanes(starvation_timeout)
         self._threads = []
+        # Worker bookkeeping, protected by a single lock. The condition wakes up the
+        # scaler thread whenever something relevant changes.
+        self._lock = threading.Lock()
+        self._scale_condition = threading.Condition(self._lock)
+        self._num_threads = 0
+        self._num_busy = 0
+        self._scaler: Optional[threading.Thread] = None
+        # Number of failed tasks per function name
+        self._failures = Counter()
+        self._failures_lock = threading.Lock()
+        # Signals the webhook server thread to stop, without it having to poll
+        self._stop_signal = AsyncQueue()
+
+    @property
+    def elastic(self) -> bool:
+        return self.max_workers > self.num_workers
 
-    def add_task(self, function, *args):
-        self._queue.put((function, args))
+    def add_task(self, function, *args, priority: int = Priority.NORMAL) -> TaskFuture:
+        """Adds a task to the queue, which will be executed by the first available
+        worker.
+
+        Returns a TaskFuture that will hold the result of the task.
+        """
+        future = TaskFuture(function, priority)
+        self._queue.put((function, args, future))
+        if self.elastic:
+            with self._lock:
+                self._scale_condition.notify()
+        return future
 
     def get_busy_workers(self):
-        return self._busy_workers.qsize()
+        return self._num_busy
+
+    def get_queue_length(self) -> int:
+        """Returns the number of tasks waiting for a worker."""
+        return self._queue.qsize()
+
+    def get_queue_age(self) -> Optional[float]:
+        """Returns how many seconds the oldest queued task has been waiting, or None if
+        the queue is empty."""
+        return self._oldest_task_age()
+
+    def get_num_workers(self):
+        """Returns the number of worker threads that are currently running."""
+        return self._num_threads
+
+    def get_failures(self) -> Dict[str, int]:
+        """Returns the number of tasks that raised an exception, per function name."""
+        with self._failures_lock:
+            return dict(self._failures)
 
     def start(self):
         self.alive = True
         # Spawn num_workers threads that will wait for work to be added to the queue
-        for _ in range(self.num_workers):
-            worker = threading.Thread(target=self.handle_work)
-            self._threads.append(worker)
-            worker.start()
+        with self._lock:
+            for _ in range(self.num_workers):
+                self._spawn_worker()
+            if self.elastic:
+                self._start_scaler()
+
+    def resize(
+        self, num_workers: Optional[int] = None, max_workers: Optional[int] = None
+    ):
+        """Changes the minimum and/or maximum number of workers of a running pool.
+
+        Missing workers are started immediately, superfluous ones stop as soon as they
+        are done with their current task.
+        """
+        with self._lock:
+            if num_workers is not None:
+                self.num_workers = num_workers
+            self.max_workers = max(self.num_workers, max_workers or self.max_workers)
+            excess = 0
+            if self.alive:
+                while self._num_threads < self.num_workers:
+                    self._spawn_worker()
+                excess = self._num_threads - self.max_workers
+                if self.elastic and not (self._scaler and self._scaler.is_alive()):
+                    self._start_scaler()
+            self._scale_condition.notify()
+
+        for _ in range(excess):
+            self.add_task(self._retire_thread, priority=Priority.LOW)
 
     def stop(self):
         """Signals all threads that they should stop and waits for them to finish."""
-        self.alive = False
-        # Signal every thread that it's time to stop
-        for _ in range(self.num_workers):
-            self._queue.put((self._stop_thread, tuple()))
+        with self._lock:
+            self.alive = False
+            self._scale_condition.notify_all()
+            num_threads = self._num_threads
+        self._stop_signal.put(None)
+        # Signal every thread that it's time to stop, after the tasks already queued.
+        for _ in range(num_threads):
+            self.add_task(self._stop_thread, priority=Priority.LOW)
         # Wait for each of them to finish
         logging.info("Stopping threadpool, waiting for threads...")
-        for thread in self._threads:
+        for thread in list(self._threads):
             thread.join()
         logging.info("Threadpool stopped.")
 
@@ -52,16 +246,147 @@ class ThreadPool(object):
         """Used to stop individual threads."""
         return
 
-    def handle_work(self):
+    def _retire_thread(self):
+        """Used to stop superfluous threads after the pool was resized."""
+        return
+
+    def _start_scaler(self):
+        # Should be called with self._lock held.
+        self._scaler = threading.Thread(target=self._scale_up_loop, daemon=True)
+        self._scaler.start()
+
+    def _spawn_worker(self):
+        # Should be called with self._lock held.
+        self._num_threads += 1
+        self._threads = [thread for thread in self._threads if thread.is_alive()]
+        worker = threading.Thread(target=self._run_worker)
+        self._threads.append(worker)
+        worker.start()
+
+    def _run_worker(self):
+        died = True
+        retired = False
+        try:
+            retired = self.handle_work()
+            died = False
+        finally:
+            with self._lock:
+                if not retired:
+                    self._num_threads -= 1
+                # If a worker dies while the pool is running, replace it so that we
+                # don't lose capacity.
+                if died and self.alive:
+                    logging.error(
+                        "Worker thread died unexpectedly, starting a new one."
+                    )
+                    self._spawn_worker()
+
+    def _should_retire(self, timed_out: bool) -> bool:
+        """Whether the calling worker should stop because the pool has too many
+        workers. If so, the worker is no longer counted from this moment on, so that
+        two workers can't both decide to retire the last superfluous thread."""
+        with self._lock:
+            limit = self.num_workers if timed_out else self.max_workers
+            if self._num_threads > limit:
+                self._num_threads -= 1
+                self._scale_condition.notify()
+                return True
+        return False
+
+    def _oldest_task_age(self) -> Optional[float]:
+        with self._queue.mutex:
+            submitted_at = self._queue.oldest()
+        if submitted_at is None:
+            return None
+        return time.perf_counter() - submitted_at
+
+    def _scale_up_loop(self):
+        """Starts extra workers whenever tasks have to wait too long, as long as the
+        maximum number of workers allows it. Sleeps while there is nothing to do."""
+        with self._lock:
+            while self.alive:
+                if not self.elastic or self._num_threads >= self.max_workers:
+                    self._scale_condition.wait()
+                    continue
+
+                age = self._oldest_task_age()
+                if age is None:
+                    self._scale_condition.wait()
+                elif age >= self.scale_up_threshold:
+                    logging.debug(f"Task waited {age:.3f}s, adding a worker thread.")
+                    self._spawn_worker()
+                    # Give the new worker a chance to pick up the task
+                    self._scale_condition.wait(self.scale_up_threshold)
+                else:
+                    self._scale_condition.wait(self.scale_up_threshold - age)
+
+    def handle_work(self) -> bool:
+        """Runs tasks until the pool is stopped. Returns True if the worker stopped
+        because the pool had too many workers."""
         while self.alive:
-            # Wait for a new task (blocking)
-            function, arguments = self._queue.get()
+            # Wait for a new task (blocking). Extra workers of an elastic pool stop
+            # once they've been idle for too long.
+            try:
+                function, arguments, future = self._queue.get(
+                    timeout=self.idle_timeout if self.elastic else None
+                )
+            except Empty:
+                if self._should_retire(timed_out=True):
+                    return True
+                continue
+
+            # Skip tasks that were cancelled while waiting in the queue
+            if not future.set_running_or_notify_cancel():
+                self._queue.task_done()
+                continue
+            if function == self._retire_thread:
+                future.set_result(None)
+                self._queue.task_done()
+                if self._should_retire(timed_out=False):
+                    return True
+                continue
+
             # Notify the pool that we started working
-            self._busy_workers.put(1)
-            function(*arguments)
-            # Notify the pool that we finished working
-            self._queue.task_done()
-            self._busy_workers.get()
+            with self._lock:
+                self._num_busy += 1
+            future.started_at = time.perf_counter()
+            # Requests made by this task are sent according to its priority
+            outbound_priority.set(future.priority)
+            try:
+                result = function(*arguments)
+                future.finished_at = time.perf_counter()
+                future.set_result(result)
+            except Exception as e:
+                # A failing task shouldn't take down the worker
+                future.finished_at = time.perf_counter()
+                future.set_exception(e)
+                self._record_failure(function)
+            except BaseException as e:
+                # Anything else (e.g. SystemExit) does end this thread, but it will be
+                # replaced by _run_worker.
+                future.finished_at = time.perf_counter()
+                future.set_exception(e)
+                self._record_failure(function)
+                raise
+            finally:
+                if future.abandoned:
+                    logging.warning(
+                        f"Abandoned task {getattr(function, 'name', function)} finished"
+                        f" after {time.perf_counter() - future.started_at:.3f}s."
+                    )
+                # Notify the pool that we finished working
+                self._queue.task_done()
+                with self._lock:
+                    self._num_busy -= 1
+        return False
+
+    def _record_failure(self, function: Callable):
+        name = getattr(function, "name", None) or getattr(
+            function, "__qualname__", repr(function)
+        )
+        logging.exception(f"Exception occurred in threadpool task {name}: ")
+        with self._failures_lock:
+            self._failures[name] += 1
 
     def start_scheduler_thread(self, trigger_period: float):
         def run_pending():
@@ -69,18 +394,22 @@ class ThreadPool(object):
             while self.alive:
                 time.sleep(trigger_period)
                 default_scheduler.run_pending()
+            if default_scheduler.threadpool is self:
+                default_scheduler.threadpool = None
             logging.info("Scheduler thread stopped.")
 
-        self.add_task(run_pending)
+        # Scheduled jobs will be executed by this pool, according to their priority.
+        default_scheduler.threadpool = self
+        self.add_task(run_pending, priority=Priority.HIGH)
 
     def start_webhook_server_thread(self, webhook_server: WebHookServer):
         async def start_server():
             logging.info("Webhook server thread started.")
             await webhook_server.start()
-            while self.alive:
-                # We just use this to keep the loop running in a non-blocking way
-                await asyncio.sleep(0.001)
+            # Keep the loop running until the threadpool is stopped. Put the signal
+            # back in case anything else is waiting for it as well.
+            self._stop_signal.put(await self._stop_signal.get_async())
             await webhook_server.stop()
             logging.info("Webhook server thread stopped.")
 
-        self.add_task(asyncio.run, start_server())
+        self.add_task(asyncio.run, start_server(), priority=Priority.HIGH)
@@ -0,0 +1,114 @@
+import asyncio
+import os
+import time
+from typing import BinaryIO, Callable, Optional
+
+from aiohttp.abc import AbstractStreamWriter
+from aiohttp.payload import Payload
+
+# Number of bytes to read from a file at a time.
+CHUNK_SIZE = 2**16
+
+
+class UploadProgress:
+    """Progress of a single file upload, passed to the progress callback of
+    `Driver.upload_files` after every chunk that was sent.
+
+    Arguments:
+    - filename: str, name of the file that is being uploaded.
+    - total: int, size of the file in bytes.
+    """
+
+    __slots__ = ("filename", "sent", "total", "started_at")
+
+    def __init__(self, filename: str, total: int):
+        self.filename = filename
+        self.sent = 0
+        self.total = total
+        self.started_at = time.perf_counter()
+
+    @property
+    def done(self) -> bool:
+        return self.sent >= self.total
+
+    @property
+    def elapsed(self) -> float:
+        return time.perf_counter() - self.started_at
+
+    @property
+    def throughput(self) -> float:
+        """Average number of bytes sent per second so far."""
+        elapsed = self.elapsed
+        return self.sent / elapsed if elapsed > 0 else 0.0
+
+    def __repr__(self):
+        return (
+            f"UploadProgress({self.filename}: {self.sent}/{self.total} bytes,"
+            f" {self.throughput / 1e6:.2f} MB/s)"
+        )
+
+
+class ProgressReader:
+    """Wraps an open (binary) file, and keeps track of how much of it was read.
+
+    requests and aiohttp stream a request body from such a file object in chunks, so
+    the file never has to be loaded into memory entirely.
+
+    Arguments:
+    - file: the file object to read from.
+    - filename: str, name to report progress for.
+    - callback: function that is called with the UploadProgress after every read.
+    """
+
+    def __init__(
+        self,
+        file: BinaryIO,
+        filename: str,
+        callback: Optional[Callable[[UploadProgress], None]] = None,
+    ):
+        self.file = file
+        self.callback = callback
+        self.progress = UploadProgress(filename, os.fstat(file.fileno()).st_size)
+
+    def __len__(self):
+        # Used by requests to set the Content-Length
+        return self.progress.total
+
+    def __bool__(self):
+        # Even an empty file is a request body, rather than no body at all.
+        return True
+
+    def read(self, size: int = -1) -> bytes:
+        chunk = self.file.read(size)
+        self.progress.sent += len(chunk)
+        if self.callback is not None and chunk:
+            self.callback(self.progress)
+        return chunk
+
+    def seek(self, offset: int, whence: int = os.SEEK_SET) -> int:
+        # When a request is retried, the file is sent from the start again.
+        position = self.file.seek(offset, whence)
+        self.progress.sent = position
+        return position
+
+    def tell(self) -> int:
+        return self.file.tell()
+
+
+class ProgressPayload(Payload):
+    """aiohttp payload that streams a ProgressReader. Unlike aiohttp's own file
+    payloads, it starts from the beginning of the file every time it is written, so the
+    request can be retried."""
+
+    def __init__(self, reader: ProgressReader, **kwargs):
+        super().__init__(reader, **kwargs)
+        self._size = len(reader)
+
+    async def write(self, writer: AbstractStreamWriter):
+        loop = asyncio.get_running_loop()
+        self._value.seek(0)
+        # Reading the file could block the event loop, so do it in a thread.
+        chunk = await loop.run_in_executor(None, self._value.read, CHUNK_SIZE)
+        while chunk:
+            await writer.write(chunk)
+            chunk = await loop.run_in_executor(None, self._value.read, CHUNK_SIZE)
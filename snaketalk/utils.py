@@ -1,4 +1,15 @@
 import asyncio
+import queue
+from collections import deque
+from enum import IntEnum
+
+
+class Priority(IntEnum):
+    """Priority of a task in the ThreadPool. Lower values are executed first."""
+
+    HIGH = 0
+    NORMAL = 1
+    LOW = 2
 
 
 def spaces(num: int):
@@ -11,3 +22,58 @@ def completed_future():
     future = asyncio.Future()
     future.set_result(True)
     return future
+
+
+def in_event_loop() -> bool:
+    """Whether the calling thread is running an asyncio event loop. Such a thread must
+    not block waiting for anything that a coroutine on that loop still has to do."""
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        return False
+    return True
+
+
+def _wake_up(waiter: asyncio.Future):
+    if not waiter.done():
+        waiter.set_result(None)
+
+
+class AsyncQueue(queue.Queue):
+    """A regular thread-safe Queue, which can additionally be awaited from an asyncio
+    event loop through `get_async`.
+
+    Rather than polling, waiting coroutines are woken up through
+    `loop.call_soon_threadsafe` whenever an item is added, from whichever thread.
+    """
+
+    def _init(self, maxsize: int):
+        super()._init(maxsize)
+        self._async_waiters = deque()
+
+    def _put(self, item):
+        # This is called with self.mutex held, so we can safely wake up the waiters.
+        super()._put(item)
+        while self._async_waiters:
+            waiter = self._async_waiters.popleft()
+            waiter.get_loop().call_soon_threadsafe(_wake_up, waiter)
+
+    async def get_async(self):
+        """Removes and returns an item from the queue, waiting until one is available
+        without blocking the event loop."""
+        loop = asyncio.get_running_loop()
+        while True:
+            with self.mutex:
+                if self._qsize():
+                    item = self._get()
+                    self.not_full.notify()
+                    return item
+                waiter = loop.create_future()
+                self._async_waiters.append(waiter)
+
+            try:
+                await waiter
+            finally:
+                with self.mutex:
+                    if waiter in self._async_waiters:
+                        self._async_waiters.remove(waiter)
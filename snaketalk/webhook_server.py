@@ -1,11 +1,11 @@
 import asyncio
 import random
 import time
-from queue import Empty, Queue
-from typing import Optional
+from typing import Callable, Optional
 
 from aiohttp import web
 
+from snaketalk.utils import AsyncQueue
 from snaketalk.wrappers import ActionEvent, WebHookEvent
 
 
@@ -29,25 +29,35 @@ def handle_json_error(func):
 
 class WebHookServer:
     """A small server that listens to incoming webhooks and forwards them to the bot
-    EventHandler in the main thread/process."""
+    EventHandler in the main thread/process.
+
+    The server can either run on its own event loop in a separate thread, or on the
+    same event loop as the EventHandler. If an admission check is given, webhooks are
+    rejected with a 503 whenever it returns False.
+    """
 
     def __init__(
         self,
         url: str,
         port: int,
-        event_queue: Optional[Queue] = None,
-        response_queue: Optional[Queue] = None,
+        event_queue: Optional[AsyncQueue] = None,
+        response_queue: Optional[AsyncQueue] = None,
+        admission_check: Optional[Callable[[], bool]] = None,
     ):
         self.app = web.Application()
         self.app_runner = web.AppRunner(self.app)
         self.url = url
         self.port = port
         self.running = False
+        # The event loop the server is running on, set once started.
+        self.loop: Optional[asyncio.AbstractEventLoop] = None
+        self._responses_task: Optional[asyncio.Task] = None
 
         # Create queues if necessary.
-        self.event_queue = event_queue or Queue()
-        self.response_queue = response_queue or Queue()
+        self.event_queue = event_queue or AsyncQueue()
+        self.response_queue = response_queue or AsyncQueue()
         self.response_handlers = {}
+        self.admission_check = admission_check
 
         # Register /hooks endpoint
         self.app.add_routes([web.post("/hooks/{webhook_id}", self.process_webhook)])
@@ -57,35 +67,65 @@ class WebHookServer:
         await self.app_runner.setup()
         site = web.TCPSite(self.app_runner, webhook_host_ip, self.port)
         await site.start()
+        self.loop = asyncio.get_running_loop()
         self.running = True
 
         # Schedule the response awaiting function to the same loop as the web server
-        asyncio.get_event_loop().create_task(self._obtain_responses_loop())
+        self._responses_task = self.loop.create_task(self._obtain_responses_loop())
 
     async def stop(self):
-        self.app_runner.cleanup()
+        if self._responses_task:
+            self._responses_task.cancel()
+        await self.app_runner.cleanup()
         self.running = False
 
+    def respond(self, request_id: str, response):
+        """Passes the response to the request with the given id. Can be called from any
+        thread.
+
+        If called from the loop the server runs on, the waiting request is resolved
+        immediately. Otherwise, this is scheduled on that loop.
+        """
+        if self.loop is None:
+            # The server hasn't started yet, the response loop will pick this up.
+            self.response_queue.put((request_id, response))
+            return
+
+        try:
+            current_loop = asyncio.get_running_loop()
+        except RuntimeError:
+            current_loop = None
+
+        if current_loop is self.loop:
+            self._set_response(request_id, response)
+        else:
+            self.loop.call_soon_threadsafe(self._set_response, request_id, response)
+
+    def _set_response(self, request_id: str, response):
+        try:
+            if not self.response_handlers[request_id].cancelled():
+                self.response_handlers[request_id].set_result(response)
+            del self.response_handlers[request_id]
+        except KeyError:
+            # If this handler already received a response, we can skip this.
+            pass
+
     async def _obtain_responses_loop(self):
         """Checks the response queue for incoming responses and passes them on to the
         functions awaiting them."""
         while True:
-            try:
-                request_id, response = self.response_queue.get_nowait()
-                print(f"Received response {response} for request {request_id}")
-                try:
-                    if not self.response_handlers[request_id].cancelled():
-                        self.response_handlers[request_id].set_result(response)
-                    del self.response_handlers[request_id]
-                except KeyError:
-                    # If this handler already received a response, we can skip this.
-                    pass
-            except Empty:
-                pass
-            await asyncio.sleep(0.0001)
+            request_id, response = await self.response_queue.get_async()
+            print(f"Received response {response} for request {request_id}")
+            self._set_response(request_id, response)
 
     @handle_json_error
     async def process_webhook(self, request: web.Request):
+        # Reject the request right away if the bot is too busy to handle it
+        if self.admission_check is not None and not self.admission_check():
+            return web.json_response(
+                {"status": "failed", "reason": "Bot is busy."}, status=503
+            )
+
         data = await request.json()
         webhook_id = request.match_info.get("webhook_id", "")
         if "trigger_id" in data:
@@ -100,12 +140,14 @@ class WebHookServer:
                 request_id=f"{time.time()}_{random.randint(0, 10000)}",
                 webhook_id=webhook_id,
             )
-        self.event_queue.put(event)
-
-        # Register a Future object that will signal us when a response has arrived,
-        # and wait for it to complete.
+        # Register a Future object that will signal us when a response has arrived.
+        # This has to happen before passing on the event, since the response might
+        # arrive right away.
         await_response = asyncio.get_event_loop().create_future()
         self.response_handlers[event.request_id] = await_response
+
+        # Pass on the event and wait for the response to complete.
+        self.event_queue.put(event)
         await await_response
 
         result = await_response.result()
@@ -0,0 +1,131 @@
+import time
+from unittest import mock
+
+from snaketalk import Plugin, Priority, listen_to
+from snaketalk.admission import ADMIT, BUSY, DROP, AdmissionController
+from snaketalk.driver import Driver
+from snaketalk.threadpool import ThreadPool
+
+
+def create_function(priority: Priority):
+    def function(self, message):
+        pass
+
+    return listen_to("pattern", priority=priority)(function)
+
+
+class SharedPlugin(Plugin):
+    @listen_to("shared", priority=Priority.LOW)
+    def low(self, message):
+        pass
+
+    @listen_to("shared")
+    def normal(self, message):
+        pass
+
+
+class IsolatedPlugin(Plugin):
+    num_threads = 1
+
+    @listen_to("isolated", priority=Priority.LOW)
+    def low(self, message):
+        pass
+
+    @listen_to("isolated")
+    def normal(self, message):
+        pass
+
+
+class CPUPlugin(Plugin):
+    @listen_to("compute", priority=Priority.LOW, executor="process")
+    def compute(self, message):
+        pass
+
+
+class TestAdmissionController:
+    def test_queue_length(self):
+        pool = ThreadPool(num_workers=1)
+        controller = AdmissionController(pool, max_queue_length=2)
+        high, normal, low = [
+            create_function(priority)
+            for priority in [Priority.HIGH, Priority.NORMAL, Priority.LOW]
+        ]
+
+        async def coroutine(self, message):
+            pass
+
+        coroutine = listen_to("pattern", priority=Priority.LOW)(coroutine)
+
+        # The pool isn't started, so tasks simply accumulate in the queue.
+        assert controller.get_load_level() == 0
+        assert controller.admit(low) == ADMIT
+
+        for _ in range(2):
+            pool.add_task(print)
+        assert controller.get_load_level() == 1
+        assert [controller.admit(f) for f in [high, normal, low]] == [
+            ADMIT,
+            ADMIT,
+            DROP,
+        ]
+        assert controller.admit(coroutine) == ADMIT
+        assert not controller.admit_webhook()
+
+        for _ in range(3):
+            pool.add_task(print)
+        assert controller.get_load_level() == 2
+        assert [controller.admit(f) for f in [high, normal, low]] == [
+            ADMIT,
+            BUSY,
+            DROP,
+        ]
+        assert controller.get_stats() == {DROP: 2, BUSY: 1, "webhook": 1}
+
+    def test_queue_age(self):
+        pool = ThreadPool(num_workers=1)
+        controller = AdmissionController(pool, max_queue_age=0.05)
+        pool.add_task(print)
+        assert controller.admit_webhook()
+        time.sleep(0.05)
+        assert not controller.admit_webhook()
+
+    def test_disabled(self):
+        pool = ThreadPool(num_workers=1)
+        controller = AdmissionController(pool)
+        for _ in range(100):
+            pool.add_task(print)
+        assert controller.admit(create_function(Priority.LOW)) == ADMIT
+        assert controller.admit_webhook()
+        assert controller.get_stats() == {}
+
+    def test_plugin_threadpools(self):
+        driver = Driver()
+        SharedPlugin().initialize(driver)
+        isolated = IsolatedPlugin().initialize(driver)
+        controller = AdmissionController(driver.threadpool, max_queue_length=2)
+
+        # A backlog in the plugin's own pool only affects that plugin
+        for _ in range(2):
+            isolated.threadpool.add_task(print)
+        assert controller.admit(IsolatedPlugin.low) == DROP
+        assert controller.admit(SharedPlugin.low) == ADMIT
+
+        # And a backlog in the shared pool doesn't affect it at all
+        for _ in range(4):
+            driver.threadpool.add_task(print)
+        assert controller.admit(SharedPlugin.normal) == BUSY
+        assert controller.admit(IsolatedPlugin.normal) == ADMIT
+        assert not controller.admit_webhook()
+
+    def test_process_pool(self):
+        driver = Driver()
+        CPUPlugin().initialize(driver)
+        controller = AdmissionController(
+            driver.threadpool, max_queue_length=2, process_pool=driver.process_pool
+        )
+
+        for _ in range(4):
+            driver.threadpool.add_task(print)
+        assert controller.admit(CPUPlugin.compute) == ADMIT
+        with mock.patch.object(driver.process_pool, "get_queue_length", return_value=2):
+            assert controller.admit(CPUPlugin.compute) == DROP
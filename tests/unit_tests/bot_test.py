@@ -51,3 +51,31 @@ class TestBot:
 
         for plugin in bot.plugins:
             plugin.on_stop.assert_called_once()
+
+    @mock.patch("snaketalk.driver.Driver.login")
+    @mock.patch("snaketalk.driver.Driver.init_websocket")
+    @mock.patch("snaketalk.threadpool.ThreadPool.start_webhook_server_thread")
+    def test_run_single_loop(self, start_webhook_server_thread, init_websocket, login):
+        bot = Bot(
+            plugins=[ExamplePlugin()],
+            settings=Settings(WEBHOOK_HOST_ENABLED=True, WEBHOOK_SINGLE_LOOP=True),
+        )
+        bot.run()
+        init_websocket.assert_called_once()
+        # The webhook server should not occupy a worker thread
+        start_webhook_server_thread.assert_not_called()
+        bot.stop()
+
+    @mock.patch("snaketalk.driver.Driver.login")
+    @mock.patch("snaketalk.driver.Driver.init_websocket")
+    def test_stop_closes_session(self, init_websocket, login):
+        bot = Bot(plugins=[ExamplePlugin()], settings=Settings())
+        bot.run()
+
+        async def get_session():
+            return bot.driver.async_client.session
+
+        session = bot.loop.run_until_complete(get_session())
+        assert not session.closed
+        bot.stop()
+        assert session.closed
@@ -0,0 +1,227 @@
+import asyncio
+import time
+from unittest import mock
+
+from mattermostdriver.endpoints.channels import Channels
+from mattermostdriver.endpoints.posts import Posts
+from mattermostdriver.endpoints.users import Users
+
+from snaketalk.cache import MetadataCache, ThreadCache, TTLCache
+
+from .driver_test import create_driver, fake_server
+
+
+class TestTTLCache:
+    def test_get_set(self):
+        cache = TTLCache(max_size=2, ttl=10)
+        assert cache.get("a") is None
+        cache.set("a", 1)
+        assert cache.get("a") == 1
+        assert cache.get_stats() == {"hits": 1, "misses": 1, "size": 1}
+
+        cache.invalidate("a")
+        assert cache.get("a", default=0) == 0
+        cache.invalidate("a")
+
+    def test_lru(self):
+        cache = TTLCache(max_size=2, ttl=10)
+        cache.set("a", 1)
+        cache.set("b", 2)
+        # Using a makes b the least recently used entry
+        cache.get("a")
+        cache.set("c", 3)
+        assert len(cache) == 2
+        assert cache.get("b") is None
+        assert cache.get("a") == 1
+
+        cache.invalidate()
+        assert len(cache) == 0
+
+    def test_ttl(self):
+        cache = TTLCache(ttl=0.1)
+        cache.set("a", 1)
+        assert cache.get("a") == 1
+        time.sleep(0.15)
+        assert cache.get("a") is None
+        assert len(cache) == 0
+
+
+class TestMetadataCache:
+    def test_users(self):
+        cache = MetadataCache()
+        cache.set_user({"id": "a", "email": "a@b.c"})
+        assert cache.get_users(["a", "b"]) == (
+            {"a": {"id": "a", "email": "a@b.c"}},
+            ["b"],
+        )
+
+        # Events only update the fields they contain
+        cache.handle_event(
+            {"event": "user_updated", "data": {"user": {"id": "a", "nickname": "A"}}}
+        )
+        assert cache.get_user("a") == {"id": "a", "email": "a@b.c", "nickname": "A"}
+        # Users that aren't cached aren't added
+        cache.handle_event({"event": "user_updated", "data": {"user": {"id": "b"}}})
+        assert cache.get_user("b") is None
+
+        cache.invalidate_user("a")
+        assert cache.get_user("a") is None
+
+    def test_channels(self):
+        cache = MetadataCache()
+        channel = {"id": "id", "team_id": "team", "name": "town-square"}
+        cache.set_channel(channel)
+        assert cache.get_channel("id") == channel
+        assert cache.get_channel_by_name("team", "town-square") == channel
+        assert cache.get_channel_by_name("other_team", "town-square") is None
+
+        # After a rename, only the new name is known
+        cache.handle_event(
+            {
+                "event": "channel_updated",
+                "data": {"channel": {"id": "id", "name": "off-topic"}},
+            }
+        )
+        assert cache.get_channel_by_name("team", "town-square") is None
+        assert cache.get_channel_by_name("team", "off-topic")["id"] == "id"
+        assert cache.channel_names.get_stats()["hits"] == 2
+
+        cache.handle_event({"event": "channel_deleted", "data": {"channel_id": "id"}})
+        assert cache.get_channel("id") is None
+        assert cache.get_channel_by_name("team", "off-topic") is None
+
+
+def create_post(id, create_at, root_id="", message="hi"):
+    return {"id": id, "create_at": create_at, "root_id": root_id, "message": message}
+
+
+def create_thread():
+    return {
+        "order": ["c", "root", "b"],
+        "posts": {
+            "root": create_post("root", 10),
+            "c": create_post("c", 30, root_id="root"),
+            "b": create_post("b", 20, root_id="root"),
+        },
+        "next_post_id": "",
+    }
+
+
+class TestThreadCache:
+    def test_get_set(self):
+        cache = ThreadCache()
+        assert cache.get("b") is None
+        thread = cache.set("b", create_thread())
+        assert thread["order"] == ["root", "b", "c"]
+        assert thread["next_post_id"] == ""
+
+        # Any post of the thread can be used to find it
+        for post_id in ["root", "b", "c"]:
+            assert cache.get(post_id) == thread
+        assert cache.get_stats() == {"hits": 3, "misses": 1, "size": 1}
+
+        # Modifying the result doesn't affect the cache
+        thread["order"].append("d")
+        assert cache.get("root")["order"] == ["root", "b", "c"]
+
+    def test_events(self):
+        cache = ThreadCache()
+        cache.set("root", create_thread())
+
+        def event(action, post):
+            cache.handle_event({"event": action, "data": {"post": post}})
+
+        event("posted", create_post("d", 40, root_id="root"))
+        # Posts are inserted in order, even if they arrive out of order
+        event("posted", create_post("a", 15, root_id="root"))
+        # Posts of other threads are ignored
+        event("posted", create_post("x", 50, root_id="other"))
+        assert cache.get("d")["order"] == ["root", "a", "b", "c", "d"]
+        assert cache.get("x") is None
+
+        event("post_edited", create_post("b", 20, root_id="root", message="edited"))
+        assert cache.get("root")["posts"]["b"]["message"] == "edited"
+        assert cache.get("root")["order"] == ["root", "a", "b", "c", "d"]
+
+        event("post_deleted", create_post("c", 30, root_id="root"))
+        assert cache.get("root")["order"] == ["root", "a", "b", "d"]
+        assert cache.get("c") is None
+
+        # Deleting the root post deletes the entire thread
+        event("post_deleted", create_post("root", 10))
+        assert cache.get("b") is None
+        assert cache._roots == {}
+
+    def test_eviction(self):
+        cache = ThreadCache(max_size=1, ttl=0.1)
+        cache.set("root", create_thread())
+        cache.set("other", {"posts": {"other": create_post("other", 1)}})
+        assert cache.get("root") is None
+        assert cache.get("other") is not None
+        assert set(cache._roots) == {"other"}
+
+        time.sleep(0.15)
+        assert cache.get("other") is None
+        assert len(cache) == 0
+
+
+class TestDriverCache:
+    def test_get_user_info(self):
+        driver = create_driver(port=3290)
+        with mock.patch.object(Users, "get_user", return_value={"id": "a"}) as get_user:
+            assert driver.get_user_info("a") == {"id": "a"}
+            assert driver.get_user_info("a") == {"id": "a"}
+            get_user.assert_called_once_with("a")
+
+        with mock.patch.object(
+            Users, "get_users_by_ids", return_value=[{"id": "b"}, {"id": "c"}]
+        ) as get_users:
+            users = driver.get_users_info(["a", "b", "c"])
+            # Only the missing users are requested, in one go
+            get_users.assert_called_once_with(["b", "c"])
+        assert users == {"a": {"id": "a"}, "b": {"id": "b"}, "c": {"id": "c"}}
+        assert driver.cache.users.get_stats() == {"hits": 2, "misses": 3, "size": 3}
+
+    def test_get_channel_info(self):
+        driver = create_driver(port=3290)
+        channel = {"id": "id", "team_id": "team", "name": "off-topic"}
+        with mock.patch.object(
+            Channels, "get_channel_by_name", return_value=channel
+        ) as get_channel_by_name:
+            assert driver.get_channel_by_name("team", "off-topic") == channel
+            get_channel_by_name.assert_called_once_with("team", "off-topic")
+        # The channel can now be found by id as well
+        with mock.patch.object(Channels, "get_channel") as get_channel:
+            assert driver.get_channel_info("id") == channel
+            get_channel.assert_not_called()
+
+    def test_get_thread(self):
+        driver = create_driver(port=3290)
+        with mock.patch.object(
+            Posts, "get_thread", return_value=create_thread()
+        ) as get_thread:
+            assert driver.get_thread("c")["order"] == ["root", "b", "c"]
+            with mock.patch.object(
+                Posts, "create_post", return_value=create_post("d", 40, "root")
+            ):
+                driver.create_post("channel", "hi", root_id="root")
+            # Our own reply was added to the cached thread
+            assert driver.get_thread("root")["order"] == ["root", "b", "c", "d"]
+            get_thread.assert_called_once_with("c")
+
+    def test_async(self):
+        driver = create_driver(port=3290)
+
+        async def run():
+            async with fake_server(3290) as requests:
+                for _ in range(3):
+                    await driver.get_user_info_async("a")
+                    await driver.get_channel_info_async("b")
+                await driver.async_client.close()
+            return requests
+
+        requests = asyncio.run(run())
+        assert [path for _, path, _, _ in requests] == [
+            "/api/v4/users/a",
+            "/api/v4/channels/b",
+        ]
@@ -0,0 +1,153 @@
+import asyncio
+import threading
+import time
+
+import pytest
+
+from snaketalk.coalesce import PostCoalescer, split_message
+
+from .driver_test import create_driver, fake_server
+from .event_handler_test import create_message
+
+
+def test_split_message():
+    assert split_message("hello", 10) == ["hello"]
+    # Prefers splitting at newlines
+    assert split_message("hello\nworld!", 10) == ["hello", "world!"]
+    assert split_message("a" * 25, 10) == ["a" * 10, "a" * 10, "a" * 5]
+
+
+class TestPostCoalescer:
+    def test_merge(self):
+        coalescer = PostCoalescer(0.1, max_length=10)
+        assert coalescer.merge(["a", "b", "c"]) == (["a\nb\nc"], [0, 0, 0])
+        assert coalescer.merge(["hello", "world", "!"]) == (
+            ["hello", "world\n!"],
+            [0, 1, 1],
+        )
+        # Messages that are too long by themselves are split as well
+        assert coalescer.merge(["a", "b" * 15]) == (["a", "b" * 10, "b" * 5], [0, 1])
+
+    def test_submit(self):
+        coalescer = PostCoalescer(0.2)
+        sent = []
+
+        def send(text):
+            sent.append(text)
+            return {"message": text}
+
+        results = []
+        threads = [
+            threading.Thread(
+                target=lambda i=i: results.append(
+                    coalescer.submit("channel", "", f"message {i}", send)
+                )
+            )
+            for i in range(3)
+        ]
+        for thread in threads:
+            thread.start()
+            time.sleep(0.02)
+        # A different thread in the same channel gets its own post
+        other = coalescer.submit("channel", "root", "reply", send)
+        for thread in threads:
+            thread.join()
+
+        assert sorted(sent) == ["message 0\nmessage 1\nmessage 2", "reply"]
+        assert other == {"message": "reply"}
+        assert results == [{"message": "message 0\nmessage 1\nmessage 2"}] * 3
+        assert coalescer.received == 4
+        assert coalescer.sent == 2
+        # Nothing is left behind
+        assert coalescer._batches == {} and coalescer._tails == {}
+
+    def test_submit_error(self):
+        coalescer = PostCoalescer(0.05)
+
+        def send(text):
+            raise ValueError("Server is down")
+
+        with pytest.raises(ValueError):
+            coalescer.submit("channel", "", "hello", send)
+        assert coalescer._batches == {} and coalescer._tails == {}
+
+    def test_submit_async(self):
+        coalescer = PostCoalescer(0.1)
+        sent = []
+
+        async def send(text):
+            sent.append(text)
+            return {"message": text}
+
+        async def run():
+            first = await asyncio.gather(
+                *[coalescer.submit_async("channel", "", str(i), send) for i in range(3)]
+            )
+            second = await coalescer.submit_async("channel", "", "later", send)
+            return first, second
+
+        first, second = asyncio.run(run())
+        assert sent == ["0\n1\n2", "later"]
+        assert first == [{"message": "0\n1\n2"}] * 3
+        assert second == {"message": "later"}
+
+    def test_submit_from_event_loop(self):
+        coalescer = PostCoalescer(0.1)
+        sent = []
+
+        def send(text):
+            sent.append(text)
+            return {"message": text}
+
+        async def send_async(text):
+            return send(text)
+
+        async def submit():
+            # A coroutine that uses the blocking version by mistake
+            return coalescer.submit("channel", "", "blocking", send)
+
+        async def run():
+            return await asyncio.wait_for(
+                asyncio.gather(
+                    coalescer.submit_async("channel", "", "first", send_async),
+                    submit(),
+                    coalescer.submit_async("channel", "", "second", send_async),
+                ),
+                timeout=2,
+            )
+
+        # The blocking call doesn't join (and deadlock) the batch of the coroutines
+        results = asyncio.run(run())
+        assert results == [
+            {"message": "first\nsecond"},
+            {"message": "blocking"},
+            {"message": "first\nsecond"},
+        ]
+        assert sent == ["blocking", "first\nsecond"]
+        assert coalescer.received == 3
+        assert coalescer.sent == 2
+
+
+class TestDriverCoalescing:
+    def test_reply_to_async(self):
+        driver = create_driver(port=3289)
+        driver.coalescer = PostCoalescer(0.1)
+        message = create_message()
+
+        async def run():
+            async with fake_server(3289) as requests:
+                await asyncio.gather(
+                    driver.reply_to_async(message, "first"),
+                    driver.reply_to_async(message, "second"),
+                    # Posts with props are never merged
+                    driver.reply_to_async(message, "third", props={"a": "b"}),
+                )
+                await driver.async_client.close()
+            return requests
+
+        requests = asyncio.run(run())
+        messages = sorted(body["message"] for _, _, body, _ in requests)
+        assert messages == ["first\nsecond", "third"]
+
+    def test_disabled_by_default(self):
+        assert create_driver(port=3289).coalescer is None
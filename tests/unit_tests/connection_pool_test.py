@@ -0,0 +1,84 @@
+import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+from mattermostdriver.exceptions import NotEnoughPermissions
+
+from snaketalk.connection_pool import PooledAdapter
+
+from .driver_test import create_driver, fake_server
+
+
+class TestPooledAdapter:
+    def test_reuses_connections(self):
+        driver = create_driver(port=3292)
+
+        async def run():
+            async with fake_server(3292):
+                loop = asyncio.get_running_loop()
+                for i in range(5):
+                    await loop.run_in_executor(None, driver.users.get_user, str(i))
+
+        asyncio.run(run())
+        stats = driver.client.get_pool_stats()
+        # Only the first request had to open a connection
+        assert stats["hits"] == 4
+        assert stats["misses"] == 1
+
+    def test_pool_size(self):
+        driver = create_driver(port=3293)
+        driver.client.set_pool_size(2)
+
+        def get_users():
+            for i in range(5):
+                driver.users.get_user(str(i))
+
+        async def run():
+            async with fake_server(3293) as requests:
+                loop = asyncio.get_running_loop()
+                with ThreadPoolExecutor(4) as executor:
+                    await asyncio.gather(
+                        *[loop.run_in_executor(executor, get_users) for _ in range(4)]
+                    )
+            return requests
+
+        assert len(asyncio.run(run())) == 20
+        stats = driver.client.get_pool_stats()
+        # No more connections were opened than fit in the pool
+        assert stats["misses"] <= 2
+        assert stats["hits"] + stats["misses"] == 20
+
+    def test_errors(self):
+        driver = create_driver(port=3294)
+
+        async def run():
+            async with fake_server(3294):
+                await asyncio.get_running_loop().run_in_executor(
+                    None,
+                    driver.posts.create_ephemeral_post,
+                    {"user_id": "user", "post": {}},
+                )
+
+        # The same exceptions as raised by mattermostdriver
+        with pytest.raises(NotEnoughPermissions):
+            asyncio.run(run())
+
+    def test_default_size(self):
+        driver = create_driver(port=3294)
+        assert driver.client.adapter._pool_maxsize == 12
+
+    def test_grows_when_busy(self):
+        adapter = PooledAdapter(pool_size=1, pool_timeout=0.05)
+        pool = adapter.poolmanager.connection_from_url("http://localhost:3295")
+
+        first = pool._get_conn()
+        # Rather than waiting for the first connection forever, a new one is opened
+        start = time.perf_counter()
+        second = pool._get_conn()
+        assert time.perf_counter() - start < 0.5
+        # And both fit in the pool once they are returned
+        pool._put_conn(first)
+        pool._put_conn(second)
+        assert pool.pool.qsize() == 2
+        assert adapter.stats.get_stats()["grown"] == 1
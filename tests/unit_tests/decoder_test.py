@@ -0,0 +1,83 @@
+import json
+from unittest import mock
+
+import pytest
+
+from snaketalk.decoder import EventDecoder, get_json_loads
+
+from .event_handler_test import create_message
+
+
+def create_frame(user_id="131gkd5thbdxiq141b3514bgjh", event="posted"):
+    # Mimics the compact encoding of the mattermost server, including the nested
+    # JSON strings.
+    body = create_message().body
+    body["event"] = event
+    body["data"]["post"]["user_id"] = user_id
+    body["data"]["post"] = json.dumps(body["data"]["post"], separators=(",", ":"))
+    body["data"]["mentions"] = json.dumps(body["data"]["mentions"])
+    return json.dumps(body, separators=(",", ":"))
+
+
+class TestGetJsonLoads:
+    def test_backends(self):
+        assert get_json_loads("stdlib") is json.loads
+        with pytest.raises(ValueError):
+            get_json_loads("simplejson")
+
+        with mock.patch("snaketalk.decoder.orjson", None):
+            assert get_json_loads("auto") is json.loads
+            with pytest.raises(ImportError):
+                get_json_loads("orjson")
+
+
+class TestEventDecoder:
+    @pytest.mark.parametrize("backend", ["stdlib", "auto"])
+    def test_decode(self, backend):
+        decoder = EventDecoder(events=["posted"], json_backend=backend)
+
+        # The nested post and mentions should be decoded as well
+        event = decoder.decode(create_frame())
+        assert event == create_message().body
+        assert decoder.frames_parsed == 1
+
+        # Other event types are skipped without being parsed
+        with mock.patch.object(decoder, "loads") as loads:
+            assert decoder.decode('{"event":"typing","data":{},"seq":3}') is None
+            assert decoder.decode(json.dumps({"event": "status_change"})) is None
+            loads.assert_not_called()
+        assert decoder.frames_skipped == 2
+        assert decoder.frames_parsed == 1
+
+        # A false positive is still rejected after parsing
+        frame = json.dumps({"event": "hello", "data": {"event": "posted"}})
+        assert decoder.decode(frame) is None
+        assert decoder.frames_parsed == 2
+
+    def test_ignore_user_id(self):
+        decoder = EventDecoder(events=["posted"], ignore_user_id="my_user_id")
+        with mock.patch.object(decoder, "loads") as loads:
+            assert decoder.decode(create_frame(user_id="my_user_id")) is None
+            loads.assert_not_called()
+        assert decoder.frames_skipped == 1
+
+        # Posts by other users, even if they quote our id, should be decoded
+        assert decoder.decode(create_frame()) is not None
+        message = create_message(text='"user_id":"my_user_id"').body
+        message["data"]["post"] = json.dumps(
+            message["data"]["post"], separators=(",", ":")
+        )
+        assert decoder.decode(json.dumps(message, separators=(",", ":"))) is not None
+        assert decoder.frames_parsed == 2
+
+    def test_own_edits_and_deletions(self):
+        decoder = EventDecoder(
+            events=["posted", "post_edited", "post_deleted"],
+            ignore_user_id="my_user_id",
+        )
+        assert decoder.decode(create_frame(user_id="my_user_id")) is None
+        # The thread cache still has to know when we edit or delete our own posts
+        for event in ["post_edited", "post_deleted"]:
+            decoded = decoder.decode(create_frame(user_id="my_user_id", event=event))
+            assert decoded["event"] == event
+            assert decoded["data"]["post"]["user_id"] == "my_user_id"
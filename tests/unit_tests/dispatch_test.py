@@ -0,0 +1,101 @@
+import re
+
+from snaketalk import ExamplePlugin, Settings, WebHookExample
+from snaketalk.dispatch import ListenerIndex, literal_prefix
+from snaketalk.driver import Driver
+
+
+def linear_scan(listeners, text):
+    # Reference implementation: try every regexp in order.
+    results = []
+    for matcher, functions in listeners.items():
+        match = matcher.match(text)
+        if match:
+            results.append((matcher, functions, match))
+    return results
+
+
+class TestLiteralPrefix:
+    def test_literal_prefix(self):
+        assert literal_prefix("^ping$") == ("ping", True)
+        assert literal_prefix("^!info$") == ("!info", True)
+        assert literal_prefix("ping") == ("ping", False)
+        assert literal_prefix("^hello_click (.*)?") == ("hello_click ", False)
+        assert literal_prefix(r"^a\.b\$$") == ("a.b$", True)
+        # Quantified characters are not part of the required prefix
+        assert literal_prefix("^abc*$") == ("ab", False)
+        assert literal_prefix("^ab{2}") == ("a", False)
+        # Character classes and escapes like \d stop the prefix
+        assert literal_prefix(r"^sleep \d+$") == ("sleep ", False)
+        assert literal_prefix("^busy|jobs$") == ("", False)
+        assert literal_prefix("(.*)") == ("", False)
+        assert literal_prefix("^ab$c") == ("ab", False)
+
+
+class TestListenerIndex:
+    patterns = [
+        re.compile("^ping$"),
+        re.compile("^ping$", re.IGNORECASE),
+        re.compile("^!info$"),
+        re.compile("^hello_click (.*)?"),
+        re.compile("^hello"),
+        re.compile("hello_.*"),
+        re.compile("^busy|jobs$", re.IGNORECASE),
+        re.compile("^reply at (.*)$", re.IGNORECASE),
+        re.compile("^sleep ([0-9]+)$"),
+        re.compile("^ab*c$"),
+        re.compile("^pi$", re.MULTILINE),
+        re.compile("^ÄPFEL$", re.IGNORECASE),
+        re.compile(".*"),
+    ]
+    texts = [
+        "ping",
+        "PING",
+        "Ping\n",
+        "pinged",
+        "!info",
+        "hello_click arg -f",
+        "hello_click",
+        "hello_clicked",
+        "hello there",
+        "busy",
+        "jobs",
+        "no jobs",
+        "Reply At 20-02-2021",
+        "sleep 5",
+        "sleep five",
+        "ac",
+        "abbbc",
+        "pi\nno",
+        "äpfel",
+        "pİng",
+        "",
+    ]
+
+    def test_matches_linear_scan(self):
+        listeners = {pattern: [pattern.pattern] for pattern in self.patterns}
+        index = ListenerIndex(listeners)
+
+        for text in self.texts:
+            expected = linear_scan(listeners, text)
+            results = index.match(text)
+            assert [(m, f) for m, f, _ in results] == [(m, f) for m, f, _ in expected]
+            assert [match.groups() for _, _, match in results] == [
+                match.groups() for _, _, match in expected
+            ]
+
+    def test_plugin_listeners(self):
+        driver = Driver()
+        listeners = {}
+        for plugin in [ExamplePlugin(), WebHookExample()]:
+            listeners.update(plugin.initialize(driver, Settings()).message_listeners)
+        index = ListenerIndex(listeners)
+
+        # Only the alternation `^busy|jobs$` can't be indexed
+        assert [index.listeners[i][0].pattern for i in index._unindexed] == [
+            "^busy|jobs$"
+        ]
+        for text in ["ping", "!info", "hello_click arg", "jobs", "help", "sleep 5"]:
+            assert [result[:2] for result in index.match(text)] == [
+                result[:2] for result in linear_scan(listeners, text)
+            ]
@@ -0,0 +1,127 @@
+import asyncio
+from contextlib import asynccontextmanager
+
+import mattermostdriver
+import pytest
+from aiohttp import web
+
+from snaketalk.driver import Driver
+
+from .event_handler_test import create_message
+
+
+@asynccontextmanager
+async def fake_server(port: int):
+    """Runs a tiny stand-in for the mattermost REST API on the current loop, which
+    records the requests it receives."""
+    requests = []
+
+    async def handler(request: web.Request):
+        body = None
+        if request.content_type == "application/json":
+            body = await request.json()
+        elif request.content_type == "multipart/form-data":
+            body = {}
+            async for part in await request.multipart():
+                body[part.filename or part.name] = (await part.read()).decode()
+        elif request.content_type == "application/octet-stream":
+            body = {**request.query, "data": (await request.read()).decode()}
+        requests.append((request.method, request.path, body, request.headers))
+
+        path = request.path
+        if path.endswith("/ephemeral"):
+            return web.json_response({"message": "not allowed"}, status=403)
+        if path.endswith("/thread"):
+            return web.json_response(
+                {
+                    "order": ["b", "a", "b"],
+                    "posts": {"a": {"create_at": 1}, "b": {"create_at": 2}},
+                }
+            )
+        if path.endswith("/files"):
+            return web.json_response({"file_infos": [{"id": "file_id"}]})
+        return web.json_response({"id": path.split("/")[-1], "path": path})
+
+    app = web.Application()
+    app.router.add_route("*", "/{tail:.*}", handler)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, "127.0.0.1", port).start()
+    try:
+        yield requests
+    finally:
+        await runner.cleanup()
+
+
+def create_driver(port: int):
+    driver = Driver({"url": "127.0.0.1", "port": port, "scheme": "http"})
+    driver.client.token = "token"
+    driver.user_id = "my_user_id"
+    return driver
+
+
+class TestAsyncDriver:
+    def test_requests(self, tmp_path):
+        driver = create_driver(port=3283)
+        message = create_message()
+        file = tmp_path / "hello.txt"
+        file.write_text("Hello from this file!")
+
+        async def run():
+            async with fake_server(3283) as requests:
+                await driver.reply_to_async(message, "pong", file_paths=[file])
+                await driver.react_to_async(message, "+1")
+                user = await driver.get_user_info_async("user_id")
+                thread = await driver.get_thread_async("a")
+                with pytest.raises(mattermostdriver.exceptions.NotEnoughPermissions):
+                    await driver.reply_to_async(message, "pong", ephemeral=True)
+                await driver.async_client.close()
+            return requests, user, thread
+
+        requests, user, thread = asyncio.run(run())
+        assert user == {"id": "user_id", "path": "/api/v4/users/user_id"}
+        # The thread order should be fixed, like the synchronous version does
+        assert thread["order"] == ["a", "b"]
+
+        (upload, post, reaction, *_) = requests
+        assert upload[:3] == (
+            "POST",
+            "/api/v4/files",
+            {
+                "channel_id": message.channel_id,
+                "filename": "hello.txt",
+                "data": "Hello from this file!",
+            },
+        )
+        assert post[:3] == (
+            "POST",
+            "/api/v4/posts",
+            {
+                "channel_id": message.channel_id,
+                "message": "pong",
+                "file_ids": ["file_id"],
+                "root_id": message.reply_id,
+                "props": {},
+            },
+        )
+        assert post[3]["Authorization"] == "Bearer token"
+        assert reaction[2] == {
+            "user_id": "my_user_id",
+            "post_id": message.id,
+            "emoji_name": "+1",
+        }
+
+    def test_concurrent_requests(self):
+        driver = create_driver(port=3284)
+
+        async def run():
+            async with fake_server(3284) as requests:
+                await asyncio.gather(
+                    *[driver.get_user_info_async(str(i)) for i in range(50)]
+                )
+                # All requests share one session
+                assert len(driver.async_client._sessions) == 1
+                await driver.async_client.close()
+            return requests
+
+        assert len(asyncio.run(run())) == 50
@@ -3,8 +3,11 @@ import json
 from unittest import mock
 
 from snaketalk import ExamplePlugin, Message, Settings, WebHookExample
+from snaketalk.admission import BUSY
 from snaketalk.driver import Driver
 from snaketalk.event_handler import EventHandler
+from snaketalk.plugins.base import BUSY_MESSAGE
+from snaketalk.ratelimit import RateLimiter
 from snaketalk.wrappers import WebHookEvent
 
 
@@ -124,7 +127,28 @@ class TestEventHandler:
 
         handle_post.assert_called_once_with(create_message().body)
 
+    def test_handle_event_cache(self):
+        handler = EventHandler(Driver(), Settings(), plugins=[])
+        handler.driver.cache.set_channel({"id": "id", "name": "town-square"})
+        # The channel is a JSON string inside the event
+        event = {
+            "event": "channel_updated",
+            "data": {"channel": json.dumps({"id": "id", "name": "off-topic"})},
+        }
+        asyncio.run(handler._handle_event(json.dumps(event)))
+        assert handler.driver.cache.get_channel("id")["name"] == "off-topic"
+
+        # Posts are added to the threads they belong to
+        handler.driver.thread_cache.set(
+            "id", {"posts": {"id": {"id": "id", "create_at": 1, "root_id": ""}}}
+        )
+        post = {"id": "reply", "create_at": 2, "root_id": "id", "message": "hi"}
+        event = {"event": "post_edited", "data": {"post": json.dumps(post)}}
+        asyncio.run(handler._handle_event(json.dumps(event)))
+        assert handler.driver.get_thread("id")["order"] == ["id", "reply"]
+
     @mock.patch("snaketalk.driver.Driver.username", new="my_username")
+    @mock.patch("snaketalk.driver.Driver.user_id", new="qmw86q7qsjriura9jos75i4why")
     def test_handle_post(self):
         # Create an initialized plugin so its listeners are registered
         driver = Driver()
@@ -151,6 +175,85 @@ class TestEventHandler:
             # Assert the function was called, so we know the asserts succeeded.
             mocked.assert_called_once()
 
+    @mock.patch("snaketalk.driver.Driver.username", new="my_username")
+    @mock.patch("snaketalk.driver.ThreadPool.add_task")
+    def test_handle_post_restrictions(self, add_task):
+        driver = Driver()
+        plugin = ExamplePlugin().initialize(driver)
+        handler = EventHandler(driver, Settings(), plugins=[plugin])
+
+        def handle_post(text, **kwargs):
+            body = create_message(text=text, **kwargs).body.copy()
+            body["data"]["post"] = json.dumps(body["data"]["post"])
+            body["data"]["mentions"] = json.dumps(body["data"]["mentions"])
+            asyncio.run(handler._handle_post(body))
+
+        with mock.patch.object(plugin, "call_function") as call_function:
+            # `admin` is direct_only, so this should be filtered out before scheduling
+            handle_post("admin", channel_type="O")
+            call_function.assert_not_called()
+            add_task.assert_not_called()
+
+            # A direct message from a user that isn't allowed only triggers a reply
+            handle_post("admin", channel_type="D", sender_name="betty")
+            call_function.assert_not_called()
+            add_task.assert_called_once()
+            function, message = add_task.call_args.args
+            assert function == plugin.users_access.reply_permission_denied
+            assert message.sender_name == "betty"
+
+            # And an allowed user gets through
+            handle_post("admin", channel_type="D", sender_name="admin")
+            call_function.assert_called_once()
+
+    @mock.patch("snaketalk.driver.Driver.username", new="my_username")
+    def test_handle_post_load_shedding(self):
+        driver = Driver()
+        plugin = ExamplePlugin().initialize(driver)
+        handler = EventHandler(driver, Settings(), plugins=[plugin])
+        body = create_message(text="hello_channel", channel_type="D").body
+
+        with mock.patch.object(plugin, "call_function") as call_function, mock.patch(
+            "snaketalk.admission.AdmissionController.admit", return_value=BUSY
+        ), mock.patch.object(driver, "reply_to_async") as reply_to_async:
+            asyncio.run(handler._handle_post(body))
+            # The function is skipped, and the user is told to try again later
+            call_function.assert_not_called()
+            reply_to_async.assert_called_once()
+            assert reply_to_async.call_args.args[1] == BUSY_MESSAGE
+
+    @mock.patch("snaketalk.driver.Driver.username", new="my_username")
+    def test_handle_post_rate_limits(self):
+        driver = Driver()
+        plugin = ExamplePlugin().initialize(driver)
+        handler = EventHandler(
+            driver, Settings(USER_RATE_LIMIT=(2, 60.0)), plugins=[plugin]
+        )
+
+        def handle_post(text, sender_name="betty"):
+            body = create_message(text=text, channel_type="D").body
+            body["data"]["post"]["user_id"] = sender_name
+            asyncio.run(handler._handle_post(body))
+
+        with mock.patch.object(plugin, "call_function") as call_function:
+            # Messages that don't trigger anything don't count
+            for _ in range(5):
+                handle_post("just chatting")
+            for _ in range(3):
+                handle_post("hello_channel")
+            assert call_function.call_count == 2
+            handle_post("hello_channel", sender_name="alice")
+            assert call_function.call_count == 3
+
+        # Limits can be set per listener as well
+        with mock.patch.object(plugin, "call_function") as call_function:
+            with mock.patch.object(
+                plugin.hello_react, "rate_limiter", RateLimiter((1, 60.0))
+            ):
+                handle_post("hello_react", sender_name="carol")
+                handle_post("hello_react", sender_name="carol")
+            call_function.assert_called_once()
+
     def test_handle_webhook(self):
         # Create an initialized plugin so its listeners are registered
         driver = Driver()
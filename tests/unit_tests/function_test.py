@@ -193,6 +193,24 @@ class TestMessageFunction:
         wrapped.assert_not_called()
         driver.reply_to.assert_called_once()
 
+    def test_rate_limit(self):
+        f = listen_to("", rate_limit=(1, 60.0), rate_limit_by="channel")(
+            example_listener
+        )
+        message = create_message()
+        assert not f.is_rate_limited(message)
+        assert f.is_rate_limited(message)
+        # Another channel has its own limit
+        other = create_message()
+        other.body["data"]["post"]["channel_id"] = "other_channel"
+        assert not f.is_rate_limited(other)
+        assert not listen_to("")(example_listener).is_rate_limited(message)
+
+        with pytest.raises(ValueError):
+            listen_to("", rate_limit=(1, 60.0), rate_limit_by="root_id")(
+                example_listener
+            )
+
 
 def example_webhook_listener(self, event):
     # Used to copy the arg specs to mock.Mock functions.
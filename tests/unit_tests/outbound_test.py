@@ -0,0 +1,212 @@
+import asyncio
+import json
+import threading
+import time
+from contextlib import asynccontextmanager
+
+import pytest
+from aiohttp import web
+from mattermostdriver.exceptions import ResourceNotFound
+
+from snaketalk.outbound import OutboundScheduler, ScheduledClient, outbound_priority
+from snaketalk.utils import Priority
+
+from .driver_test import create_driver
+
+
+@asynccontextmanager
+async def flaky_server(port: int, failures: int, status: int = 429):
+    """Fake REST API that answers the first few requests with the given status."""
+    requests = []
+
+    async def handler(request: web.Request):
+        requests.append(request.path)
+        if len(requests) <= failures:
+            return web.json_response(
+                {"message": "slow down"},
+                status=status,
+                headers={"X-Ratelimit-Remaining": "0", "X-Ratelimit-Reset": "0"},
+            )
+        # Without a charset, so that the sync client recognizes it as json
+        return web.Response(
+            body=json.dumps({"id": "user_id", "path": request.path}).encode(),
+            content_type="application/json",
+            headers={"X-Ratelimit-Remaining": "100", "X-Ratelimit-Reset": "1"},
+        )
+
+    app = web.Application()
+    app.router.add_route("*", "/{tail:.*}", handler)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, "127.0.0.1", port).start()
+    try:
+        yield requests
+    finally:
+        await runner.cleanup()
+
+
+class TestOutboundScheduler:
+    def test_rate_limit_headers(self):
+        scheduler = OutboundScheduler()
+        scheduler.update(200, {"X-Ratelimit-Remaining": "5", "X-Ratelimit-Reset": "1"})
+        assert scheduler.remaining == 5
+        assert scheduler.reset_at == pytest.approx(time.monotonic() + 1, abs=0.1)
+
+        # Reset may also be given as a timestamp
+        scheduler.update(
+            200, {"X-Ratelimit-Remaining": "4", "X-Ratelimit-Reset": time.time() + 2}
+        )
+        assert scheduler.reset_at == pytest.approx(time.monotonic() + 2, abs=0.1)
+
+        # A 429 means nothing remains, even without headers
+        scheduler.update(429, {})
+        assert scheduler.remaining == 0
+
+    def test_waits_for_reset(self):
+        scheduler = OutboundScheduler()
+        scheduler.acquire()
+        assert scheduler.throttled == 0
+
+        scheduler.update(429, {"X-Ratelimit-Reset": "0.3"})
+        start = time.time()
+        scheduler.acquire()
+        assert 0.25 < time.time() - start < 0.6
+        assert scheduler.throttled == 1
+        # A new window started
+        assert scheduler.remaining is None
+
+    def test_spacing(self):
+        scheduler = OutboundScheduler(spacing_threshold=10)
+        scheduler.update(200, {"X-Ratelimit-Remaining": "4", "X-Ratelimit-Reset": "1"})
+        start = time.time()
+        for _ in range(3):
+            scheduler.acquire()
+        # The last requests are spread over the rest of the window instead of sent in
+        # one burst.
+        assert 0.3 < time.time() - start < 1.0
+
+    def test_priority(self):
+        scheduler = OutboundScheduler()
+        scheduler.update(429, {"X-Ratelimit-Reset": "0.2"})
+        order = []
+
+        def send(priority, name):
+            scheduler.acquire(priority)
+            order.append(name)
+
+        threads = [
+            threading.Thread(target=send, args=(Priority.LOW, "scheduled")),
+            threading.Thread(target=send, args=(Priority.NORMAL, "reply")),
+            threading.Thread(target=send, args=(Priority.HIGH, "urgent")),
+        ]
+        for thread in threads:
+            thread.start()
+            time.sleep(0.02)
+        for thread in threads:
+            thread.join()
+        assert order == ["urgent", "reply", "scheduled"]
+
+    def test_priority_async(self):
+        scheduler = OutboundScheduler()
+        scheduler.update(429, {"X-Ratelimit-Reset": "0.2"})
+        order = []
+
+        async def send(priority, name):
+            await scheduler.acquire_async(priority)
+            order.append(name)
+
+        async def run():
+            tasks = []
+            for priority, name in [
+                (Priority.LOW, "scheduled"),
+                (Priority.HIGH, "reply"),
+            ]:
+                tasks.append(asyncio.create_task(send(priority, name)))
+                await asyncio.sleep(0.02)
+            await asyncio.gather(*tasks)
+
+        asyncio.run(run())
+        assert order == ["reply", "scheduled"]
+
+    def test_retry(self):
+        scheduler = OutboundScheduler(max_retries=2, backoff=1.0, max_backoff=1.5)
+        assert scheduler.should_retry(429, 0)
+        assert scheduler.should_retry(503, 1)
+        assert not scheduler.should_retry(429, 2)
+        assert not scheduler.should_retry(500, 0)
+
+        for attempt in range(5):
+            assert 0 <= scheduler.get_backoff(attempt) <= 1.5
+        assert scheduler.retries == 5
+
+
+class TestScheduledClient:
+    def test_driver_client(self):
+        driver = create_driver(port=3286)
+        assert isinstance(driver.client, ScheduledClient)
+        assert driver.async_client.scheduler is driver.client.scheduler
+
+    def test_retries_sync(self):
+        driver = create_driver(port=3286)
+        driver.client.scheduler.backoff = 0.01
+
+        async def run():
+            async with flaky_server(3286, failures=2) as requests:
+                user = await asyncio.get_running_loop().run_in_executor(
+                    None, driver.users.get_user, "user_id"
+                )
+            return user, requests
+
+        user, requests = asyncio.run(run())
+        assert user == {"id": "user_id", "path": "/api/v4/users/user_id"}
+        assert len(requests) == 3
+        assert driver.client.scheduler.retries == 2
+        assert driver.client.scheduler.remaining == 100
+
+    def test_retries_async(self):
+        driver = create_driver(port=3287)
+        driver.client.scheduler.backoff = 0.01
+
+        async def run():
+            async with flaky_server(3287, failures=1, status=503) as requests:
+                outbound_priority.set(Priority.HIGH)
+                user = await driver.get_user_info_async("user_id")
+                await driver.async_client.close()
+            return user, requests
+
+        user, requests = asyncio.run(run())
+        assert user == {"id": "user_id", "path": "/api/v4/users/user_id"}
+        assert len(requests) == 2
+        assert driver.client.scheduler.retries == 1
+
+    def test_gives_up(self):
+        driver = create_driver(port=3288)
+        driver.client.scheduler.backoff = 0.01
+        driver.client.scheduler.max_retries = 1
+
+        async def run():
+            async with flaky_server(3288, failures=5, status=502) as requests:
+                with pytest.raises(Exception):
+                    await driver.get_user_info_async("user_id")
+                await driver.async_client.close()
+            return requests
+
+        assert len(asyncio.run(run())) == 2
+
+    def test_client_errors(self):
+        driver = create_driver(port=3299)
+
+        async def run():
+            async with flaky_server(3299, failures=1, status=404) as requests:
+                with pytest.raises(ResourceNotFound) as e:
+                    await asyncio.get_running_loop().run_in_executor(
+                        None, driver.users.get_user, "user_id"
+                    )
+            return e.value, requests
+
+        error, requests = asyncio.run(run())
+        # The same exception as mattermostdriver raises, but with the response
+        assert error.response.status_code == 404
+        # Not retried
+        assert len(requests) == 1
+        assert driver.client.scheduler.retries == 0
@@ -0,0 +1,115 @@
+import asyncio
+import json
+from contextlib import asynccontextmanager
+
+from aiohttp import web
+
+from snaketalk.pagination import ChannelPages, ThreadPages, iterate_pages
+
+from .driver_test import create_driver
+
+# Post i was created at time i, the first one is the root of the thread.
+POSTS = {
+    str(i): {"id": str(i), "create_at": i, "root_id": "0" if i else ""}
+    for i in range(25)
+}
+
+
+def json_response(data):
+    # Without a charset, so that the sync client recognizes it as json
+    return web.Response(body=json.dumps(data).encode(), content_type="application/json")
+
+
+@asynccontextmanager
+async def history_server(port: int):
+    """Fake API that pages through POSTS like Mattermost does."""
+    requests = []
+
+    async def channel_posts(request: web.Request):
+        requests.append(dict(request.query))
+        per_page = int(request.query["per_page"])
+        end = int(request.query.get("before", len(POSTS)))
+        order = [str(i) for i in reversed(range(max(end - per_page, 0), end))]
+        return json_response({"order": order, "posts": {id: POSTS[id] for id in order}})
+
+    async def thread(request: web.Request):
+        requests.append(dict(request.query))
+        per_page = int(request.query["perPage"])
+        # The cursor post itself is included again
+        start = int(request.query.get("fromPost", 0))
+        ids = [str(i) for i in range(start, min(start + per_page, len(POSTS)))]
+        return json_response(
+            {
+                "order": ids,
+                "posts": {id: POSTS[id] for id in ids},
+                "has_next": start + per_page < len(POSTS),
+            }
+        )
+
+    app = web.Application()
+    app.router.add_get("/api/v4/channels/{channel_id}/posts", channel_posts)
+    app.router.add_get("/api/v4/posts/{post_id}/thread", thread)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, "127.0.0.1", port).start()
+    try:
+        yield requests
+    finally:
+        await runner.cleanup()
+
+
+class TestPages:
+    def test_channel_pages(self):
+        pages = ChannelPages("channel", per_page=2)
+        assert pages.request() == ("/channels/channel/posts", {"per_page": "2"})
+        posts = pages.parse({"order": ["b", "a"], "posts": {"a": 1, "b": 2}})
+        assert posts == [2, 1]
+        assert not pages.done
+        assert pages.request()[1] == {"per_page": "2", "before": "a"}
+
+        assert pages.parse({"order": [], "posts": {}}) == []
+        assert pages.done
+
+    def test_thread_pages_unsupported(self):
+        # Older servers return the entire thread at once
+        pages = ThreadPages("0", per_page=10)
+        posts = list(iterate_pages(pages, lambda endpoint, params: {"posts": POSTS}))
+        assert [post["id"] for post in posts] == [str(i) for i in range(25)]
+        assert pages.done
+
+
+class TestDriverIterators:
+    def test_iter_channel_posts(self):
+        driver = create_driver(port=3295)
+
+        async def run():
+            async with history_server(3295) as requests:
+                posts = await asyncio.get_running_loop().run_in_executor(
+                    None,
+                    lambda: list(driver.iter_channel_posts("channel", per_page=10)),
+                )
+            return posts, requests
+
+        posts, requests = asyncio.run(run())
+        assert [post["id"] for post in posts] == [str(i) for i in reversed(range(25))]
+        assert [request.get("before") for request in requests] == [None, "15", "5"]
+
+    def test_iter_thread_async(self):
+        driver = create_driver(port=3296)
+
+        async def run():
+            async with history_server(3296) as requests:
+                posts = [post async for post in driver.iter_thread_async("3", 10)]
+                # Stopping early doesn't leave anything running
+                async for post in driver.iter_channel_posts_async("channel", 10):
+                    break
+                await driver.async_client.close()
+            return posts, requests
+
+        posts, requests = asyncio.run(run())
+        assert [post["id"] for post in posts] == [str(i) for i in range(25)]
+        assert [request.get("fromPost") for request in requests[:3]] == [
+            None,
+            "9",
+            "18",
+        ]
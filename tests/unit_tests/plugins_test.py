@@ -1,11 +1,15 @@
 import asyncio
 import re
+import time
 from unittest import mock
 
 import click
+import pytest
 
-from snaketalk import Plugin, listen_to, listen_webhook
+from snaketalk import Plugin, Priority, listen_to, listen_webhook
 from snaketalk.driver import Driver
+from snaketalk.plugins.base import BUSY_MESSAGE
+from snaketalk.threadpool import TaskFuture
 
 from .event_handler_test import create_message
 
@@ -74,6 +78,11 @@ class TestPlugin:
     @mock.patch("snaketalk.driver.ThreadPool.add_task")
     def test_call_function(self, add_task):
         p = FakePlugin().initialize(Driver())
+        # call_function waits for the task to finish, so return a finished one
+        future = TaskFuture(FakePlugin.my_function)
+        future.started_at = future.finished_at = future.submitted_at
+        future.set_result(None)
+        add_task.return_value = future
 
         # Since this is not an async function, a task should be added to the threadpool
         message = create_message(text="pattern")
@@ -81,7 +90,11 @@ class TestPlugin:
             p.call_function(FakePlugin.my_function, message, groups=["test", "another"])
         )
         add_task.assert_called_once_with(
-            FakePlugin.my_function, message, "test", "another"
+            FakePlugin.my_function,
+            message,
+            "test",
+            "another",
+            priority=Priority.NORMAL,
         )
 
         # Since this is an async function, it should be called directly through asyncio.
@@ -92,6 +105,181 @@ class TestPlugin:
             )
             mock_function.assert_called_once_with(p, message)
 
+    def test_worker_quota(self):
+        class SlowPlugin(Plugin):
+            worker_quota = 2
+
+            @listen_to("slow")
+            def slow_function(self, message):
+                time.sleep(0.2)
+
+        driver = Driver()
+        p = SlowPlugin().initialize(driver)
+        assert not p.has_own_threadpool
+        message = create_message(text="slow")
+
+        async def call_functions():
+            tasks = [
+                asyncio.create_task(p.call_function(SlowPlugin.slow_function, message))
+                for _ in range(4)
+            ]
+            await asyncio.sleep(0.1)
+            # Only two of them take up a worker, the others wait on the event loop.
+            assert driver.threadpool.get_busy_workers() == 2
+            assert p.get_stats()["in_flight"] == 2
+            assert p.get_stats()["queued"] == 2
+            assert p.get_stats()["saturation"] == 1
+            await asyncio.gather(*tasks)
+
+        driver.threadpool.start()
+        try:
+            asyncio.run(call_functions())
+        finally:
+            driver.threadpool.stop()
+
+        stats = p.get_stats()
+        assert stats["completed"] == 4
+        assert stats["in_flight"] == stats["queued"] == 0
+        assert stats["max_wait_time"] >= 0.2
+
+    def test_own_threadpool(self):
+        class IsolatedPlugin(Plugin):
+            num_threads = 1
+            executor = "process"
+
+            @listen_to("pattern")
+            async def async_function(self, message):
+                pass
+
+        driver = Driver()
+        p = IsolatedPlugin().initialize(driver)
+        assert p.has_own_threadpool
+        assert p.threadpool.num_workers == 1
+        assert p.get_stats()["capacity"] == 1
+        # The plugin executor only applies to regular functions
+        assert IsolatedPlugin.async_function.executor is None
+
+        with mock.patch.object(p.threadpool, "add_task") as add_task:
+            future = TaskFuture(FakePlugin.my_function)
+            future.started_at = future.finished_at = future.submitted_at
+            future.set_result(None)
+            add_task.return_value = future
+            asyncio.run(p.call_function(FakePlugin.my_function, create_message()))
+            add_task.assert_called_once()
+
+    def test_serialize_by(self):
+        class StatefulPlugin(Plugin):
+            def __init__(self):
+                super().__init__()
+                self.handled = []
+
+            @listen_to("([0-9]+)", serialize_by="channel")
+            def stateful_function(self, message, number):
+                # Later messages finish sooner, unless they are serialized.
+                time.sleep(0.05 * (5 - int(number)))
+                self.handled.append((message.channel_id, int(number)))
+
+        driver = Driver()
+        p = StatefulPlugin().initialize(driver)
+        messages = []
+        for channel in ["channel_a", "channel_b"]:
+            for number in range(5):
+                message = create_message(text=str(number))
+                message.body["data"]["post"]["channel_id"] = channel
+                messages.append(message)
+
+        async def call_functions():
+            await asyncio.gather(
+                *[
+                    p.call_function(
+                        StatefulPlugin.stateful_function, message, [message.text]
+                    )
+                    for message in messages
+                ]
+            )
+
+        driver.threadpool.start()
+        try:
+            start = time.time()
+            asyncio.run(call_functions())
+            # The channels were handled in parallel
+            assert time.time() - start < 1.2
+        finally:
+            driver.threadpool.stop()
+
+        for channel in ["channel_a", "channel_b"]:
+            handled = [number for key, number in p.handled if key == channel]
+            assert handled == list(range(5))
+        # No bookkeeping is left behind
+        assert p._serial_tails == {}
+
+    def test_concurrency_limits(self):
+        class LimitedPlugin(Plugin):
+            cancelled = False
+
+            @listen_to("drop", max_concurrency=1, overflow="drop")
+            async def drop_function(self, message):
+                await asyncio.sleep(0.1)
+
+            @listen_to("busy", max_concurrency=2, overflow="busy")
+            def busy_function(self, message):
+                time.sleep(0.1)
+
+            @listen_to("async_timeout", timeout=0.1)
+            async def async_timeout(self, message):
+                try:
+                    await asyncio.sleep(10)
+                except asyncio.CancelledError:
+                    LimitedPlugin.cancelled = True
+                    raise
+
+            @listen_to("thread_timeout", timeout=0.1)
+            def thread_timeout(self, message):
+                time.sleep(0.3)
+
+        driver = Driver()
+        p = LimitedPlugin().initialize(driver)
+        message = create_message()
+
+        async def call_functions(function, times):
+            await asyncio.gather(
+                *[p.call_function(function, message) for _ in range(times)]
+            )
+
+        driver.threadpool.start()
+        try:
+            asyncio.run(call_functions(LimitedPlugin.drop_function, 3))
+            assert p.get_stats()["dropped"] == 2
+
+            with mock.patch.object(driver, "reply_to_async") as reply_to_async:
+                asyncio.run(call_functions(LimitedPlugin.busy_function, 3))
+                reply_to_async.assert_called_once_with(message, BUSY_MESSAGE)
+            assert p.get_stats()["dropped"] == 3
+
+            asyncio.run(call_functions(LimitedPlugin.async_timeout, 1))
+            assert LimitedPlugin.cancelled
+
+            futures = []
+            add_task = p.threadpool.add_task
+
+            def record_task(*args, **kwargs):
+                futures.append(add_task(*args, **kwargs))
+                return futures[-1]
+
+            with mock.patch.object(p.threadpool, "add_task", side_effect=record_task):
+                start = time.time()
+                asyncio.run(call_functions(LimitedPlugin.thread_timeout, 1))
+                # The thread is abandoned, and flagged as such
+                assert time.time() - start < 0.3
+                assert futures[0].abandoned
+            assert p.get_stats()["timed_out"] == 2
+        finally:
+            driver.threadpool.stop()
+
+    def test_invalid_limits(self):
+        with pytest.raises(ValueError):
+            listen_to("pattern", overflow="ignore")(FakePlugin.my_function.function)
+
     def test_help_string(self, snapshot):
         p = FakePlugin().initialize(Driver())
         # Compare the help string with the snapshotted version.
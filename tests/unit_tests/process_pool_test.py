@@ -0,0 +1,117 @@
+import asyncio
+import os
+import time
+from concurrent.futures import wait
+from unittest import mock
+
+import pytest
+
+from snaketalk import Plugin, listen_to
+from snaketalk.driver import Driver
+from snaketalk.process_pool import DriverProxy, ProcessPool
+
+from .event_handler_test import create_message
+
+
+class CPUPlugin(Plugin):
+    @listen_to("^compute ([0-9]+)$", executor="process")
+    def compute(self, message, number):
+        result = sum(i * i for i in range(int(number)))
+        self.driver.reply_to(message, f"{result} from {os.getpid()}")
+        # Calls return the result of the parent's driver
+        assert self.driver.get_thread(message.id) == {"order": []}
+        assert self.driver.user_id == "my_user_id"
+
+
+class SlowPlugin(Plugin):
+    @listen_to("^sleep$", executor="process")
+    def sleep(self, message):
+        time.sleep(0.2)
+
+
+class TestProcessPool:
+    def test_invalid_executor(self):
+        with pytest.raises(ValueError):
+            listen_to("pattern", executor="gpu")(CPUPlugin.compute.function)
+
+        async def coroutine(self, message):
+            pass
+
+        with pytest.raises(ValueError):
+            listen_to("pattern", executor="process")(coroutine)
+
+    def test_driver_proxy(self):
+        driver = Driver()
+        driver.user_id = "my_user_id"
+        call = mock.Mock(return_value="result")
+        proxy = DriverProxy(driver, call)
+
+        assert proxy.user_id == "my_user_id"
+        assert proxy.reply_to("message", "text", ephemeral=True) == "result"
+        call.assert_called_with(("reply_to",), ("message", "text"), {"ephemeral": True})
+        proxy.posts.create_post({"message": "text"})
+        call.assert_called_with(("posts", "create_post"), ({"message": "text"},), {})
+
+    def test_call_function(self):
+        driver = Driver()
+        driver.user_id = "my_user_id"
+        driver.process_pool = ProcessPool(driver, num_processes=2)
+        plugin = CPUPlugin().initialize(driver)
+        message = create_message(text="compute 1000")
+
+        driver.process_pool.start()
+        driver.threadpool.start()
+        try:
+            with mock.patch.object(
+                driver, "reply_to", return_value=None
+            ) as reply_to, mock.patch.object(
+                driver, "get_thread", return_value={"order": []}
+            ):
+                asyncio.run(
+                    plugin.call_function(CPUPlugin.compute, message, groups=["1000"])
+                )
+            reply, pid = reply_to.call_args.args[1].split(" from ")
+            assert reply_to.call_args.args[0].body == message.body
+            assert int(reply) == sum(i * i for i in range(1000))
+            assert int(pid) != os.getpid()
+        finally:
+            driver.process_pool.stop()
+            driver.threadpool.stop()
+
+    def test_restart(self):
+        driver = Driver()
+        driver.process_pool = ProcessPool(driver, num_processes=1)
+        CPUPlugin().initialize(driver)
+
+        driver.process_pool.start()
+        driver.process_pool.stop()
+        assert not driver.process_pool.alive
+
+        # The registered functions are kept, so the pool can be started again
+        driver.process_pool.start()
+        try:
+            assert driver.process_pool.alive
+            assert id(CPUPlugin.compute) in driver.process_pool.functions
+        finally:
+            driver.process_pool.stop()
+
+    def test_queue(self):
+        driver = Driver()
+        driver.process_pool = ProcessPool(driver, num_processes=1)
+        SlowPlugin().initialize(driver)
+        message = create_message(text="sleep")
+
+        driver.process_pool.start()
+        try:
+            assert driver.process_pool.get_queue_length() == 0
+            assert driver.process_pool.get_queue_age() is None
+            futures = [
+                driver.process_pool.submit(SlowPlugin.sleep, message) for _ in range(3)
+            ]
+            # One call is running, the others are waiting for it
+            assert driver.process_pool.get_queue_length() == 2
+            assert driver.process_pool.get_queue_age() >= 0
+            wait(futures)
+            assert driver.process_pool.get_queue_length() == 0
+        finally:
+            driver.process_pool.stop()
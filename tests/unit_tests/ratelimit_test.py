@@ -0,0 +1,39 @@
+from unittest import mock
+
+from snaketalk.ratelimit import RateLimiter, TokenBucket
+
+
+class TestTokenBucket:
+    def test_consume(self):
+        with mock.patch("time.monotonic", return_value=0.0):
+            bucket = TokenBucket(capacity=2, rate=1.0)
+        assert bucket.consume(now=0.0)
+        assert bucket.consume(now=0.0)
+        assert not bucket.consume(now=0.5)
+        # Refilled at one token per second, but never beyond the capacity
+        assert bucket.consume(now=1.0)
+        assert not bucket.consume(now=1.0)
+        assert bucket.consume(now=100.0)
+        assert bucket.consume(now=100.0)
+        assert not bucket.consume(now=100.0)
+
+
+class TestRateLimiter:
+    def test_allow(self):
+        limiter = RateLimiter((2, 60.0))
+        assert limiter.allow("alice")
+        assert limiter.allow("alice")
+        assert not limiter.allow("alice")
+        # Other keys have their own bucket
+        assert limiter.allow("bob")
+        assert limiter.rejected == 1
+
+    def test_lru_eviction(self):
+        limiter = RateLimiter((1, 60.0), max_keys=2)
+        assert limiter.allow("alice")
+        assert limiter.allow("bob")
+        assert not limiter.allow("alice")  # alice is now the most recently used
+        assert limiter.allow("carol")  # so bob is evicted
+        assert len(limiter) == 2
+        assert not limiter.allow("alice")
+        assert limiter.allow("bob")
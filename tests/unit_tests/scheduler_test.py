@@ -3,10 +3,12 @@ import time
 from datetime import datetime
 from pathlib import Path
 from typing import Dict
+from unittest import mock
 
 import pytest
 
-from snaketalk import schedule
+from snaketalk import Priority, schedule
+from snaketalk.threadpool import ThreadPool
 
 
 def test_once():
@@ -99,3 +101,21 @@ def test_recurring_subprocess():
         file.seek(0)
         assert file.readline() == "3"
         assert test_dict == {}  # We expect the dict to not have been changed.
+
+
+def test_threadpool_priority():
+    # One of the workers will be occupied by the scheduler itself
+    pool = ThreadPool(num_workers=2)
+    pool.start()
+    pool.start_scheduler_thread(trigger_period=0.1)
+    try:
+        # The scheduled jobs run in the threadpool, according to their priority.
+        with mock.patch.object(pool, "add_task", wraps=pool.add_task) as add_task:
+            schedule.once().do(print, "low")
+            schedule.once().do(print, "high").tag(Priority.HIGH)
+            time.sleep(0.5)
+        priorities = sorted(call.kwargs["priority"] for call in add_task.call_args_list)
+        assert priorities == [Priority.HIGH, Priority.LOW]
+    finally:
+        schedule.clear()
+        pool.stop()
@@ -0,0 +1,130 @@
+import asyncio
+import threading
+import time
+
+from snaketalk.singleflight import SingleFlight
+
+from .driver_test import create_driver, fake_server
+
+
+class TestSingleFlight:
+    def test_threads(self):
+        flight = SingleFlight()
+        calls = []
+
+        def fetch():
+            calls.append(1)
+            time.sleep(0.1)
+            return {"id": "a"}
+
+        results = []
+        threads = [
+            threading.Thread(
+                target=lambda: results.append(flight.do("/users", ("a",), fetch))
+            )
+            for _ in range(5)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        assert len(calls) == 1
+        assert results == [{"id": "a"}] * 5
+        assert flight.get_stats() == {"/users": {"requests": 1, "deduplicated": 4}}
+
+        # Once landed, the next call sends a new request
+        flight.do("/users", ("a",), fetch)
+        assert len(calls) == 2
+
+    def test_different_keys(self):
+        flight = SingleFlight()
+
+        async def fetch():
+            await asyncio.sleep(0.05)
+            return "result"
+
+        async def run():
+            return await asyncio.gather(
+                *[flight.do_async("/channels", (str(i % 2),), fetch) for i in range(4)]
+            )
+
+        assert asyncio.run(run()) == ["result"] * 4
+        assert flight.get_stats()["/channels"] == {"requests": 2, "deduplicated": 2}
+
+    def test_exception(self):
+        flight = SingleFlight()
+
+        async def fetch():
+            await asyncio.sleep(0.05)
+            raise ValueError("Not found")
+
+        async def run():
+            return await asyncio.gather(
+                *[flight.do_async("/users", ("a",), fetch) for _ in range(3)],
+                return_exceptions=True,
+            )
+
+        results = asyncio.run(run())
+        assert all(isinstance(result, ValueError) for result in results)
+        assert flight._flights == {}
+
+    def test_threads_and_coroutines(self):
+        flight = SingleFlight()
+
+        def fetch():
+            time.sleep(0.1)
+            return "result"
+
+        async def run():
+            loop = asyncio.get_running_loop()
+            # A thread starts the request, the coroutine waits for it
+            thread = loop.run_in_executor(None, flight.do, "/users", ("a",), fetch)
+            await asyncio.sleep(0.02)
+            return await asyncio.gather(
+                thread, flight.do_async("/users", ("a",), asyncio.sleep)
+            )
+
+        assert asyncio.run(run()) == ["result", "result"]
+        assert flight.get_stats()["/users"] == {"requests": 1, "deduplicated": 1}
+
+    def test_sync_call_from_event_loop(self):
+        flight = SingleFlight()
+
+        async def fetch_async():
+            await asyncio.sleep(0.1)
+            return "async"
+
+        async def fetch():
+            # A coroutine that uses the blocking version by mistake
+            return flight.do("/users", ("a",), lambda: "sync")
+
+        async def run():
+            return await asyncio.wait_for(
+                asyncio.gather(flight.do_async("/users", ("a",), fetch_async), fetch()),
+                timeout=2,
+            )
+
+        # The blocking call doesn't wait for (and deadlock) the coroutine's flight
+        assert asyncio.run(run()) == ["async", "sync"]
+        assert flight.get_stats()["/users"] == {"requests": 2, "deduplicated": 0}
+
+
+class TestDriverSingleFlight:
+    def test_get_thread_async(self):
+        driver = create_driver(port=3291)
+
+        async def run():
+            async with fake_server(3291) as requests:
+                threads = await asyncio.gather(
+                    *[driver.get_thread_async("a") for _ in range(5)]
+                )
+                await driver.async_client.close()
+            return threads, requests
+
+        threads, requests = asyncio.run(run())
+        assert len(requests) == 1
+        assert all(thread["order"] == ["a", "b"] for thread in threads)
+        assert driver.single_flight.get_stats() == {
+            "/posts/{post_id}/thread": {"requests": 1, "deduplicated": 4}
+        }
@@ -0,0 +1,99 @@
+import asyncio
+import logging
+
+import pytest
+
+from snaketalk import Plugin, listen_to
+from snaketalk.driver import Driver
+from snaketalk.supervisor import TaskSupervisor
+
+from .event_handler_test import create_message
+
+
+class TestTaskSupervisor:
+    def test_backpressure(self):
+        supervisor = TaskSupervisor(max_tasks=2)
+        release = None
+
+        async def handler():
+            await release.wait()
+
+        async def run():
+            nonlocal release
+            release = asyncio.Event()
+            await supervisor.spawn(handler(), name="handler")
+            await supervisor.spawn(handler(), name="handler")
+            assert supervisor.get_in_flight() == {"handler": 2}
+
+            # The third one has to wait until a slot is freed
+            third = asyncio.create_task(supervisor.spawn(handler(), name="other"))
+            await asyncio.sleep(0.05)
+            assert not third.done()
+            assert supervisor.in_flight == 2
+
+            release.set()
+            await third
+            await supervisor.join()
+            assert supervisor.in_flight == 0
+
+        asyncio.run(run())
+        assert supervisor.started == 3
+
+    def test_exceptions(self, caplog):
+        supervisor = TaskSupervisor()
+
+        async def fail():
+            raise ValueError("Oops")
+
+        async def run():
+            await supervisor.spawn(fail(), name="MyPlugin.fail")
+            await supervisor.join()
+
+        with caplog.at_level(logging.ERROR):
+            asyncio.run(run())
+        assert supervisor.failures == {"MyPlugin.fail": 1}
+        assert "MyPlugin.fail" in caplog.text
+        assert "Oops" in caplog.text
+
+    def test_threadpool_exceptions(self, caplog):
+        class FailingPlugin(Plugin):
+            @listen_to("fail")
+            def fail(self, message):
+                raise ValueError("Oops")
+
+        driver = Driver()
+        plugin = FailingPlugin().initialize(driver)
+        supervisor = TaskSupervisor()
+
+        async def run():
+            await supervisor.spawn(
+                plugin.call_function(FailingPlugin.fail, create_message(text="fail")),
+                name="FailingPlugin.fail",
+            )
+            await supervisor.join()
+
+        driver.threadpool.start()
+        try:
+            with caplog.at_level(logging.ERROR):
+                asyncio.run(run())
+        finally:
+            driver.threadpool.stop()
+        # The threadpool reports the exception, so the supervisor doesn't
+        assert list(driver.threadpool.get_failures().values()) == [1]
+        assert supervisor.failures == {}
+        assert caplog.text.count("Traceback") == 1
+
+    def test_cancelled_waiter(self):
+        supervisor = TaskSupervisor(max_tasks=1)
+
+        async def run():
+            await supervisor.spawn(asyncio.sleep(10), name="sleep")
+            waiting = asyncio.create_task(supervisor.spawn(asyncio.sleep(0), "other"))
+            await asyncio.sleep(0.01)
+            waiting.cancel()
+            with pytest.raises(asyncio.CancelledError):
+                await waiting
+            assert len(supervisor._waiters) == 0
+            assert supervisor.get_in_flight() == {"sleep": 1}
+
+        asyncio.run(run())
@@ -1,8 +1,11 @@
+import asyncio
 import time
 
 import pytest
 
 from snaketalk.driver import ThreadPool
+from snaketalk.threadpool import PriorityLanes, TaskFuture
+from snaketalk.utils import Priority
 
 
 @pytest.fixture(scope="function")
@@ -31,3 +34,119 @@ class TestThreadPool:
         assert threadpool.get_busy_workers() == 0
         threadpool.stop()
         assert not threadpool.alive
+
+    def test_add_task_future(self, threadpool):
+        def add(a, b):
+            time.sleep(0.1)
+            return a + b
+
+        def fail():
+            raise ValueError("Oops")
+
+        threadpool.start()
+        future = threadpool.add_task(add, 1, 2)
+        assert future.result(timeout=1) == 3
+        assert future.function is add
+        assert future.wait_time >= 0
+        assert future.run_time >= 0.1
+        assert future.total_time >= future.run_time
+
+        # The future can be awaited from an event loop, including exceptions
+        async def await_tasks():
+            assert await threadpool.add_task(add, 3, 4) == 7
+            with pytest.raises(ValueError, match="Oops"):
+                await threadpool.add_task(fail)
+
+        asyncio.run(await_tasks())
+
+    def test_failing_tasks(self, threadpool):
+        def fail():
+            raise ValueError("Oops")
+
+        def exit_thread():
+            raise SystemExit()
+
+        threadpool.start()
+        futures = [threadpool.add_task(fail) for _ in range(20)]
+        futures.append(threadpool.add_task(exit_thread))
+        for future in futures:
+            assert isinstance(future.exception(timeout=1), (ValueError, SystemExit))
+        time.sleep(0.1)
+
+        # Failed tasks are counted, and no capacity is lost
+        assert threadpool.get_failures() == {
+            fail.__qualname__: 20,
+            exit_thread.__qualname__: 1,
+        }
+        assert threadpool.get_busy_workers() == 0
+        assert sum(thread.is_alive() for thread in threadpool._threads) == 10
+        assert threadpool.add_task(sum, [1, 2]).result(timeout=1) == 3
+
+    def test_autoscaling(self):
+        pool = ThreadPool(
+            num_workers=2, max_workers=6, scale_up_threshold=0.01, idle_timeout=0.5
+        )
+        pool.start()
+        try:
+            assert pool.get_num_workers() == 2
+            futures = [pool.add_task(time.sleep, 0.5) for _ in range(6)]
+            time.sleep(0.3)
+            # Tasks had to wait, so the pool should have grown to its maximum
+            assert pool.get_num_workers() == 6
+            assert pool.get_busy_workers() == 6
+            for future in futures:
+                future.result(timeout=2)
+
+            # The extra workers stop once they've been idle for too long
+            time.sleep(1.2)
+            assert pool.get_num_workers() == 2
+            assert sum(thread.is_alive() for thread in pool._threads) == 2
+        finally:
+            pool.stop()
+        assert pool.get_num_workers() == 0
+
+    def test_resize(self, threadpool):
+        threadpool.start()
+        threadpool.resize(num_workers=12)
+        assert threadpool.get_num_workers() == 12
+
+        threadpool.resize(num_workers=3, max_workers=4)
+        assert threadpool.add_task(sum, [1, 2]).result(timeout=1) == 3
+        time.sleep(0.1)
+        assert threadpool.get_num_workers() == 4
+        assert sum(thread.is_alive() for thread in threadpool._threads) == 4
+        assert threadpool.elastic
+
+    def test_priorities(self):
+        pool = ThreadPool(num_workers=1)
+        pool.start()
+        order = []
+        blocker = pool.add_task(time.sleep, 0.2)
+        futures = [
+            pool.add_task(order.append, priority, priority=priority)
+            for priority in [Priority.LOW, Priority.NORMAL, Priority.HIGH]
+        ]
+        futures.append(pool.add_task(order.append, "default"))
+        for future in [blocker] + futures:
+            future.result(timeout=1)
+        pool.stop()
+        # The worker was busy, so the queued tasks run in order of priority.
+        assert order == [Priority.HIGH, Priority.NORMAL, "default", Priority.LOW]
+
+
+class TestPriorityLanes:
+    def test_starvation(self):
+        lanes = PriorityLanes(starvation_timeout=0.1)
+        for priority in [Priority.LOW, Priority.HIGH, Priority.NORMAL]:
+            lanes.put((priority, (), TaskFuture(print, priority)))
+        assert lanes.get()[0] == Priority.HIGH
+
+        # Once the remaining tasks have waited too long, the oldest goes first
+        lanes.put((Priority.HIGH, (), TaskFuture(print, Priority.HIGH)))
+        time.sleep(0.1)
+        assert [lanes.get()[0] for _ in range(3)] == [
+            Priority.LOW,
+            Priority.NORMAL,
+            Priority.HIGH,
+        ]
+        assert lanes.empty()
@@ -0,0 +1,90 @@
+import asyncio
+import threading
+
+from snaketalk.uploads import ProgressReader
+
+from .driver_test import create_driver, fake_server
+
+
+def create_files(tmp_path, num_files=3):
+    paths = []
+    for i in range(num_files):
+        path = tmp_path / f"file_{i}.txt"
+        path.write_text(f"Contents of file {i}" * (i + 1))
+        paths.append(path)
+    return paths
+
+
+class TestProgressReader:
+    def test_progress(self, tmp_path):
+        (path,) = create_files(tmp_path, 1)
+        updates = []
+        with path.open("rb") as file:
+            reader = ProgressReader(
+                file, path.name, lambda progress: updates.append(progress.sent)
+            )
+            assert len(reader) == 18
+            assert reader.read(10) == b"Contents o"
+            assert reader.read() == b"f file 0"
+            assert reader.progress.done
+            assert reader.progress.throughput > 0
+
+            # Retrying starts from scratch
+            reader.seek(0)
+            assert reader.progress.sent == 0
+        assert updates == [10, 18]
+
+
+class TestDriverUploads:
+    def test_upload_files(self, tmp_path):
+        driver = create_driver(port=3297)
+        paths = create_files(tmp_path)
+        updates = []
+        threads = set()
+
+        def progress(progress):
+            updates.append((progress.filename, progress.sent, progress.total))
+            threads.add(threading.get_ident())
+
+        async def run():
+            async with fake_server(3297) as requests:
+                file_ids = await asyncio.get_running_loop().run_in_executor(
+                    None,
+                    lambda: driver.upload_files(paths, "channel", progress=progress),
+                )
+            return file_ids, requests
+
+        file_ids, requests = asyncio.run(run())
+        assert file_ids == ["file_id"] * 3
+        # One request per file, streamed as raw body
+        assert sorted(body["data"] for _, _, body, _ in requests) == [
+            path.read_text() for path in paths
+        ]
+        assert all(body["channel_id"] == "channel" for _, _, body, _ in requests)
+        assert sorted(updates) == [
+            ("file_0.txt", 18, 18),
+            ("file_1.txt", 36, 36),
+            ("file_2.txt", 54, 54),
+        ]
+        # The files were uploaded in parallel
+        assert len(threads) > 1
+
+    def test_upload_files_async(self, tmp_path):
+        driver = create_driver(port=3298)
+        paths = create_files(tmp_path, 5)
+        updates = []
+
+        async def run():
+            async with fake_server(3298) as requests:
+                file_ids = await driver.upload_files_async(
+                    paths, "channel", max_concurrency=2, progress=updates.append
+                )
+                await driver.async_client.close()
+            return file_ids, requests
+
+        file_ids, requests = asyncio.run(run())
+        assert file_ids == ["file_id"] * 5
+        assert sorted(body["filename"] for _, _, body, _ in requests) == [
+            path.name for path in paths
+        ]
+        assert all(progress.done for progress in updates)
@@ -0,0 +1,46 @@
+import asyncio
+import threading
+import time
+
+from snaketalk.utils import AsyncQueue
+
+
+class TestAsyncQueue:
+    def test_get_async(self):
+        q = AsyncQueue()
+
+        def put_later():
+            time.sleep(0.2)
+            q.put("from another thread")
+
+        async def get():
+            # Items that are already there are returned immediately
+            q.put("first")
+            assert await q.get_async() == "first"
+
+            threading.Thread(target=put_later).start()
+            start = time.process_time()
+            item = await asyncio.wait_for(q.get_async(), timeout=1)
+            # Waiting for the item shouldn't cost any noticeable CPU time
+            assert time.process_time() - start < 0.1
+            return item
+
+        assert asyncio.run(get()) == "from another thread"
+        assert q.empty()
+
+    def test_cancel(self):
+        q = AsyncQueue()
+
+        async def get():
+            with_timeout = asyncio.wait_for(q.get_async(), timeout=0.1)
+            try:
+                await with_timeout
+            except asyncio.TimeoutError:
+                pass
+            # The cancelled waiter should not stay registered
+            assert len(q._async_waiters) == 0
+
+        asyncio.run(get())
+        # The regular Queue interface keeps working
+        q.put(1)
+        assert q.get(timeout=1) == 1
@@ -37,6 +37,55 @@ class TestWebHookServer:
         threadpool.stop()
         assert not server.running
 
+    def test_single_loop(self):
+        # Run the server on the current event loop, so no threads are involved at all.
+        server = WebHookServer(port=3282, url=Settings().WEBHOOK_HOST_URL)
+
+        async def respond_to_events():
+            while True:
+                event = await server.event_queue.get_async()
+                # Called from the server loop, so the request is resolved directly
+                server.respond(event.request_id, {"text": event.text})
+
+        async def run():
+            await server.start()
+            assert server.loop is asyncio.get_running_loop()
+            responder = asyncio.create_task(respond_to_events())
+            async with ClientSession() as session:
+                response = await session.post(
+                    f"{server.url}:{server.port}/hooks/test_hook",
+                    json={"text": "Hello!"},
+                    timeout=1,
+                )
+                result = await response.json()
+            responder.cancel()
+            await server.stop()
+            return result
+
+        assert asyncio.run(run()) == {"text": "Hello!"}
+        assert not server.running
+        assert server.response_handlers == {}
+
+    def test_admission_check(self):
+        server = WebHookServer(
+            port=3285, url=Settings().WEBHOOK_HOST_URL, admission_check=lambda: False
+        )
+
+        async def run():
+            await server.start()
+            async with ClientSession() as session:
+                response = await session.post(
+                    f"{server.url}:{server.port}/hooks/test_hook",
+                    json={"text": "Hello!"},
+                    timeout=1,
+                )
+            await server.stop()
+            return response.status
+
+        # The webhook is rejected before it reaches the event queue
+        assert asyncio.run(run()) == 503
+        assert server.event_queue.empty()
+
     @pytest.mark.skip("Called from test_start since we can't parallellize this.")
     def test_obtain_response(self, server):
         assert server.response_handlers == {}